@@ -0,0 +1,344 @@
+#
+# HTTP session layer for the client-side app (main.py).
+#
+# One ApiClient holds a requests.Session, so every call to the web
+# service reuses a pooled keep-alive connection instead of paying a
+# new TCP+TLS handshake. It also applies default timeouts, retries
+# with exponential backoff on 429 and 5xx responses, and adds the
+# Authorization header for the active session.
+#
+# Responses may come back compressed (see shared/responses.py): the
+# client advertises gzip, and br when the brotli package is
+# installed, and requests undoes the Content-Encoding transparently
+# before .json() or .content see the body.
+#
+
+import requests
+
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+
+try:
+  import brotli
+  accept_encoding = "br, gzip"
+except ImportError:
+  accept_encoding = "gzip"
+
+
+_record_types = {}
+
+
+def record_type(typename, schema):
+  """
+  Returns the namedtuple class for records with the given schema,
+  creating it on first use
+
+  Parameters
+  ----------
+  typename: name for the class, e.g. "User"
+  schema: column names, in order
+
+  Returns
+  -------
+  namedtuple class
+  """
+
+  k = (typename, tuple(schema))
+  if k not in _record_types:
+    _record_types[k] = namedtuple(typename, schema)
+  return _record_types[k]
+
+
+def decode_records(body, typename):
+  """
+  Turns the data of a listing response into records, named by the
+  response's schema. Handles both the row and columnar layouts.
+
+  Parameters
+  ----------
+  body: parsed JSON body of a listing response
+  typename: name for the record class, e.g. "User"
+
+  Returns
+  -------
+  list of namedtuple records
+  """
+
+  cls = record_type(typename, body["schema"])
+
+  if body.get("layout") == "columnar":
+    return list(map(cls._make, zip(*body["data"])))
+
+  return list(map(cls._make, body["data"]))
+
+
+class ApiError(Exception):
+  """
+  Raised by iter_pages() when the web service returns an error,
+  carrying the url and response so the caller can report it
+  """
+
+  def __init__(self, url, res):
+    super().__init__("request failed with status code " +
+                     str(res.status_code))
+    self.url = url
+    self.res = res
+
+
+class _Retry(Retry):
+  """
+  Retry policy that only retries a POST when API Gateway throttled
+  it (429), since the request never reached the lambda. Any other
+  failed POST may already have inserted a like, comment or asset,
+  so it is not safe to send again.
+
+  POST stays out of allowed_methods, so urllib3 never re-sends one
+  after a read error (a read timeout, or a keep-alive connection
+  dropped mid-response); only this status check lets a 429 through.
+  """
+
+  def is_retry(self, method, status_code, has_retry_after=False):
+    if method and method.upper() == "POST":
+      if status_code != 429:
+        return False
+      if self.status_forcelist and status_code in self.status_forcelist:
+        return True
+      return bool(self.total and self.respect_retry_after_header and
+                  has_retry_after)
+    return super().is_retry(method, status_code, has_retry_after)
+
+
+class ApiClient:
+
+  def __init__(self, baseurl, token_source=None, timeout=30.0,
+               connect_timeout=5.0, retries=3, backoff=0.5, pool_size=10):
+    """
+    Parameters
+    ----------
+    baseurl: baseurl for web service, without a trailing /
+    token_source: function returning the active session's token,
+      or None if there is no active session
+    timeout: seconds to wait for a response
+    connect_timeout: seconds to wait for a connection
+    retries: how many times to retry a failed request
+    backoff: base of the exponential backoff between retries, in
+      seconds (0.5 => 0.5s, 1s, 2s, ...)
+    pool_size: keep-alive connections to hold per host
+    """
+
+    self.baseurl = baseurl
+    self.token_source = token_source
+
+    parts = urlsplit(baseurl)
+    self.origin = (parts.scheme.lower(), parts.netloc.lower())
+    self.timeout = (connect_timeout, timeout)
+
+    retry = _Retry(total=retries,
+                   backoff_factor=backoff,
+                   status_forcelist=[429, 500, 502, 503, 504],
+                   allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                   respect_retry_after_header=True,
+                   raise_on_status=False)
+
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+
+    self.session = requests.Session()
+    self.session.headers["Accept-Encoding"] = accept_encoding
+    self.session.mount("https://", adapter)
+    self.session.mount("http://", adapter)
+
+    #
+    # uploads to presigned S3 urls are never retried: on a retry
+    # urllib3 would re-send a file object it has already read to
+    # the end, storing a truncated or empty object with a 200:
+    #
+    upload_adapter = HTTPAdapter(pool_connections=pool_size,
+                                 pool_maxsize=pool_size,
+                                 max_retries=0)
+
+    self.upload_session = requests.Session()
+    self.upload_session.mount("https://", upload_adapter)
+    self.upload_session.mount("http://", upload_adapter)
+
+  def request(self, method, url, **kwargs):
+    """
+    Sends a request through the pooled session
+
+    Parameters
+    ----------
+    method: HTTP method, e.g. "GET"
+    url: full url, or a path like "/final_users" that is appended
+      to the baseurl
+    kwargs: passed on to requests (params, json, data, headers,
+      stream, ...)
+
+    Returns
+    -------
+    requests Response
+    """
+
+    if url.startswith("/"):
+      url = self.baseurl + url
+
+    kwargs.setdefault("timeout", self.timeout)
+
+    #
+    # only our own web service gets the token; presigned S3 urls
+    # carry their own signature and would be rejected. The scheme
+    # and host are compared, not the text, so a host that merely
+    # starts with ours (api.example.com.evil.net) gets nothing:
+    #
+    parts = urlsplit(url)
+    own = (parts.scheme.lower(), parts.netloc.lower()) == self.origin
+
+    if self.token_source is not None and own:
+      token = self.token_source()
+      if token is not None:
+        headers = dict(kwargs.get("headers") or {})
+        headers.setdefault("Authorization", "Bearer " + token)
+        kwargs["headers"] = headers
+
+    return self.session.request(method, url, **kwargs)
+
+  def get(self, url, **kwargs):
+    return self.request("GET", url, **kwargs)
+
+  def post(self, url, **kwargs):
+    return self.request("POST", url, **kwargs)
+
+  def put(self, url, **kwargs):
+    return self.request("PUT", url, **kwargs)
+
+  def delete(self, url, **kwargs):
+    return self.request("DELETE", url, **kwargs)
+
+  def upload(self, url, infile, headers=None):
+    """
+    PUTs an open file to a presigned S3 url, streaming it in chunks
+    so it is never held in memory. Sent once, without retries or the
+    Authorization header; a failed upload is reported by the status.
+
+    Parameters
+    ----------
+    url: the presigned url
+    infile: file opened in binary mode
+    headers: headers the url was signed with
+
+    Returns
+    -------
+    requests Response
+    """
+
+    return self.upload_session.put(url, data=infile, headers=headers,
+                                   timeout=self.timeout)
+
+  def iter_bodies(self, url, params=None):
+    """
+    Lazily walks a paginated listing, yielding each page's parsed
+    JSON body, for listings that return more than rows (e.g. the
+    feed's comments). The next page is only fetched when the caller
+    asks for it.
+
+    Parameters
+    ----------
+    url: full url or path of the listing, e.g. "/final_feed"
+    params: query string parameters for every page
+
+    Yields
+    ------
+    the body of each page in turn
+
+    Raises
+    ------
+    ApiError if any page fails
+    """
+
+    params = dict(params or {})
+
+    while True:
+      res = self.get(url, params=params)
+      if not res.ok:
+        raise ApiError(url, res)
+
+      body = res.json()
+
+      yield body
+
+      if not body.get("next"):
+        return
+      params["cursor"] = body["next"]
+
+  def iter_pages(self, url, typename, fields=None, limit=None,
+                 params=None):
+    """
+    Lazily walks a paginated listing, fetching the next page only
+    when the caller asks for it. Pages are requested in the
+    columnar layout and decoded into namedtuple records.
+
+    Parameters
+    ----------
+    url: full url or path of the listing, e.g. "/final_users"
+    typename: name for the record class, e.g. "User"
+    fields: column names to ask for, or None for the defaults
+    limit: rows per page, or None for the server default
+    params: extra query string parameters
+
+    Yields
+    ------
+    (records, more) for each page in turn, where more is True if
+    another page follows
+
+    Raises
+    ------
+    ApiError if any page fails
+    """
+
+    params = dict(params or {})
+    params["layout"] = "columnar"
+    if fields is not None:
+      params["fields"] = ",".join(fields)
+    if limit is not None:
+      params["limit"] = limit
+
+    for body in self.iter_bodies(url, params):
+      yield decode_records(body, typename), bool(body.get("next"))
+
+  def post_batches(self, url, name, items, batch_size=100):
+    """
+    Sends a list of items to a batch endpoint (e.g. /final_likebatch),
+    split into requests of at most batch_size items, and collects the
+    per-item results
+
+    Parameters
+    ----------
+    url: full url or path of the batch endpoint
+    name: body key the endpoint reads the items from, e.g. "assetids"
+    items: the items to send
+    batch_size: most items per request; the server's limit is 100
+
+    Returns
+    -------
+    list of result dictionaries, one per item, in order
+
+    Raises
+    ------
+    ApiError if any request fails
+    """
+
+    results = []
+
+    for i in range(0, len(items), batch_size):
+      res = self.post(url, json={name: items[i:i + batch_size]})
+      if not res.ok:
+        raise ApiError(url, res)
+      results.extend(res.json()["results"])
+
+    return results
+
+  def close(self):
+    self.session.close()
+    self.upload_session.close()
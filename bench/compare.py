@@ -0,0 +1,349 @@
+#
+# Baselines for the benchmarks, and regression reports against them.
+#
+# A run is the JSON written by a benchmark's --out (bench/handlers.py,
+# bench/loadtest.py): a "meta" section describing the run and a list
+# of "results", one per handler and case, each with
+#
+#   total_ms   -- summary (n, mean, p50, p95, p99, max) of the totals
+#   phases_ms  -- the same per phase, if the benchmark splits them
+#   samples_ms -- the individual timings behind each summary
+#
+# Baselines are runs kept in bench/baselines/<name>.json and checked
+# in, so the baseline a change is compared against is versioned with
+# the code it measured:
+#
+#   python bench/handlers.py ... --out run.json
+#   python bench/compare.py save run.json --name handlers
+#   ... change something ...
+#   python bench/handlers.py ... --out new.json
+#   python bench/compare.py check new.json --name handlers
+#
+# check compares p50, p95 and p99 of every total and phase present
+# in both runs. A change counts as a regression only if all of these
+# hold, so ordinary run-to-run noise does not trip it:
+#
+#   - it is larger than the threshold for that percentile
+#     (--threshold, default 10% for p50; p95 and p99 are noisier and
+#     get 2x and 3x that)
+#   - it is more than --min-ms in absolute terms, so a 0.02 ms phase
+#     doubling is not reported
+#   - with samples on both sides, a Mann-Whitney U test says the new
+#     timings are larger with p < --alpha
+#
+# Improvements are reported the same way. check exits with status 1
+# if anything regressed, so it can gate a CI job.
+#
+# Runs are only comparable if they measured the same thing: a
+# warning is printed when the two differ in fixture, iterations,
+# cold starts or host.
+#
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from stats import mann_whitney
+
+baseline_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "baselines")
+
+#
+# version of the baseline file layout, bumped if it changes:
+#
+baseline_format = 1
+
+#
+# percentiles compared, and how much noisier each is than the median:
+#
+percentiles = [("p50", 1), ("p95", 2), ("p99", 3)]
+
+#
+# meta fields that must match for two runs to be comparable:
+#
+comparable = ["manifest", "iterations", "cold", "host", "mix", "users"]
+
+
+def baseline_path(name):
+  return os.path.join(baseline_dir, name + ".json")
+
+
+def load(path):
+  with open(path) as f:
+    run = json.load(f)
+
+  if "results" not in run:
+    raise Exception(path + " is not a benchmark run")
+
+  return run
+
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                          cwd=os.path.dirname(baseline_dir),
+                          capture_output=True, text=True,
+                          check=True).stdout.strip()
+  except Exception:
+    return None
+
+
+def save(run_path, name):
+  """
+  Stores a run as the named baseline, replacing the previous one
+  (which stays in git history)
+
+  Parameters
+  ----------
+  run_path: JSON written by a benchmark
+  name: baseline name, e.g. "handlers"
+
+  Returns
+  -------
+  path of the baseline file
+  """
+
+  run = load(run_path)
+
+  run["baseline"] = {
+    "format": baseline_format,
+    "name": name,
+    "saved": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    "saved_at_commit": git_commit()
+  }
+
+  os.makedirs(baseline_dir, exist_ok=True)
+  path = baseline_path(name)
+  with open(path, "w") as f:
+    f.write(json.dumps(run, indent=2) + "\n")
+
+  return path
+
+
+def metrics(result):
+  """
+  Yields (metric, summary, samples) for a result's total and phases
+  """
+
+  samples = result.get("samples_ms") or {}
+
+  yield "total", result["total_ms"], samples.get("total")
+  for phase, summary in sorted((result.get("phases_ms") or {}).items()):
+    yield phase, summary, samples.get(phase)
+
+
+def compare(base, new, threshold, min_ms, alpha):
+  """
+  Compares every percentile of every metric present in both runs
+
+  Parameters
+  ----------
+  base: baseline run
+  new: new run
+  threshold: relative change that counts for the median, e.g. 0.10
+  min_ms: smallest absolute change that counts
+  alpha: significance level for the Mann-Whitney test
+
+  Returns
+  -------
+  (changes, added, removed): changes is a list of dictionaries, one
+  per handler/case/metric/percentile, with a "verdict" of
+  "regression", "improvement" or "same"; added and removed list the
+  (handler, case) pairs only in the new run or only in the baseline
+  """
+
+  def key(r):
+    return (r["handler"], r["case"])
+
+  base_results = {key(r): r for r in base["results"]}
+  new_results = {key(r): r for r in new["results"]}
+
+  changes = []
+
+  for k in base_results:
+    if k not in new_results:
+      continue
+
+    before = {m: (s, x) for m, s, x in metrics(base_results[k])}
+
+    for metric, summary, samples in metrics(new_results[k]):
+      if metric not in before:
+        continue
+      base_summary, base_samples = before[metric]
+
+      #
+      # whether the whole distribution moved, rather than a few
+      # outliers; without samples only the thresholds apply:
+      #
+      p_slower = p_faster = None
+      if base_samples and samples:
+        p_slower = mann_whitney(base_samples, samples)
+        p_faster = mann_whitney(samples, base_samples)
+
+      for stat, noise in percentiles:
+        old = base_summary[stat]
+        value = summary[stat]
+        diff = value - old
+        change = diff / old if old > 0 else (0.0 if diff == 0 else float("inf"))
+
+        verdict = "same"
+        if abs(diff) > min_ms and abs(change) > threshold * noise:
+          if diff > 0 and (p_slower is None or p_slower < alpha):
+            verdict = "regression"
+          elif diff < 0 and (p_faster is None or p_faster < alpha):
+            verdict = "improvement"
+
+        changes.append({
+          "handler": k[0],
+          "case": k[1],
+          "metric": metric,
+          "stat": stat,
+          "baseline_ms": old,
+          "new_ms": value,
+          "change": round(change, 4) if change != float("inf") else None,
+          "p_value": p_slower if diff >= 0 else p_faster,
+          "verdict": verdict
+        })
+
+  added = [k for k in new_results if k not in base_results]
+  removed = [k for k in base_results if k not in new_results]
+
+  return changes, added, removed
+
+
+def mismatches(base, new):
+  """
+  Lists the meta fields that differ between two runs, among those
+  that make timings incomparable
+  """
+
+  b = base.get("meta", {})
+  n = new.get("meta", {})
+
+  return [f for f in comparable if f in b and f in n and b[f] != n[f]]
+
+
+def report(base, new, changes, added, removed, differ, verbose):
+  """
+  Prints the regression report
+  """
+
+  b = base.get("meta", {})
+  n = new.get("meta", {})
+
+  print(f"baseline: commit {b.get('commit')}, {b.get('time')}, "
+        f"{b.get('host')}")
+  print(f"new:      commit {n.get('commit')}, {n.get('time')}, "
+        f"{n.get('host')}")
+
+  for field in differ:
+    print(f"warning: runs differ in {field} "
+          f"({json.dumps(b[field])} vs {json.dumps(n[field])}), "
+          f"timings may not be comparable")
+  print()
+
+  def line(c):
+    change = "new" if c["change"] is None else f"{c['change'] * 100:+.1f}%"
+    p = "" if c["p_value"] is None else f"  p={c['p_value']:.3g}"
+    return (f"  {c['handler']} {c['case']}: {c['metric']} {c['stat']} "
+            f"{c['baseline_ms']:.3f} -> {c['new_ms']:.3f} ms  {change}{p}")
+
+  for verdict, title in [("regression", "REGRESSIONS"),
+                         ("improvement", "improvements")]:
+    found = [c for c in changes if c["verdict"] == verdict]
+    found.sort(key=lambda c: -abs(c["change"] if c["change"] is not None
+                                  else float("inf")))
+    if found:
+      print(f"{title} ({len(found)}):")
+      for c in found:
+        print(line(c))
+      print()
+
+  if verbose:
+    same = [c for c in changes if c["verdict"] == "same"]
+    if same:
+      print(f"within noise ({len(same)}):")
+      for c in same:
+        print(line(c))
+      print()
+
+  for k in added:
+    print(f"new case, no baseline: {k[0]} {k[1]}")
+  for k in removed:
+    print(f"missing from new run: {k[0]} {k[1]}")
+  if added or removed:
+    print()
+
+  regressions = sum(1 for c in changes if c["verdict"] == "regression")
+  improvements = sum(1 for c in changes if c["verdict"] == "improvement")
+  cases = len(set((c["handler"], c["case"]) for c in changes))
+
+  print(f"{cases} cases compared: {regressions} regressions, "
+        f"{improvements} improvements")
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Benchmark baselines and regression reports")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  p = commands.add_parser("save", help="store a run as a baseline")
+  p.add_argument("run", help="JSON written by a benchmark's --out")
+  p.add_argument("--name", required=True,
+                 help="baseline name, e.g. handlers or loadtest")
+
+  p = commands.add_parser("check", help="compare a run with a baseline")
+  p.add_argument("run", help="JSON written by a benchmark's --out")
+  group = p.add_mutually_exclusive_group(required=True)
+  group.add_argument("--name", help="baseline name in bench/baselines")
+  group.add_argument("--baseline", help="path of any earlier run")
+  p.add_argument("--threshold", type=float, default=0.10,
+                 help="relative change that counts, for p50 (default 0.10)")
+  p.add_argument("--min-ms", type=float, default=0.5,
+                 help="smallest absolute change that counts (default 0.5)")
+  p.add_argument("--alpha", type=float, default=0.01,
+                 help="significance level of the Mann-Whitney test")
+  p.add_argument("--verbose", action="store_true",
+                 help="also list the changes within noise")
+  p.add_argument("--json", action="store_true",
+                 help="print the comparison as JSON instead")
+
+  args = parser.parse_args()
+
+  if args.command == "save":
+    path = save(args.run, args.name)
+    print("saved", path)
+    return 0
+
+  base_path = args.baseline or baseline_path(args.name)
+  if not os.path.exists(base_path):
+    print("no baseline at", base_path, file=sys.stderr)
+    return 2
+
+  base = load(base_path)
+  new = load(args.run)
+
+  changes, added, removed = compare(base, new, args.threshold, args.min_ms,
+                                    args.alpha)
+  differ = mismatches(base, new)
+
+  if args.json:
+    print(json.dumps({"baseline": base.get("meta"),
+                      "new": new.get("meta"),
+                      "incomparable": differ,
+                      "added": added,
+                      "removed": removed,
+                      "changes": changes}, indent=2))
+  else:
+    report(base, new, changes, added, removed, differ, args.verbose)
+
+  if any(c["verdict"] == "regression" for c in changes):
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
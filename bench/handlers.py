@@ -0,0 +1,342 @@
+#
+# Phase-timing benchmark of the lambda handlers.
+#
+# Calls each handler's lambda_handler directly, in this process, with
+# synthetic API Gateway events, against the database and bucket in
+# the given config file: a local MySQL filled by tools/seed.py and a
+# local S3 stand-in, never the real ones. Every invocation is split
+# into the phases shared/metrics.py records for it, the same ones
+# the deployed handlers emit, and for each case the per-invocation
+# time of each phase is reported as p50/p95/p99:
+#
+#   config        runtime.get_config (parsing config.ini)
+#   connect       opening the database connection
+#   s3_setup      boto3 session and bucket setup
+#   sql ...       each SQL statement, by verb and table (sql SELECT assets)
+#   s3            S3 API calls, uploads and reading object bodies
+#   base64        encoding and decoding image data
+#   tmp_io        reading and writing files under /tmp
+#   serialize     building the JSON response body
+#   other         the rest of the handler
+#
+# Phase times are exclusive: time inside get_dbConn that is spent
+# parsing the config counts under config only.
+#
+#   python tools/seed.py --config local.ini --reset --manifest fixture.json
+#   python bench/handlers.py --config local.ini --manifest fixture.json \
+#     --out results.json
+#   python bench/handlers.py --config local.ini --manifest fixture.json \
+#     --handlers final_download --sizes 10000 1000000 --iterations 50
+#
+# final_uploadimage and final_download run once per payload size
+# (--sizes, bytes); final_users, final_getcomments and final_getlikes
+# once per result-set size (--rows). With --cold the per-container
+# caches in runtime are dropped before every invocation, so the
+# config, s3_setup and connect phases are paid every time.
+#
+# The JSON written by --out is what bench/compare.py reads; it keeps
+# every invocation's timings (samples_ms) as well as the summaries, so
+# a comparison can test whether a change is more than noise.
+#
+
+import argparse
+import base64
+import contextlib
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, "shared"))
+sys.path.insert(0, repo_root)
+
+import metrics
+import runtime
+
+from stats import summarize
+
+
+##################################################################
+#
+# runtime
+#
+
+def reset_runtime():
+  """
+  Drops the per-container caches, as a cold start would
+  """
+
+  runtime.close_dbConn()
+  runtime._configur = None
+  runtime._sessions.clear()
+  runtime._buckets.clear()
+
+
+##################################################################
+#
+# cases
+#
+
+def event(userid=None, path=None, query=None, body=None):
+  """
+  Builds a proxy event like the one API Gateway sends
+
+  Parameters
+  ----------
+  userid: the caller, put into the body as the deployed API does
+  path: pathParameters
+  query: queryStringParameters
+  body: other body fields
+
+  Returns
+  -------
+  the event
+  """
+
+  payload = dict(body or {})
+  if userid is not None:
+    payload["userid"] = userid
+
+  return {
+    "httpMethod": "GET",
+    "headers": {},
+    "pathParameters": path,
+    "queryStringParameters": query,
+    "body": json.dumps(payload)
+  }
+
+
+def payload(size):
+  """
+  Returns size bytes of JPEG-ish data (content doesn't matter to the
+  handlers, only the size)
+  """
+
+  return (b"\xff\xd8\xff\xe0" + os.urandom(max(0, size - 6)) + b"\xff\xd9")[:size]
+
+
+def build_cases(manifest, handlers, sizes, rows):
+  """
+  Works out which cases to run
+
+  Parameters
+  ----------
+  manifest: the fixture description written by tools/seed.py
+  handlers: handler names to include
+  sizes: payload sizes for upload/download, in bytes
+  rows: result-set sizes for the listings
+
+  Returns
+  -------
+  list of (handler, case name, params, function returning an event);
+  a download case's event needs the asset uploaded by the matching
+  upload case, so the function takes the results so far
+  """
+
+  hot = manifest["hot_assets"][0]
+  public_hot = next((a for a in manifest["hot_assets"] if a["public"]), hot)
+  userid = hot["userid"]
+  assetid = hot["assetid"]
+
+  cases = []
+
+  def add(handler, name, params, make):
+    if handler in handlers:
+      cases.append((handler, name, params, make))
+
+  for n in rows:
+    add("final_users", f"rows={n}", {"rows": n},
+        lambda ctx, n=n: event(query={"limit": str(n)}))
+    add("final_getcomments", f"rows={n}", {"rows": n},
+        lambda ctx, n=n: event(userid, {"assetid": str(assetid)},
+                               {"limit": str(n)}))
+    add("final_getlikes", f"rows={n}", {"rows": n},
+        lambda ctx, n=n: event(userid, {"assetid": str(assetid)},
+                               {"limit": str(n)}))
+
+  add("final_assets", "rows=100", {"rows": 100},
+      lambda ctx: event(userid, query={"limit": "100"}))
+  add("final_feed", "rows=25", {"rows": 25},
+      lambda ctx: event(userid, query={"limit": "25"}))
+  add("final_counts", "assets=10", {"assets": 10},
+      lambda ctx: event(userid, query={
+        "assetids": ",".join(str(a["assetid"]) for a in manifest["hot_assets"]),
+        "comments": "3"}))
+  add("final_like", "hot asset", {},
+      lambda ctx: event(public_hot["userid"],
+                        {"assetid": str(public_hot["assetid"])}))
+  add("final_comment", "hot asset", {},
+      lambda ctx: event(public_hot["userid"],
+                        {"assetid": str(public_hot["assetid"])},
+                        body={"comment": "benchmark comment"}))
+
+  for size in sizes:
+    data = base64.b64encode(payload(size)).decode()
+    add("final_uploadimage", f"bytes={size}", {"bytes": size},
+        lambda ctx, data=data: event(path={"userid": str(userid)},
+                                     body={"assetname": "bench.jpg",
+                                           "assettype": "public",
+                                           "data": data}))
+    add("final_download", f"bytes={size}", {"bytes": size},
+        lambda ctx, size=size: event(userid, {"assetid": str(ctx[size])}))
+
+  return cases
+
+
+def run_case(handler_fn, make_event, ctx, iterations, cold):
+  """
+  Runs one case, taking every invocation's timings from the record
+  metrics.instrument keeps for it
+
+  Returns
+  -------
+  (list of per-invocation phase dictionaries, totals in ms,
+  status counts, last response)
+  """
+
+  phases = []
+  totals = []
+  statuses = {}
+  response = None
+
+  with open(os.devnull, "w") as devnull:
+    for i in range(iterations):
+      ev = make_event(ctx)
+      if cold:
+        reset_runtime()
+
+      # the EMF line each invocation prints goes to devnull too:
+      with contextlib.redirect_stdout(devnull):
+        response = handler_fn(ev, None)
+
+      recorded = metrics.last_invocation()
+      phases.append(recorded["spans"])
+      totals.append(recorded["duration"])
+
+      status = str(response.get("statusCode"))
+      statuses[status] = statuses.get(status, 0) + 1
+
+  return phases, totals, statuses, response
+
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                          cwd=repo_root, capture_output=True, text=True,
+                          check=True).stdout.strip()
+  except Exception:
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Phase timings of each lambda handler")
+  parser.add_argument("--config", default="config.ini",
+                      help="config file with the [rds] and [s3] sections")
+  parser.add_argument("--manifest", required=True,
+                      help="fixture description written by tools/seed.py")
+  parser.add_argument("--handlers", nargs="+", default=None,
+                      help="handlers to run (default: all with cases)")
+  parser.add_argument("--iterations", type=int, default=30)
+  parser.add_argument("--warmup", type=int, default=3,
+                      help="untimed invocations before each case")
+  parser.add_argument("--sizes", type=int, nargs="+",
+                      default=[10000, 100000, 1000000],
+                      help="payload sizes for upload/download, in bytes")
+  parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000],
+                      help="result-set sizes for the listings")
+  parser.add_argument("--cold", action="store_true",
+                      help="drop runtime's caches before every invocation")
+  parser.add_argument("--out", default=None,
+                      help="write the results as JSON here")
+  args = parser.parse_args()
+
+  with open(args.manifest) as f:
+    manifest = json.load(f)
+
+  runtime.config_file = args.config
+
+  all_handlers = ["final_users", "final_assets", "final_feed", "final_counts",
+                  "final_getlikes", "final_getcomments", "final_like",
+                  "final_comment", "final_uploadimage", "final_download"]
+  handlers = args.handlers or all_handlers
+
+  # a download needs the matching upload, whether or not it's timed:
+  if "final_download" in handlers and "final_uploadimage" not in handlers:
+    handlers = handlers + ["final_uploadimage"]
+    untimed = {"final_uploadimage"}
+  else:
+    untimed = set()
+
+  cases = build_cases(manifest, handlers, args.sizes, args.rows)
+
+  ctx = {}  # payload size => assetid uploaded with it
+  results = []
+
+  for handler, name, params, make_event in cases:
+    fn = importlib.import_module(handler + ".lambda_function").lambda_handler
+
+    print(f"**{handler} {name}**", file=sys.stderr)
+
+    if args.warmup > 0 and handler not in untimed:
+      run_case(fn, make_event, ctx, args.warmup, False)
+
+    n = 1 if handler in untimed else args.iterations
+    phases, totals, statuses, response = run_case(fn, make_event, ctx, n,
+                                                  args.cold)
+
+    if handler == "final_uploadimage":
+      ctx[params["bytes"]] = json.loads(response["body"])["assetid"]
+    if handler in untimed:
+      continue
+
+    names = sorted(set(p for spent in phases for p in spent))
+    results.append({
+      "handler": handler,
+      "case": name,
+      "params": params,
+      "statuses": statuses,
+      "total_ms": summarize(totals),
+      "phases_ms": {p: summarize([spent.get(p, 0.0) for spent in phases])
+                    for p in names},
+      "samples_ms": dict(
+        [("total", [round(t, 3) for t in totals])] +
+        [(p, [round(spent.get(p, 0.0), 3) for spent in phases])
+         for p in names])
+    })
+
+    r = results[-1]
+    print(f"  total p50 {r['total_ms']['p50']:.2f} ms  "
+          f"p95 {r['total_ms']['p95']:.2f}  p99 {r['total_ms']['p99']:.2f}  "
+          f"status {statuses}", file=sys.stderr)
+
+  report = {
+    "meta": {
+      "commit": git_commit(),
+      "python": platform.python_version(),
+      "host": platform.node(),
+      "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+      "iterations": args.iterations,
+      "cold": args.cold,
+      "manifest": {"seed": manifest.get("seed"),
+                   "assets": manifest.get("assets"),
+                   "likes": manifest.get("likes"),
+                   "comments": manifest.get("comments")}
+    },
+    "results": results
+  }
+
+  text = json.dumps(report, indent=2)
+  if args.out:
+    with open(args.out, "w") as f:
+      f.write(text + "\n")
+  else:
+    print(text)
+
+
+if __name__ == "__main__":
+  main()
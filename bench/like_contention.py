@@ -0,0 +1,245 @@
+#
+# Like contention benchmark.
+#
+# Drives concurrent likes at a single asset through the real
+# final_like handler, against the database in the given config file
+# (use a local MySQL with the schema/ migrations applied, not RDS),
+# and reports throughput and latency for each counter layout:
+#
+#   python bench/like_contention.py --config local.ini
+#   python bench/like_contention.py --config local.ini --threads 32 \
+#     --seconds 20 --shards 1 4 16
+#
+# --shards 1 puts every like on one counter row, the same contention
+# as a single like_count column; larger values spread the likes over
+# that many slots. Between runs the slots are compacted, and after
+# each run the asset's like count is checked against the rows that
+# were inserted.
+#
+# Without --assetid a bench user and a public asset are created.
+#
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, "shared"))
+sys.path.insert(0, repo_root)
+
+import counters
+import datatier
+import runtime
+
+from stats import percentile
+
+
+def create_asset(dbConn):
+  """
+  Creates a bench user owning one public asset
+
+  Parameters
+  ----------
+  dbConn: database connection
+
+  Returns
+  -------
+  (userid, assetid)
+  """
+
+  tag = str(uuid.uuid4())
+
+  sql = """
+  INSERT INTO users (email, lastname, firstname, bucketfolder, username, pwdhash)
+              VALUES (%s, 'bench', 'bench', %s, %s, '');
+  """
+  q, userid = datatier.perform_insert(dbConn, sql,
+                                      [tag + "@bench", tag, "bench-" + tag])
+
+  sql = """
+  INSERT INTO assets (userid, assetname, bucketkey, assettype)
+              VALUES (%s, 'bench.jpg', %s, 'public');
+  """
+  q, assetid = datatier.perform_insert(dbConn, sql,
+                                       [userid, tag + "/bench.jpg"])
+
+  return userid, assetid
+
+
+def like_state(dbConn, assetid):
+  """
+  Returns the asset's like count and the # of like rows for it
+
+  Parameters
+  ----------
+  dbConn: database connection
+  assetid: asset being liked
+
+  Returns
+  -------
+  (like count, like rows)
+  """
+
+  sql = f"""
+  SELECT {counters.like_count_sql},
+         (SELECT COUNT(*) FROM likes WHERE likes.assetid = a.assetid)
+    FROM assets a WHERE a.assetid = %s;
+  """
+  row = datatier.retrieve_one_row(dbConn, sql, [assetid])
+  return int(row[0]), int(row[1])
+
+
+def worker(handler, userid, assetid, deadline, results):
+  """
+  Likes the asset over and over until the deadline, recording each
+  call's latency and status
+
+  Parameters
+  ----------
+  handler: final_like's lambda_handler
+  userid: user doing the liking
+  assetid: asset being liked
+  deadline: time.perf_counter() value to stop at
+  results: list to append (latency_ms, status, message) to
+
+  Returns
+  -------
+  nothing
+  """
+
+  event = {
+    "pathParameters": {"assetid": str(assetid)},
+    "body": json.dumps({"userid": userid})
+  }
+
+  mine = []
+  try:
+    while time.perf_counter() < deadline:
+      start = time.perf_counter()
+      response = handler(event, None)
+      ms = (time.perf_counter() - start) * 1000
+
+      status = response["statusCode"]
+      message = None
+      if status != 200:
+        message = json.loads(response["body"])["message"]
+      mine.append((ms, status, message))
+  finally:
+    runtime.release_dbConn()
+    results.extend(mine)
+
+
+def run(handler, compact, shards, threads, seconds, userid, assetid):
+  """
+  One timed run with the given number of counter slots
+
+  Returns
+  -------
+  dictionary of results
+  """
+
+  counters.like_shards = shards
+
+  dbConn = runtime.get_dbConn()
+  compact({"limit": 1000000}, None)
+  before_count, before_rows = like_state(dbConn, assetid)
+
+  results = []
+  deadline = time.perf_counter() + seconds
+
+  pool = [threading.Thread(target=worker,
+                           args=(handler, userid, assetid, deadline, results))
+          for i in range(threads)]
+
+  #
+  # the handlers print a lot; keep it out of the report:
+  #
+  with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    start = time.perf_counter()
+    for t in pool:
+      t.start()
+    for t in pool:
+      t.join()
+    elapsed = time.perf_counter() - start
+
+  dbConn = runtime.get_dbConn()
+  after_count, after_rows = like_state(dbConn, assetid)
+
+  ok = sorted(ms for (ms, status, message) in results if status == 200)
+  errors = {}
+  for (ms, status, message) in results:
+    if status != 200:
+      errors[message] = errors.get(message, 0) + 1
+
+  return {
+    "shards": shards,
+    "threads": threads,
+    "seconds": round(elapsed, 3),
+    "likes": len(ok),
+    "likes_per_sec": round(len(ok) / elapsed, 1),
+    "p50_ms": round(percentile(ok, 50), 3),
+    "p95_ms": round(percentile(ok, 95), 3),
+    "p99_ms": round(percentile(ok, 99), 3),
+    "errors": errors,
+    "consistent": after_count - before_count == after_rows - before_rows
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Concurrent likes on one asset, single vs sharded counter")
+  parser.add_argument("--config", default="config.ini",
+                      help="config file with the [rds] section to use")
+  parser.add_argument("--threads", type=int, default=16)
+  parser.add_argument("--seconds", type=float, default=10.0,
+                      help="length of each run")
+  parser.add_argument("--shards", type=int, nargs="+", default=[1, 16],
+                      help="counter slots per run; 1 = single counter")
+  parser.add_argument("--userid", type=int, default=None)
+  parser.add_argument("--assetid", type=int, default=None,
+                      help="public asset to like (default: create one)")
+  parser.add_argument("--json", action="store_true",
+                      help="write the results as JSON")
+  args = parser.parse_args()
+
+  runtime.config_file = args.config
+
+  handler = importlib.import_module("final_like.lambda_function").lambda_handler
+  compact = importlib.import_module(
+    "final_compactlikes.lambda_function").lambda_handler
+
+  userid, assetid = args.userid, args.assetid
+  if assetid is None:
+    userid, assetid = create_asset(runtime.get_dbConn())
+  elif userid is None:
+    parser.error("--assetid needs --userid")
+
+  results = []
+  for shards in args.shards:
+    results.append(run(handler, compact, shards, args.threads, args.seconds,
+                       userid, assetid))
+
+  if args.json:
+    print(json.dumps(results, indent=2))
+    return
+
+  print(f"asset {assetid}, {args.threads} threads, {args.seconds:g}s per run")
+  print()
+  print(f"{'shards':>6} {'likes/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'errors':>7}  consistent")
+  for r in results:
+    print(f"{r['shards']:>6} {r['likes_per_sec']:>9.1f} {r['p50_ms']:>8.2f} "
+          f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+          f"{sum(r['errors'].values()):>7}  {r['consistent']}")
+    for message, n in r["errors"].items():
+      print(f"{'':>8}{n} x {message}")
+
+
+if __name__ == "__main__":
+  main()
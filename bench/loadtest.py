@@ -0,0 +1,552 @@
+#
+# Load test of the web service, as many concurrent clients.
+#
+# Each virtual user is a thread with its own apiclient.ApiClient
+# (the same pooled, token-carrying session main.py uses) and its own
+# login. It loops over the commands main.py offers, picking each one
+# at random by weight from the mix, until the run is over:
+#
+#   login        POST /auth, a fresh token for the user
+#   get_assets   first page of /final_assets
+#   upload       reserve, PUT the image to S3, complete
+#   download     /final_download?mode=url, then GET the image from S3
+#   like         POST /final_like/<assetid>
+#   comment      POST /final_comment/<assetid>
+#   getlikes     the total (counts=1), then the first page of likes
+#   getcomments  the same for comments
+#
+# Assets to like, comment on and download are picked from those the
+# user has seen in a get_assets listing or uploaded itself, so they
+# are always visible to it.
+#
+# Against the local gateway (tools/gateway.py), with a fixture from
+# tools/seed.py, the virtual users log in as the seeded users:
+#
+#   python bench/loadtest.py --url http://localhost:8080 \
+#     --manifest fixture.json --users 32 --duration 60 --out load.json
+#
+# Against a deployed API, give real accounts instead, one
+# "username,password" per line:
+#
+#   python bench/loadtest.py --url https://....amazonaws.com \
+#     --credentials accounts.csv --users 8 \
+#     --mix get_assets=50,download=30,like=20
+#
+# Every HTTP request is timed, and reported per endpoint ("POST
+# /final_like", "S3 PUT", ...): throughput, error rate by status and
+# a latency histogram. Requests started during --ramp, while the
+# users are still starting up, are left out. The JSON written by --out
+# can be saved as a baseline and checked with bench/compare.py.
+#
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+
+import apiclient
+
+from stats import histogram, summarize
+
+default_mix = {
+  "login": 2,
+  "get_assets": 25,
+  "upload": 5,
+  "download": 20,
+  "like": 10,
+  "comment": 8,
+  "getlikes": 15,
+  "getcomments": 15,
+}
+
+#
+# latency histogram buckets, upper bounds in ms:
+#
+buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+page_size = 25
+
+
+##################################################################
+#
+# recording
+#
+
+class Recorder:
+  """
+  Collects (endpoint, start, ms, status) for every request, from
+  all the virtual users
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.requests = []
+
+  def add(self, endpoint, start, ms, status):
+    with self.lock:
+      self.requests.append((endpoint, start, ms, status))
+
+
+class TimedClient(apiclient.ApiClient):
+  """
+  ApiClient that records every request it sends
+  """
+
+  def __init__(self, baseurl, recorder, **kwargs):
+    super().__init__(baseurl, **kwargs)
+    self.recorder = recorder
+
+  def request(self, method, url, **kwargs):
+    endpoint = self.endpoint(method, url, kwargs.get("params"))
+
+    start = time.perf_counter()
+    status = "exception"
+    try:
+      res = super().request(method, url, **kwargs)
+      status = res.status_code
+      return res
+    finally:
+      ms = (time.perf_counter() - start) * 1000
+      self.recorder.add(endpoint, start, ms, status)
+
+  def endpoint(self, method, url, params):
+    """
+    Names the endpoint a request is for, e.g. "POST /final_like"
+    """
+
+    if url.startswith("/"):
+      url = self.baseurl + url
+
+    if not url.startswith(self.baseurl):
+      # a presigned url:
+      return "S3 " + method
+
+    path = urlsplit(url).path[len(urlsplit(self.baseurl).path):]
+    name = method + " /" + path.strip("/").split("/")[0]
+
+    if params and "counts" in params:
+      name += " counts"
+
+    return name
+
+
+##################################################################
+#
+# virtual users
+#
+
+class VirtualUser:
+
+  def __init__(self, baseurl, recorder, username, password, assets,
+               image, timeout, retries, rng):
+    """
+    Parameters
+    ----------
+    baseurl: baseurl for web service
+    recorder: Recorder for the requests
+    username, password: the account to log in as
+    assets: assetids known to be visible to everyone, to start from
+    image: bytes to upload
+    timeout: seconds to wait for a response
+    retries: how many times the client retries a failed request
+    rng: random.Random for this user
+    """
+
+    self.username = username
+    self.password = password
+    self.token = None
+    self.assets = list(assets)
+    self.image = image
+    self.rng = rng
+
+    self.client = TimedClient(baseurl, recorder,
+                              token_source=lambda: self.token,
+                              timeout=timeout,
+                              retries=retries,
+                              pool_size=2)
+
+    self.ops = {
+      "login": self.login,
+      "get_assets": self.get_assets,
+      "upload": self.upload,
+      "download": self.download,
+      "like": self.like,
+      "comment": self.comment,
+      "getlikes": self.getlikes,
+      "getcomments": self.getcomments,
+    }
+
+  def check(self, url, res):
+    if not res.ok:
+      raise apiclient.ApiError(url, res)
+    return res
+
+  def pick_asset(self):
+    if len(self.assets) == 0:
+      self.get_assets()
+    if len(self.assets) == 0:
+      raise Exception("no assets to pick from")
+    return self.rng.choice(self.assets)
+
+  def remember(self, assetids):
+    known = set(self.assets)
+    self.assets.extend(a for a in assetids if a not in known)
+
+  def login(self):
+    res = self.check("/auth", self.client.post("/auth", json={
+      "username": self.username, "password": self.password}))
+    self.token = res.json()["access_token"]
+
+  def get_assets(self):
+    pages = self.client.iter_pages("/final_assets", "Asset",
+                                   ["assetid", "userid"], limit=page_size)
+    try:
+      records, more = next(pages, ([], False))
+    finally:
+      pages.close()
+    self.remember(r.assetid for r in records)
+
+  def upload(self):
+    url = "/final_uploadimage"
+
+    body = self.check(url, self.client.post(url, json={
+      "action": "reserve",
+      "assetname": "load.jpg",
+      "assettype": "public"})).json()
+
+    self.check(body["url"], self.client.put(body["url"], data=self.image,
+                                            headers=body["headers"]))
+
+    self.check(url, self.client.post(url, json={
+      "action": "complete", "assetid": body["assetid"]}))
+
+    self.remember([body["assetid"]])
+
+  def download(self):
+    url = "/final_download/" + str(self.pick_asset())
+
+    body = self.check(url, self.client.get(url, params={"mode": "url"})).json()
+
+    self.check(body["url"], self.client.get(body["url"]))
+
+  def like(self):
+    url = "/final_like/" + str(self.pick_asset())
+    self.check(url, self.client.post(url))
+
+  def comment(self):
+    url = "/final_comment/" + str(self.pick_asset())
+    self.check(url, self.client.post(url, json={"comment": "load test"}))
+
+  def listing(self, route, typename, fields):
+    url = route + "/" + str(self.pick_asset())
+
+    self.check(url, self.client.get(url, params={"counts": 1}))
+
+    pages = self.client.iter_pages(url, typename, fields, limit=page_size)
+    try:
+      next(pages, None)
+    finally:
+      pages.close()
+
+  def getlikes(self):
+    self.listing("/final_getlikes", "Like", ["likeid", "userid"])
+
+  def getcomments(self):
+    self.listing("/final_getcomments", "Comment",
+                 ["commentid", "userid", "comment_body"])
+
+  def run(self, mix, start_at, stop_at, think_ms, failures):
+    """
+    Logs in, then runs commands from the mix until stop_at
+
+    Parameters
+    ----------
+    mix: dictionary command => weight
+    start_at, stop_at: perf_counter times to start and stop
+    think_ms: mean pause between commands
+    failures: dictionary command => count of failed commands, shared
+    """
+
+    names = list(mix)
+    weights = [mix[n] for n in names]
+
+    time.sleep(max(0.0, start_at - time.perf_counter()))
+
+    try:
+      self.login()
+    except Exception as err:
+      print(f"**{self.username} could not log in: {err}", file=sys.stderr)
+      return
+
+    while time.perf_counter() < stop_at:
+      name = self.rng.choices(names, weights)[0]
+      try:
+        self.ops[name]()
+      except Exception:
+        with failures["lock"]:
+          failures[name] = failures.get(name, 0) + 1
+
+      if think_ms > 0:
+        time.sleep(self.rng.expovariate(1000 / think_ms))
+
+    self.client.close()
+
+
+##################################################################
+#
+# reporting
+#
+
+def summarize_requests(requests, seconds):
+  """
+  Groups the recorded requests by endpoint
+
+  Parameters
+  ----------
+  requests: list of (endpoint, start, ms, status)
+  seconds: length of the measured window
+
+  Returns
+  -------
+  list of result dictionaries, busiest endpoint first
+  """
+
+  by_endpoint = {}
+  for endpoint, start, ms, status in requests:
+    by_endpoint.setdefault(endpoint, []).append((ms, status))
+
+  results = []
+  for endpoint, rows in by_endpoint.items():
+    timings = [ms for ms, status in rows]
+
+    statuses = {}
+    for ms, status in rows:
+      statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    errors = sum(1 for ms, status in rows
+                 if status == "exception" or status >= 400)
+
+    results.append({
+      "handler": endpoint,
+      "case": "load",
+      "requests": len(rows),
+      "throughput_rps": round(len(rows) / seconds, 2),
+      "errors": errors,
+      "error_rate": round(errors / len(rows), 4),
+      "statuses": statuses,
+      "total_ms": summarize(timings),
+      "histogram": {"bounds_ms": buckets,
+                    "counts": histogram(timings, buckets)},
+      "samples_ms": {"total": [round(ms, 3) for ms in timings]}
+    })
+
+  results.sort(key=lambda r: -r["requests"])
+  return results
+
+
+def print_report(results, seconds, failures):
+  total = sum(r["requests"] for r in results)
+  errors = sum(r["errors"] for r in results)
+
+  print(f"{total} requests in {seconds:.1f}s: {total / seconds:.1f} req/s, "
+        f"{errors} errors ({errors / max(1, total) * 100:.2f}%)")
+  print()
+
+  print(f"{'endpoint':<28} {'req':>7} {'req/s':>8} {'err%':>6} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+  for r in results:
+    t = r["total_ms"]
+    print(f"{r['handler']:<28} {r['requests']:>7} {r['throughput_rps']:>8.1f} "
+          f"{r['error_rate'] * 100:>6.2f} {t['p50']:>8.1f} {t['p95']:>8.1f} "
+          f"{t['p99']:>8.1f} {t['max']:>8.1f}")
+
+  for r in results:
+    print()
+    print(r["handler"], " ".join(f"{s}={n}" for s, n in
+                                 sorted(r["statuses"].items())))
+
+    counts = r["histogram"]["counts"]
+    most = max(counts)
+    lower = 0
+    for bound, n in zip(buckets + [None], counts):
+      label = (f"{lower:>5g}-{bound:<5g}ms" if bound is not None
+               else f"{lower:>5g}+     ms")
+      if n > 0:
+        print(f"  {label} {n:>7} {'#' * max(1, round(40 * n / most))}")
+      lower = bound
+
+  failed = {k: v for k, v in failures.items() if k != "lock"}
+  if failed:
+    print()
+    print("failed commands:", " ".join(f"{k}={v}" for k, v in
+                                       sorted(failed.items())))
+
+
+##################################################################
+#
+# main
+#
+
+def parse_mix(text):
+  """
+  Parses "get_assets=50,like=20,..." into a dictionary
+  """
+
+  mix = {}
+  for part in text.split(","):
+    name, _, weight = part.partition("=")
+    name = name.strip()
+    if name not in default_mix:
+      raise Exception("unknown command in mix: " + name)
+    mix[name] = float(weight) if weight else 1.0
+  return mix
+
+
+def read_credentials(path):
+  accounts = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if line and not line.startswith("#"):
+        username, _, password = line.partition(",")
+        accounts.append((username.strip(), password.strip()))
+  return accounts
+
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                          cwd=repo_root, capture_output=True, text=True,
+                          check=True).stdout.strip()
+  except Exception:
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Load test of the web service with concurrent virtual users")
+  parser.add_argument("--url", required=True,
+                      help="baseurl of the web service, e.g. "
+                           "http://localhost:8080")
+  accounts = parser.add_mutually_exclusive_group(required=True)
+  accounts.add_argument("--manifest",
+                        help="fixture from tools/seed.py; log in as its users")
+  accounts.add_argument("--credentials",
+                        help="file of username,password lines to log in as")
+  parser.add_argument("--users", type=int, default=16,
+                      help="concurrent virtual users")
+  parser.add_argument("--duration", type=float, default=30.0,
+                      help="seconds to measure for")
+  parser.add_argument("--ramp", type=float, default=5.0,
+                      help="seconds over which the users start, not measured")
+  parser.add_argument("--think-ms", type=float, default=0.0,
+                      help="mean pause between a user's commands")
+  parser.add_argument("--mix", default=None,
+                      help="command weights, e.g. get_assets=50,like=20 "
+                           "(default: all commands)")
+  parser.add_argument("--image", default=None,
+                      help="image file to upload (default: 100KB of noise)")
+  parser.add_argument("--timeout", type=float, default=30.0)
+  parser.add_argument("--retries", type=int, default=0,
+                      help="client retries; 0 so failures show up as errors")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--out", default=None,
+                      help="write the results as JSON here")
+  args = parser.parse_args()
+
+  baseurl = args.url.rstrip("/")
+  mix = parse_mix(args.mix) if args.mix else dict(default_mix)
+
+  assets = []
+  if args.manifest:
+    with open(args.manifest) as f:
+      manifest = json.load(f)
+    first = manifest["users"]["first"]
+    count = manifest["users"]["count"]
+    # the seeded users have no password; the local /auth doesn't check:
+    logins = [(f"seed{first + i}", "") for i in range(count)]
+    assets = [a["assetid"] for a in manifest["hot_assets"] if a["public"]]
+  else:
+    logins = read_credentials(args.credentials)
+
+  if len(logins) == 0:
+    raise Exception("no accounts to log in as")
+
+  if args.image:
+    with open(args.image, "rb") as f:
+      image = f.read()
+  else:
+    image = b"\xff\xd8\xff\xe0" + os.urandom(100000) + b"\xff\xd9"
+
+  rng = random.Random(args.seed)
+  recorder = Recorder()
+  failures = {"lock": threading.Lock()}
+
+  now = time.perf_counter()
+  measure_from = now + args.ramp
+  stop_at = measure_from + args.duration
+
+  threads = []
+  for i in range(args.users):
+    username, password = logins[i % len(logins)]
+    user = VirtualUser(baseurl, recorder, username, password, assets, image,
+                       args.timeout, args.retries,
+                       random.Random(rng.random()))
+    start_at = now + args.ramp * i / args.users
+    t = threading.Thread(target=user.run,
+                         args=(mix, start_at, stop_at, args.think_ms,
+                               failures),
+                         daemon=True)
+    threads.append(t)
+
+  print(f"{args.users} users against {baseurl} for {args.duration:g}s "
+        f"(+{args.ramp:g}s ramp)", file=sys.stderr)
+
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+
+  measured = [r for r in recorder.requests if r[1] >= measure_from]
+  seconds = max(1e-9, max([r[1] + r[2] / 1000 for r in measured],
+                          default=stop_at) - measure_from)
+
+  results = summarize_requests(measured, seconds)
+  print_report(results, seconds, failures)
+
+  if args.out:
+    report = {
+      "meta": {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "url": baseurl,
+        "users": args.users,
+        "duration": args.duration,
+        "think_ms": args.think_ms,
+        "mix": mix,
+        "manifest": ({"seed": manifest.get("seed"),
+                      "assets": manifest.get("assets")}
+                     if args.manifest else None),
+        "seconds": round(seconds, 3),
+        "failed_commands": {k: v for k, v in failures.items() if k != "lock"}
+      },
+      "results": results
+    }
+    with open(args.out, "w") as f:
+      f.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,129 @@
+#
+# Summary statistics shared by the benchmark scripts.
+#
+
+import bisect
+import math
+
+
+def percentile(values, p):
+  """
+  Returns the p'th percentile of values (nearest rank)
+
+  Parameters
+  ----------
+  values: sorted list of numbers
+  p: percentile, 0-100
+
+  Returns
+  -------
+  the value, or 0.0 for an empty list
+  """
+
+  if len(values) == 0:
+    return 0.0
+  k = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+  return values[k]
+
+
+def summarize(values):
+  """
+  Summarizes a list of timings
+
+  Parameters
+  ----------
+  values: list of numbers, e.g. milliseconds
+
+  Returns
+  -------
+  dictionary with n, mean, p50, p95, p99 and max, rounded to
+  microseconds
+  """
+
+  values = sorted(values)
+  n = len(values)
+
+  return {
+    "n": n,
+    "mean": round(sum(values) / n, 3) if n else 0.0,
+    "p50": round(percentile(values, 50), 3),
+    "p95": round(percentile(values, 95), 3),
+    "p99": round(percentile(values, 99), 3),
+    "max": round(values[-1], 3) if n else 0.0
+  }
+
+
+def mann_whitney(before, after):
+  """
+  One-sided Mann-Whitney U test of whether the values in after tend
+  to be larger than those in before, using the normal approximation
+  with a correction for ties. Unlike a t-test it makes no assumption
+  about the shape of the distributions, which for latencies are
+  usually skewed with a long tail.
+
+  Parameters
+  ----------
+  before: list of numbers, e.g. baseline timings
+  after: list of numbers, e.g. new timings
+
+  Returns
+  -------
+  p-value: the chance of after looking at least this much larger
+  if both came from the same distribution; 1.0 if either list is
+  empty or all values are equal
+  """
+
+  n1 = len(before)
+  n2 = len(after)
+  if n1 == 0 or n2 == 0:
+    return 1.0
+
+  #
+  # rank everything together, ties getting the average of their ranks:
+  #
+  values = sorted([(v, 0) for v in before] + [(v, 1) for v in after])
+  n = n1 + n2
+
+  rank_sum = 0.0  # of the values in after
+  tie_term = 0.0
+  i = 0
+  while i < n:
+    j = i
+    while j + 1 < n and values[j + 1][0] == values[i][0]:
+      j += 1
+    rank = (i + j) / 2 + 1
+    t = j - i + 1
+    tie_term += t ** 3 - t
+    rank_sum += rank * sum(1 for k in range(i, j + 1) if values[k][1] == 1)
+    i = j + 1
+
+  u = rank_sum - n2 * (n2 + 1) / 2
+
+  mean = n1 * n2 / 2
+  variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+  if variance <= 0:
+    return 1.0
+
+  z = (u - mean - 0.5) / math.sqrt(variance)
+  return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def histogram(values, bounds):
+  """
+  Counts values into buckets
+
+  Parameters
+  ----------
+  values: list of numbers
+  bounds: sorted upper bounds of the buckets; a last bucket catches
+    everything above the largest
+
+  Returns
+  -------
+  list of counts, one per bucket (len(bounds) + 1)
+  """
+
+  counts = [0] * (len(bounds) + 1)
+  for v in values:
+    counts[bisect.bisect_left(bounds, v)] += 1
+  return counts
@@ -1,44 +1,20 @@
 import json
-import boto3
-import os
 import datatier
+import listing
+import metrics
+import responses
+import runtime
+import visibility
 
-from configparser import ConfigParser
+#
+# columns a caller may ask for, and the key the listing pages on:
+#
+columns = ["assetid", "userid", "assetname", "bucketkey", "assettype"]
+key = "assetid"
 
+@metrics.instrument("final_assets")
 def lambda_handler(event, context):
   try:
-    print("**STARTING**")
-    print("**lambda: final_assets**")
-    
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    #s3_profile = 's3readonly'
-    #boto3.setup_default_session(profile_name=s3_profile)
-    #
-    #bucketname = configur.get('s3', 'bucket_name')
-    #
-    #s3 = boto3.resource('s3')
-    #bucket = s3.Bucket(bucketname)
-    
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-
     #
     # the user has sent us two parameters:
     #  1. userid of who is logged in
@@ -47,59 +23,67 @@ def lambda_handler(event, context):
     # (or API Gateway) in the body of the request
     # in JSON format.
     #
-    print("**Accessing request body**")
+    metrics.debug("**Accessing request body**")
     
-    if "body" not in event:
-      raise Exception("event has no body")
-      
-    body = json.loads(event["body"]) # parse the json
+    #
+    # a plain GET has no body (API Gateway sends "body": null), and
+    # no userid means an anonymous caller, who only sees public
+    # assets:
+    #
+    body = json.loads(event.get("body") or "{}") # parse the json
     
-    if "userid" not in body:
-      raise Exception("event has a body but no userid")
-
+    userid = body.get("userid")
     
-
-    userid = body["userid"]
-    
-    print("userid:", userid)
+    metrics.debug("userid:", userid)
 
     #
     # open connection to the database:
     #
-    print("**Opening connection**")
+    metrics.debug("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = runtime.get_dbConn()
     
     #
     # now retrieve all the assest that a user HAS ACCESS TO:
     #
-    print("**Retrieving data**")
-    
-    sql = "SELECT * FROM users ORDER BY userid;" ## Change SQL so it gets all the assets in assets table that are either of the current user or public
+    metrics.debug("**Retrieving data**")
     
-    rows = datatier.retrieve_all_rows(dbConn, sql)
+    limit, after = listing.get_page_params(event)
+    fields = listing.get_fields(event, columns, key)
+    layout = listing.get_layout(event)
+
+    metrics.debug("limit:", limit, "after:", after)
+    metrics.debug("fields:", fields, "layout:", layout)
+
+    #
+    # the field names have been checked against columns, so are safe
+    # to put in the SQL:
+    #
+    select = ", ".join(fields)
+
+    sql, params = visibility.page_sql(select, userid, after, limit + 1)
+
+    rows = datatier.stream_rows(dbConn, sql, params)
     
-    for row in rows:
-      print(row)
+    # streamed: make_page reads limit + 1 rows and closes the cursor
+    rows, cursor = listing.make_page(rows, limit)
+
+    metrics.debug_rows(rows)
 
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    print("**DONE, returning rows**")
+    metrics.debug("**DONE, returning rows**")
     
-    return {
-        'statusCode': 200,
-        'body': json.dumps({"message":"success",
-                            "data": rows})
-      }
+    return responses.respond(event, 200, {"message":"success",
+                                          "schema": fields,
+                                          "layout": layout,
+                                          "data": listing.make_data(fields, rows, layout),
+                                          "next": cursor})
     
   except Exception as err:
-    print("**ERROR**")
-    print(str(err))
+    metrics.error(str(err))
     
-    return {
-        'statusCode': 400,
-        'body': json.dumps({"message":str(err),
-                            "data": []})
-      }
\ No newline at end of file
+    return responses.respond(event, 400, {"message":str(err),
+                                          "data": []})
\ No newline at end of file
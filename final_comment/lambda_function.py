@@ -1,52 +1,17 @@
 import json
-import boto3
-import os
-import uuid
-import base64
-import pathlib
 import datatier
+import metrics
+import responses
+import runtime
 
-from configparser import ConfigParser
-
+@metrics.instrument("final_comment")
 def lambda_handler(event, context):
   try:
-    print("**STARTING**")
-    print("**lambda: final_comment**")
-    
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    # s3_profile = 's3readwrite'
-    # boto3.setup_default_session(profile_name=s3_profile)
-    
-    # bucketname = configur.get('s3', 'bucket_name')
-    
-    # s3 = boto3.resource('s3')
-    # bucket = s3.Bucket(bucketname)
-    
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-    
     #
     # userid from event: could be a parameter
     # or could be part of URL path ("pathParameters"):
     #
-    print("**Accessing event/pathParameters**")
+    metrics.debug("**Accessing event/pathParameters**")
     
     if "assetid" in event:
       assetid = event["assetid"]
@@ -58,7 +23,7 @@ def lambda_handler(event, context):
     else:
         raise Exception("requires assetid parameter in event")
         
-    print("assetid:", assetid)
+    metrics.debug("assetid:", assetid)
   
     #
     # the user has sent us two parameters:
@@ -69,7 +34,7 @@ def lambda_handler(event, context):
     # (or API Gateway) in the body of the request
     # in JSON format.
     #
-    print("**Accessing request body**")
+    metrics.debug("**Accessing request body**")
     
     if "body" not in event:
       raise Exception("event has no body")
@@ -85,110 +50,74 @@ def lambda_handler(event, context):
     userid = body["userid"]
     comment = body["comment"]
     
-    print("userid:", userid)
-    print("comment:", comment)
+    metrics.debug("userid:", userid)
+    metrics.debug("comment:", comment)
 
     #
     # open connection to the database:
     #
-    print("**Opening connection**")
+    metrics.debug("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = runtime.get_dbConn()
 
     #
-    # first we need to make sure the assetid is valid:
+    # add to database, in one transaction sent as one round trip:
+    # the asset's comment_count is bumped only if it exists and the
+    # user may see it (public, or their own), and the comment is
+    # only inserted if that UPDATE hit a row:
     #
-    print("**Checking if userid is valid**")
+    metrics.debug("**Adding comment to database**")
     
-    # probably include privacy here in query
     sql = """
-    SELECT userid FROM assets WHERE assetid = %s;
-    """   
-
-
-    row = datatier.retrieve_one_row(dbConn, sql, [assetid])
-    
-    if not row:
-      print("Database operation failed... returning")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"database operation failed...",
-                            "commentid": -1})
-      }
-    
-    elif row == ():  # no such asset
-      print("**No such asset, returning...**")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"no such asset...",
-                            "commentid": -1})
-      }
+    UPDATE assets SET comment_count = comment_count + 1
+     WHERE assetid = %s AND uploaded = 1
+       AND (assettype = 'public' OR userid = %s);
+    INSERT INTO comments (userid, assetid, comment_body)
+      SELECT %s, %s, %s FROM DUAL WHERE ROW_COUNT() > 0;
+    """
     
-    ## NEED LOGIC HERE SO ONLY DOWNLOAD IF HAS ACCESS
+    results = datatier.perform_transaction(dbConn, sql,
+                                           [assetid, userid,
+                                            userid, assetid, comment])
 
+    q, commentid = results[1]
 
+    if q == 0:
+      #
+      # nothing inserted; tell a missing asset from a private one
+      # (this lookup only happens on the failure path):
+      #
+      sql = "SELECT assetid FROM assets WHERE assetid = %s AND uploaded = 1;"
 
-    print(row)
-    
-    author_userid = row[0]
-    #privacy = row[1]
-    
-    #
-    # add to database
-    #
-    print("**Adding asset to database**")
-    
-    sql = """
-    INSERT INTO comments (userid, assetid, comment_body) VALUES (%s, %s, %s);
-    """
-    
-    q = datatier.perform_action(dbConn, sql, [userid, assetid, comment])
+      row = datatier.retrieve_one_row(dbConn, sql, [assetid])
+
+      if row == ():  # no such asset
+        metrics.debug("**No such asset, returning...**")
+        return responses.respond(event, 400, {"message":"no such asset...",
+                                              "commentid": -1})
 
-    if q == -1:
-      print("Database operation failed...")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"inserting comment failed",
-                            "commentid": -1})
-      }
-    elif q == 0:
-      print("Unexpected query failure...")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"inserting comment failed",
-                            "commentid": -1})
-      }
+      metrics.debug("**Asset is private, returning...**")
+      return responses.respond(event, 403, {"message":"forbidden...",
+                                            "commentid": -1})
     
     #
-    # grab the jobid that was auto-generated by mysql:
+    # commentid is the id mysql auto-generated for the insert, read
+    # back with the insert itself:
     #
-    sql = "SELECT LAST_INSERT_ID();"
-    
-    row = datatier.retrieve_one_row(dbConn, sql)
-    
-    commentid = row[0]
-    
-    print("commentid:", commentid)
+    metrics.debug("commentid:", commentid)
     
 
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    print("**DONE, returning assetid**")
+    metrics.debug("**DONE, returning assetid**")
     
-    return {
-          'statusCode': 200,
-          'body': json.dumps({"message":"success",
-                              "commentid": commentid})
-        }
+    return responses.respond(event, 200, {"message":"success",
+                                          "commentid": commentid})
     
   except Exception as err:
-    print("**ERROR**")
-    print(str(err))
+    metrics.error(str(err))
     
-    return {
-        'statusCode': 400,
-        'body': json.dumps({"message":str(err),
-                            "commentid": -1})
-      }
+    return responses.respond(event, 400, {"message":str(err),
+                                          "commentid": -1})
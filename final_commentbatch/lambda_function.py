@@ -0,0 +1,113 @@
+import json
+import batch
+import datatier
+import metrics
+import responses
+import runtime
+
+@metrics.instrument("final_commentbatch")
+def lambda_handler(event, context):
+  try:
+    #
+    # the user has sent us two parameters:
+    #  1. userid of who is logged in
+    #  2. items, a list of {"assetid": ..., "comment": ...}
+    #
+    # The parameters are coming through web server
+    # (or API Gateway) in the body of the request
+    # in JSON format.
+    #
+    metrics.debug("**Accessing request body**")
+
+    if "body" not in event:
+      raise Exception("event has no body")
+
+    body = json.loads(event["body"]) # parse the json
+
+    if "userid" not in body:
+      raise Exception("event has a body but no userid")
+
+    userid = int(body["userid"])
+
+    items = []
+    for item in batch.get_items(body, "items"):
+      if "assetid" not in item or "comment" not in item:
+        raise Exception("each item needs an assetid and a comment")
+      items.append((int(item["assetid"]), item["comment"]))
+
+    metrics.debug("userid:", userid)
+    metrics.debug("items:", len(items))
+
+    #
+    # open connection to the database:
+    #
+    metrics.debug("**Opening connection**")
+
+    dbConn = runtime.get_dbConn()
+
+    #
+    # check every asset at once:
+    #
+    metrics.debug("**Checking assets**")
+
+    checked = batch.check_assets(dbConn, userid,
+                                 [assetid for (assetid, comment) in items])
+
+    allowed = [item for item in items if checked[item[0]][0] == 200]
+
+    metrics.debug("allowed:", len(allowed))
+
+    #
+    # add the comments to the database in one transaction: one
+    # UPDATE for the counters (rows are locked in assetid order, so
+    # batches can't deadlock each other) and one multi-row INSERT:
+    #
+    if len(allowed) > 0:
+      metrics.debug("**Adding comments to database**")
+
+      per_asset = {}
+      for (assetid, comment) in allowed:
+        per_asset[assetid] = per_asset.get(assetid, 0) + 1
+
+      cases = " ".join(["WHEN %s THEN %s"] * len(per_asset))
+      marks = ", ".join(["%s"] * len(per_asset))
+      comment_rows = ", ".join(["(%s, %s, %s)"] * len(allowed))
+
+      sql = f"""
+      UPDATE assets SET comment_count = comment_count + CASE assetid {cases} END
+       WHERE assetid IN ({marks});
+      INSERT INTO comments (userid, assetid, comment_body) VALUES {comment_rows};
+      """
+
+      params = []
+      for assetid in sorted(per_asset):
+        params += [assetid, per_asset[assetid]]
+      params += sorted(per_asset)
+      for (assetid, comment) in allowed:
+        params += [userid, assetid, comment]
+
+      datatier.perform_transaction(dbConn, sql, params)
+
+    #
+    # respond in an HTTP-like way, i.e. with a status
+    # code and body in JSON format; there is one result per item,
+    # in the order they were sent:
+    #
+    metrics.debug("**DONE, returning results**")
+
+    results = []
+    for (assetid, comment) in items:
+      status, message = checked[assetid]
+      results.append({"assetid": assetid,
+                      "status": status,
+                      "message": message})
+
+    return responses.respond(event, 200, {"message":"success",
+                                          "commented": len(allowed),
+                                          "results": results})
+
+  except Exception as err:
+    metrics.error(str(err))
+
+    return responses.respond(event, 400, {"message":str(err),
+                                          "results": []})
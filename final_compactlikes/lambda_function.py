@@ -0,0 +1,80 @@
+#
+# Folds the sharded like counters back into assets.like_count.
+#
+# Not an API route: this runs on a schedule (e.g. an EventBridge rule
+# every few minutes). Each asset with counter slots is compacted in
+# its own short transaction, so likes on other assets are never held
+# up. An event may carry "limit", the most assets to compact in one
+# run (default 500).
+#
+import datatier
+import metrics
+import responses
+import runtime
+
+default_limit = 500
+
+#
+# lock the asset row first, in the same order final_like takes its
+# locks (asset, then slot), so compaction and likes can't deadlock;
+# the slots are then locked, added in and deleted:
+#
+compact_sql = """
+SELECT assetid FROM assets WHERE assetid = %s FOR UPDATE;
+SELECT COALESCE(SUM(likes), 0) INTO @folded
+  FROM asset_like_shards WHERE assetid = %s FOR UPDATE;
+UPDATE assets SET like_count = like_count + @folded WHERE assetid = %s;
+DELETE FROM asset_like_shards WHERE assetid = %s;
+"""
+
+@metrics.instrument("final_compactlikes")
+def lambda_handler(event, context):
+  try:
+    limit = int((event or {}).get("limit", default_limit))
+
+    metrics.debug("limit:", limit)
+
+    #
+    # open connection to the database:
+    #
+    metrics.debug("**Opening connection**")
+
+    dbConn = runtime.get_dbConn()
+
+    #
+    # which assets have likes sitting in slots? The primary key is
+    # (assetid, shard), so this is an index scan:
+    #
+    metrics.debug("**Finding assets to compact**")
+
+    sql = """
+    SELECT DISTINCT assetid FROM asset_like_shards ORDER BY assetid LIMIT %s;
+    """
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, [limit])
+
+    metrics.debug("assets:", len(rows))
+
+    #
+    # fold each one:
+    #
+    metrics.debug("**Compacting**")
+
+    compacted = 0
+    for row in rows:
+      assetid = row[0]
+      datatier.perform_transaction(dbConn, compact_sql,
+                                   [assetid, assetid, assetid, assetid])
+      compacted += 1
+
+    metrics.debug("**DONE, compacted", compacted, "assets**")
+
+    return responses.respond(event or {}, 200, {"message":"success",
+                                                "compacted": compacted,
+                                                "more": len(rows) == limit})
+
+  except Exception as err:
+    metrics.error(str(err))
+
+    return responses.respond(event or {}, 400, {"message":str(err),
+                                                "compacted": -1})
@@ -0,0 +1,105 @@
+import json
+import batch
+import metrics
+import responses
+import runtime
+import summary
+
+@metrics.instrument("final_counts")
+def lambda_handler(event, context):
+  try:
+    #
+    # the assets come in the query string:
+    #   assetids -- comma-separated asset ids, e.g. "1001,1002"
+    #   comments -- newest comments to return per asset (default 0)
+    #
+    metrics.debug("**Accessing query string**")
+
+    query = event.get("queryStringParameters") or {}
+
+    if not query.get("assetids"):
+      raise Exception("requires assetids in the query string")
+
+    try:
+      assetids = [int(s) for s in query["assetids"].split(",") if s.strip()]
+      k = int(query.get("comments", "0"))
+    except ValueError:
+      raise Exception("assetids and comments must be numbers")
+
+    if len(assetids) == 0:
+      raise Exception("requires assetids in the query string")
+    if len(assetids) > batch.max_items:
+      raise Exception("at most " + str(batch.max_items) + " assetids")
+    if k < 0 or k > summary.max_comments:
+      raise Exception("comments must be 0.." + str(summary.max_comments))
+
+    metrics.debug("assetids:", len(assetids))
+    metrics.debug("comments:", k)
+
+    #
+    # the user has sent us one parameter:
+    #  1. userid of who is logged in
+    #
+    # The parameters are coming through web server
+    # (or API Gateway) in the body of the request
+    # in JSON format.
+    #
+    metrics.debug("**Accessing request body**")
+
+    if "body" not in event:
+      raise Exception("event has no body")
+
+    body = json.loads(event["body"]) # parse the json
+
+    if "userid" not in body:
+      raise Exception("event has a body but no userid")
+
+    userid = int(body["userid"])
+
+    metrics.debug("userid:", userid)
+
+    #
+    # open connection to the database:
+    #
+    metrics.debug("**Opening connection**")
+
+    dbConn = runtime.get_dbConn()
+
+    #
+    # counts for every asset in one grouped query, then the newest
+    # comments on the visible ones in one more:
+    #
+    metrics.debug("**Retrieving counts**")
+
+    counts = summary.get_counts(dbConn, userid, assetids)
+
+    visible = [assetid for assetid in counts if counts[assetid]["status"] == 200]
+
+    if k > 0:
+      metrics.debug("**Retrieving comments**")
+
+      comments = summary.get_latest_comments(dbConn, visible, k)
+      for assetid in visible:
+        counts[assetid]["comments"] = comments[assetid]
+
+    #
+    # respond in an HTTP-like way, i.e. with a status
+    # code and body in JSON format; one result per assetid, in the
+    # order they were asked for:
+    #
+    metrics.debug("**DONE, returning counts**")
+
+    results = []
+    for assetid in assetids:
+      result = {"assetid": assetid}
+      result.update(counts[assetid])
+      results.append(result)
+
+    return responses.respond(event, 200, {"message":"success",
+                                          "results": results})
+
+  except Exception as err:
+    metrics.error(str(err))
+
+    return responses.respond(event, 400, {"message":str(err),
+                                          "results": []})
@@ -1,45 +1,67 @@
 import json
-import boto3
-import os
-import base64
+import binascii
 import datatier
+import metrics
+import responses
+import runtime
 
-from configparser import ConfigParser
 
-def lambda_handler(event, context):
-  try:
-    print("**STARTING**")
-    print("**lambda: final_download**")
+def stream_base64(body, size, chunk_size=3 * 256 * 1024):
+  """
+  base64-encodes an S3 object body as it streams in, straight into
+  a buffer sized for the encoded result, so the raw object is never
+  held in memory as a whole.
+
+  Parameters
+  ----------
+  body: StreamingBody from S3 get_object
+  size: ContentLength of the object
+  chunk_size: bytes to read at a time, a multiple of 3 so that
+    each chunk encodes without padding
+
+  Returns
+  -------
+  the base64 text, as a str
+  """
+
+  encoded = bytearray(4 * ((size + 2) // 3))
+  out = memoryview(encoded)
+  pos = 0
+
+  carry = b""
+  for chunk in body.iter_chunks(chunk_size):
+    if carry:
+      chunk = carry + chunk
 
     #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    s3_profile = 's3readonly'
-    boto3.setup_default_session(profile_name=s3_profile)
-    
-    bucketname = configur.get('s3', 'bucket_name')
-    
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucketname)
-    
-    #
-    # configure for RDS access
+    # encode the largest multiple of 3 bytes, keep the rest for
+    # the next chunk:
     #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-    
+    usable = len(chunk) - len(chunk) % 3
+    with metrics.span("base64"):
+      piece = binascii.b2a_base64(memoryview(chunk)[:usable], newline=False)
+    carry = chunk[usable:]
+
+    if pos + len(piece) > len(encoded):
+      raise Exception("object is larger than its ContentLength")
+
+    out[pos:pos + len(piece)] = piece
+    pos += len(piece)
+
+  if carry:
+    piece = binascii.b2a_base64(carry, newline=False)
+    out[pos:pos + len(piece)] = piece
+    pos += len(piece)
+
+  if pos != len(encoded):
+    raise Exception("object is smaller than its ContentLength")
+
+  return str(out, "ascii")
+
+
+@metrics.instrument("final_download")
+def lambda_handler(event, context):
+  try:
     #
     # assetid from event: could be a parameter
     # or could be part of URL path ("pathParameters"):
@@ -54,9 +76,24 @@ def lambda_handler(event, context):
     else:
         raise Exception("requires assetid parameter in event")
         
-    print("assetid:", assetid)
+    metrics.debug("assetid:", assetid)
+
+    #
+    # how the image should come back, from the query string:
+    #  "inline"   -- the default, base64 data in the JSON body
+    #  "url"      -- a short-lived presigned GET url in the JSON
+    #                body, which the client downloads from S3
+    #  "redirect" -- a 302 to the presigned GET url
+    #
+    query = event.get("queryStringParameters") or {}
+    mode = query.get("mode", "inline")
+
+    if mode not in ["inline", "url", "redirect"]:
+      raise Exception("unknown mode: " + str(mode))
+
+    metrics.debug("mode:", mode)
 
-    print("**Accessing request body**")
+    metrics.debug("**Accessing request body**")
     
     if "body" not in event:
       raise Exception("event has no body")
@@ -69,124 +106,120 @@ def lambda_handler(event, context):
 
     userid = body["userid"]
     
-    print("userid:", userid)
+    metrics.debug("userid:", userid)
 
     #
     # does the jobid exist?  What's the status of the job if so?
     #
     # open connection to the database:
     #
-    print("**Opening connection**")
+    metrics.debug("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = runtime.get_dbConn()
 
     #
-    # first we need to make sure the assetid is valid:
+    # first we need to make sure the assetid is valid; an asset
+    # whose upload hasn't finished has no object to download yet:
     #
-    print("**Checking if assetid is valid**")
+    metrics.debug("**Checking if assetid is valid**")
     
-    # probably include privacy here in query
     sql = """
-    SELECT userid,assetname,bucketkey FROM assets WHERE assetid = %s;
+    SELECT userid,assetname,bucketkey,assettype FROM assets
+     WHERE assetid = %s AND uploaded = 1;
     """
     
     row = datatier.retrieve_one_row(dbConn, sql, [assetid])
 
     # error in SQL -- MAKE ERROR MESSAGES MATCH
     if not row:
-      print("Database operation failed... returning")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"database operation failed...",
-                            "user_id": -1,
-                            "asset_name": "?",
-                            "bucket_key": "?",
-                            "data": []})
-      }
+      metrics.debug("Database operation failed... returning")
+      return responses.respond(event, 400, {"message":"database operation failed...",
+                                            "user_id": -1,
+                                            "asset_name": "?",
+                                            "bucket_key": "?",
+                                            "data": []})
     
     elif row == ():  # no such job
-      print("**No such asset, returning...**")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"no such asset...",
-                            "user_id": -1,
-                            "asset_name": "?",
-                            "bucket_key": "?",
-                            "data": []})
-      }
+      metrics.debug("**No such asset, returning...**")
+      return responses.respond(event, 400, {"message":"no such asset...",
+                                            "user_id": -1,
+                                            "asset_name": "?",
+                                            "bucket_key": "?",
+                                            "data": []})
     
-    print(row)
+    metrics.debug(row)
     
     author_userid = row[0]
     assetname = row[1]
     bucketkey = row[2]
+    assettype = row[3]
 
-     ## NEED LOGIC HERE SO ONLY DOWNLOAD IF HAS ACCESS
-
-    
-    print("author userid:", author_userid)
-    print("assetname:", assetname)
-    print("bucketkey:", bucketkey)
-      
     #
-    # if we get here, the job completed. So we should have results
-    # to download and return to the user:
-    #      
-    local_filename = "/tmp/results.txt"
-    
-    print("**Downloading results from S3**")
-    
-    bucket.download_file(bucketkey, local_filename)
-    
+    # only public assets, or the caller's own, may be downloaded;
+    # checked before any url is signed or object read:
     #
-    #infile = open(local_filename, "r")
-    #ines = infile.readlines()
-    #infile.close()
-    #
-    #for line in lines:
-    #  print(line)
-    #
-  
+    if assettype != "public" and author_userid != int(userid):
+      metrics.debug("**Asset is private, returning...**")
+      return responses.respond(event, 403, {"message":"forbidden...",
+                                            "user_id": -1,
+                                            "asset_name": "?",
+                                            "bucket_key": "?",
+                                            "data": []})
+
+    metrics.debug("author userid:", author_userid)
+    metrics.debug("assetname:", assetname)
+    metrics.debug("bucketkey:", bucketkey)
+
+    if mode != "inline":
+      #
+      # let the client fetch the object from S3 itself, so its size
+      # is not bound by lambda's response limit:
+      #
+      url = runtime.presigned_url('s3readonly', 'get_object', bucketkey)
+
+      if mode == "redirect":
+        metrics.debug("**DONE, redirecting to presigned url**")
+        return responses.respond(event, 302, None, {'Location': url})
+
+      metrics.debug("**DONE, returning presigned url**")
+      return responses.respond(event, 200, {"message":"success",
+                                            "user_id": author_userid,
+                                            "asset_name": assetname,
+                                            "bucket_key": bucketkey,
+                                            "url": url})
+      
     #
-    # open the file and read as raw bytes:
+    # stream the object from S3, encoding it as base64 for the
+    # JSON response as the bytes arrive. Nothing is staged in
+    # /tmp, and the raw bytes are never held as one full copy:
     #
-    infile = open(local_filename, "rb")
-    bytes = infile.read()
-    infile.close()
+    metrics.debug("**Downloading results from S3**")
     
-    #
-    # now encode the data as base64. Note b64encode returns
-    # a bytes object, not a string. So then we have to convert
-    # (decode) the bytes -> string, and then we can serialize
-    # the string as JSON for download:
-    #
-    data = base64.b64encode(bytes)
-    datastr = data.decode()
+    bucket = runtime.get_bucket('s3readonly')
+
+    # s3 covers the transfer; the encoding is timed as base64:
+    with metrics.span("s3"):
+      obj = bucket.meta.client.get_object(Bucket=bucket.name, Key=bucketkey)
+
+      datastr = stream_base64(obj['Body'], obj['ContentLength'])
 
-    print("**DONE, returning results**")
+    metrics.debug("**DONE, returning results**")
     
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    return {
-        'statusCode': 200,
-        'body': json.dumps({"message":"success",
-                            "user_id": author_userid,
-                            "asset_name": assetname,
-                            "bucket_key": bucketkey,
-                            "data": datastr})
-      }
+    return responses.respond(event, 200, {"message":"success",
+                                          "user_id": author_userid,
+                                          "asset_name": assetname,
+                                          "bucket_key": bucketkey,
+                                          "data": datastr})
     
   except Exception as err:
-    print("**ERROR**")
-    print(str(err))
+    metrics.error(str(err))
     
-    return {
-          'statusCode': 400,
-          'body': json.dumps({"message":str(err),
-                              "user_id": -1,
-                              "asset_name": "?",
-                              "bucket_key": "?",
-                              "data": []})
-        }
+    return responses.respond(event, 400, {"message":str(err),
+                                          "user_id": -1,
+                                          "asset_name": "?",
+                                          "bucket_key": "?",
+                                          "data": []})
@@ -0,0 +1,91 @@
+#
+# Removes presigned-upload reservations that were never completed.
+#
+# Not an API route: this runs on a schedule (e.g. an EventBridge rule
+# every hour), like final_compactlikes. final_uploadimage's "reserve"
+# inserts the asset as pending (uploaded = 0); if the client never
+# calls "complete", the row would stay forever. Each pending asset
+# reserved more than "max_age" seconds ago (default 3600, well past
+# the presigned url's lifetime) is deleted, and then its object, in
+# case the PUT did arrive. An event may also carry "limit", the most
+# reservations to remove in one run (default 500, at most 1000).
+#
+import datatier
+import metrics
+import responses
+import runtime
+
+default_max_age = 3600
+default_limit = 500
+
+@metrics.instrument("final_expireuploads")
+def lambda_handler(event, context):
+  try:
+    max_age = int((event or {}).get("max_age", default_max_age))
+    limit = min(int((event or {}).get("limit", default_limit)), 1000)
+
+    metrics.debug("max_age:", max_age, "limit:", limit)
+
+    #
+    # open connection to the database:
+    #
+    metrics.debug("**Opening connection**")
+
+    dbConn = runtime.get_dbConn()
+
+    #
+    # which reservations have expired? (uploaded, reserved_at) is
+    # indexed, so this is a range scan over the pending assets only:
+    #
+    metrics.debug("**Finding expired reservations**")
+
+    sql = """
+    SELECT assetid, bucketkey FROM assets
+     WHERE uploaded = 0
+       AND reserved_at < UTC_TIMESTAMP() - INTERVAL %s SECOND
+     ORDER BY reserved_at LIMIT %s;
+    """
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, [max_age, limit])
+
+    metrics.debug("expired:", len(rows))
+
+    #
+    # delete each row only if it is still pending: a "complete" that
+    # got in first keeps its asset, and its object. Pending assets
+    # can't have likes or comments, so nothing refers to them.
+    #
+    metrics.debug("**Removing reservations**")
+
+    sql = "DELETE FROM assets WHERE assetid = %s AND uploaded = 0;"
+
+    bucketkeys = []
+    for row in rows:
+      if datatier.perform_action(dbConn, sql, [row[0]]) > 0:
+        bucketkeys.append(row[1])
+
+    #
+    # and their objects, in one request; keys that were never
+    # uploaded are simply not there:
+    #
+    if bucketkeys:
+      metrics.debug("**Deleting objects**")
+
+      bucket = runtime.get_bucket('s3readwrite')
+      with metrics.span("s3"):
+        bucket.delete_objects(Delete={
+          'Objects': [{'Key': key} for key in bucketkeys],
+          'Quiet': True
+        })
+
+    metrics.debug("**DONE, removed", len(bucketkeys), "reservations**")
+
+    return responses.respond(event or {}, 200, {"message":"success",
+                                                "expired": len(bucketkeys),
+                                                "more": len(rows) == limit})
+
+  except Exception as err:
+    metrics.error(str(err))
+
+    return responses.respond(event or {}, 400, {"message":str(err),
+                                                "expired": -1})
@@ -0,0 +1,124 @@
+import json
+import counters
+import datatier
+import listing
+import metrics
+import responses
+import runtime
+import summary
+import visibility
+
+#
+# the feed's columns, in order; it pages on assetid, newest first:
+#
+columns = ["assetid", "assetname", "assettype", "userid", "username",
+           "like_count", "comment_count"]
+key = "assetid"
+
+default_comments = 3
+
+@metrics.instrument("final_feed")
+def lambda_handler(event, context):
+  try:
+    #
+    # the user has sent us one parameter:
+    #  1. userid of who is logged in
+    #
+    # The parameters are coming through web server
+    # (or API Gateway) in the body of the request
+    # in JSON format.
+    #
+    metrics.debug("**Accessing request body**")
+
+    if "body" not in event:
+      raise Exception("event has no body")
+
+    body = json.loads(event["body"]) # parse the json
+
+    if "userid" not in body:
+      raise Exception("event has a body but no userid")
+
+    userid = int(body["userid"])
+
+    metrics.debug("userid:", userid)
+
+    #
+    # paging and shape of the response, plus how many of each
+    # asset's newest comments to include:
+    #
+    limit, after = listing.get_page_params(event)
+    layout = listing.get_layout(event)
+
+    query = event.get("queryStringParameters") or {}
+    try:
+      k = int(query.get("comments", default_comments))
+    except ValueError:
+      raise Exception("comments must be a number")
+    if k < 0 or k > summary.max_comments:
+      raise Exception("comments must be 0.." + str(summary.max_comments))
+
+    metrics.debug("limit:", limit, "after:", after, "comments:", k)
+
+    #
+    # open connection to the database:
+    #
+    metrics.debug("**Opening connection**")
+
+    dbConn = runtime.get_dbConn()
+
+    #
+    # one page of the assets the user can see, newest first, each
+    # with its owner's username and its counts:
+    #
+    metrics.debug("**Retrieving feed**")
+
+    #
+    # the page of visible assetids is two index range scans (see
+    # visibility.py); the rest is primary key lookups for just those:
+    #
+    page, params = visibility.page_sql("assetid", userid, after, limit + 1,
+                                       descending=True)
+
+    sql = f"""
+    SELECT a.assetid, a.assetname, a.assettype, a.userid, u.username,
+           {counters.like_count_sql}, a.comment_count
+      FROM ({page}) AS v
+      JOIN assets a ON a.assetid = v.assetid
+      JOIN users u ON u.userid = a.userid
+     ORDER BY a.assetid DESC;
+    """
+
+    rows = datatier.stream_rows(dbConn, sql, params)
+
+    rows, cursor = listing.make_page(rows, limit)
+
+    #
+    # and the newest comments on every asset on the page, in one
+    # more query:
+    #
+    comments = {}
+    if k > 0 and len(rows) > 0:
+      metrics.debug("**Retrieving comments**")
+
+      latest = summary.get_latest_comments(dbConn, [row[0] for row in rows], k)
+      for assetid in latest:
+        comments[str(assetid)] = latest[assetid]
+
+    #
+    # respond in an HTTP-like way, i.e. with a status
+    # code and body in JSON format:
+    #
+    metrics.debug("**DONE, returning", len(rows), "assets**")
+
+    return responses.respond(event, 200, {"message":"success",
+                                          "schema": columns,
+                                          "layout": layout,
+                                          "data": listing.make_data(columns, rows, layout),
+                                          "comments": comments,
+                                          "next": cursor})
+
+  except Exception as err:
+    metrics.error(str(err))
+
+    return responses.respond(event, 400, {"message":str(err),
+                                          "data": []})
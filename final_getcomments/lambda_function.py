@@ -1,49 +1,24 @@
 import json
-import boto3
-import os
 import datatier
+import listing
+import metrics
+import responses
+import runtime
 
-from configparser import ConfigParser
+#
+# columns a caller may ask for, and the key the listing pages on:
+#
+columns = ["commentid", "userid", "assetid", "comment_body"]
+key = "commentid"
 
+@metrics.instrument("final_getcomments")
 def lambda_handler(event, context):
   try:
-    print("**STARTING**")
-    print("**lambda: final_getcomments**")
-    
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    #s3_profile = 's3readonly'
-    #boto3.setup_default_session(profile_name=s3_profile)
-    #
-    #bucketname = configur.get('s3', 'bucket_name')
-    #
-    #s3 = boto3.resource('s3')
-    #bucket = s3.Bucket(bucketname)
-    
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-
     #
     # userid from event: could be a parameter
     # or could be part of URL path ("pathParameters"):
     #
-    print("**Accessing event/pathParameters**")
+    metrics.debug("**Accessing event/pathParameters**")
     
     if "assetid" in event:
       assetid = event["assetid"]
@@ -55,7 +30,7 @@ def lambda_handler(event, context):
     else:
         raise Exception("requires assetid parameter in event")
         
-    print("assetid:", assetid)
+    metrics.debug("assetid:", assetid)
   
     #
     # the user has sent us two parameters:
@@ -65,7 +40,7 @@ def lambda_handler(event, context):
     # (or API Gateway) in the body of the request
     # in JSON format.
     #
-    print("**Accessing request body**")
+    metrics.debug("**Accessing request body**")
     
     if "body" not in event:
       raise Exception("event has no body")
@@ -78,82 +53,107 @@ def lambda_handler(event, context):
     
     userid = body["userid"]
     
-    print("userid:", userid)
+    metrics.debug("userid:", userid)
 
     #
     # open connection to the database:
     #
-    print("**Opening connection**")
+    metrics.debug("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = runtime.get_dbConn()
 
     #
     # first we need to make sure the assetid is valid:
     #
-    print("**Checking if userid is valid**")
+    metrics.debug("**Checking if userid is valid**")
     
-    # probably include privacy here in query
+    # pending uploads (0006) are not assets yet:
     sql = """
-    SELECT userid FROM assets WHERE assetid = %s;
+    SELECT userid, comment_count, assettype FROM assets
+     WHERE assetid = %s AND uploaded = 1;
     """   
 
 
     row = datatier.retrieve_one_row(dbConn, sql, [assetid])
     
     if not row:
-      print("Database operation failed... returning")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"database operation failed...",
-                            "data": []})
-      }
+      metrics.debug("Database operation failed... returning")
+      return responses.respond(event, 400, {"message":"database operation failed...",
+                                            "data": []})
     
     elif row == ():  # no such asset
-      print("**No such asset, returning...**")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"no such asset...",
-                            "data": []})
-      }
+      metrics.debug("**No such asset, returning...**")
+      return responses.respond(event, 400, {"message":"no such asset...",
+                                            "data": []})
     
-    ## NEED LOGIC HERE SO ONLY DOWNLOAD IF HAS ACCESS
-
-    print(row)
+    metrics.debug(row)
     
     author_userid = row[0]
-    #privacy = row[1]
+    comment_count = row[1]
+    assettype = row[2]
+
+    #
+    # only public assets, or the caller's own, may have their
+    # comments counted or listed:
+    #
+    if assettype != "public" and author_userid != int(userid):
+      metrics.debug("**Asset is private, returning...**")
+      return responses.respond(event, 403, {"message":"forbidden...",
+                                            "data": []})
+
+    #
+    # counts only? then the counter on the asset is the answer, and
+    # the comments table is never touched:
+    #
+    if listing.get_counts_only(event):
+      metrics.debug("**DONE, returning count**")
+
+      return responses.respond(event, 200, {"message":"success",
+                                            "assetid": int(assetid),
+                                            "comment_count": comment_count})
 
     
     #
     # now retrieve all the likes:
     #
-    print("**Retrieving data**")
+    metrics.debug("**Retrieving data**")
     
-    sql = "SELECT * FROM comments WHERE assetid = %s;" ## I think this is right?
+    limit, after = listing.get_page_params(event)
+    fields = listing.get_fields(event, columns, key)
+    layout = listing.get_layout(event)
+
+    metrics.debug("limit:", limit, "after:", after)
+    metrics.debug("fields:", fields, "layout:", layout)
+
+    select = ", ".join(fields)
+
+    sql = f"""
+    SELECT {select} FROM comments WHERE assetid = %s AND commentid > %s
+    ORDER BY commentid LIMIT %s;
+    """
     
-    rows = datatier.retrieve_all_rows(dbConn, sql, [assetid])
+    rows = datatier.stream_rows(dbConn, sql,
+                                [assetid, after or 0, limit + 1])
     
-    for row in rows:
-      print(row)
+    # streamed: make_page reads limit + 1 rows and closes the cursor
+    rows, cursor = listing.make_page(rows, limit)
+
+    metrics.debug_rows(rows)
 
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    print("**DONE, returning rows**")
+    metrics.debug("**DONE, returning rows**")
     
-    return {
-        'statusCode': 200,
-        'body': json.dumps({"message":"success",
-                            "data": rows})
-      }
+    return responses.respond(event, 200, {"message":"success",
+                                          "schema": fields,
+                                          "layout": layout,
+                                          "data": listing.make_data(fields, rows, layout),
+                                          "next": cursor})
     
   except Exception as err:
-    print("**ERROR**")
-    print(str(err))
-    
-    return {
-        'statusCode': 400,
-        'body': json.dumps({"message":str(err),
-                            "data": []})
-      }
\ No newline at end of file
+    metrics.error(str(err))
+    
+    return responses.respond(event, 400, {"message":str(err),
+                                          "data": []})
\ No newline at end of file
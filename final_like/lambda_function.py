@@ -1,52 +1,18 @@
 import json
-import boto3
-import os
-import uuid
-import base64
-import pathlib
+import counters
 import datatier
+import metrics
+import responses
+import runtime
 
-from configparser import ConfigParser
-
+@metrics.instrument("final_like")
 def lambda_handler(event, context):
   try:
-    print("**STARTING**")
-    print("**lambda: final_like**")
-    
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    # s3_profile = 's3readwrite'
-    # boto3.setup_default_session(profile_name=s3_profile)
-    
-    # bucketname = configur.get('s3', 'bucket_name')
-    
-    # s3 = boto3.resource('s3')
-    # bucket = s3.Bucket(bucketname)
-    
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-    
     #
     # userid from event: could be a parameter
     # or could be part of URL path ("pathParameters"):
     #
-    print("**Accessing event/pathParameters**")
+    metrics.debug("**Accessing event/pathParameters**")
     
     if "assetid" in event:
       assetid = event["assetid"]
@@ -58,7 +24,7 @@ def lambda_handler(event, context):
     else:
         raise Exception("requires assetid parameter in event")
         
-    print("assetid:", assetid)
+    metrics.debug("assetid:", assetid)
   
     #
     # the user has sent us two parameters:
@@ -68,7 +34,7 @@ def lambda_handler(event, context):
     # (or API Gateway) in the body of the request
     # in JSON format.
     #
-    print("**Accessing request body**")
+    metrics.debug("**Accessing request body**")
     
     if "body" not in event:
       raise Exception("event has no body")
@@ -81,109 +47,79 @@ def lambda_handler(event, context):
 
     userid = body["userid"]
     
-    print("userid:", userid)
+    metrics.debug("userid:", userid)
 
     #
     # open connection to the database:
     #
-    print("**Opening connection**")
+    metrics.debug("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = runtime.get_dbConn()
 
     #
-    # first we need to make sure the assetid is valid:
+    # add to database, in one transaction sent as one round trip:
+    # the like is counted in one of the asset's counter slots, picked
+    # at random, so concurrent likes on a popular asset rarely wait
+    # on the same row (see counters.py). The slot is only written if
+    # the asset exists and the user may see it (public, or their
+    # own), and the like is only inserted if the slot was written.
     #
-    print("**Checking if userid is valid**")
+    metrics.debug("**Adding like to database**")
     
-    # probably include privacy here in query
     sql = """
-    SELECT userid FROM assets WHERE assetid = %s;
-    """   
+    INSERT INTO asset_like_shards (assetid, shard, likes)
+      SELECT assetid, %s, 1 FROM assets
+       WHERE assetid = %s AND uploaded = 1
+         AND (assettype = 'public' OR userid = %s)
+    ON DUPLICATE KEY UPDATE likes = likes + 1;
+    INSERT INTO likes (userid, assetid)
+      SELECT %s, %s FROM DUAL WHERE ROW_COUNT() > 0;
+    """
+    
+    shard = counters.pick_shard()
 
+    results = datatier.perform_transaction(dbConn, sql,
+                                           [shard, assetid, userid,
+                                            userid, assetid])
 
-    row = datatier.retrieve_one_row(dbConn, sql, [assetid])
-    
-    if not row:
-      print("Database operation failed... returning")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"database operation failed...",
-                            "likeid": -1})
-      }
-    
-    elif row == ():  # no such asset
-      print("**No such asset, returning...**")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"no such asset...",
-                            "likeid": -1})
-      }
-    
-    ## NEED LOGIC HERE SO ONLY DOWNLOAD IF HAS ACCESS
+    q, likeid = results[1]
 
+    if q == 0:
+      #
+      # nothing inserted: only now look at why, so the common case
+      # stays a single round trip:
+      #
+      sql = "SELECT assetid FROM assets WHERE assetid = %s AND uploaded = 1;"
 
+      row = datatier.retrieve_one_row(dbConn, sql, [assetid])
 
-    print(row)
-    
-    author_userid = row[0]
-    #privacy = row[1]
-    
-    #
-    # add to database
-    #
-    print("**Adding asset to database**")
-    
-    sql = """
-    INSERT INTO likes (userid, assetid) VALUES (%s, %s);
-    """
-    
-    q = datatier.perform_action(dbConn, sql, [userid, assetid])
+      if row == ():  # no such asset
+        metrics.debug("**No such asset, returning...**")
+        return responses.respond(event, 400, {"message":"no such asset...",
+                                              "likeid": -1})
 
-    if q == -1:
-      print("Database operation failed...")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"inserting asset failed",
-                            "likeid": -1})
-      }
-    elif q == 0:
-      print("Unexpected query failure...")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"inserting asset failed",
-                            "likeid": -1})
-      }
+      metrics.debug("**Asset is private, returning...**")
+      return responses.respond(event, 403, {"message":"forbidden...",
+                                            "likeid": -1})
     
     #
-    # grab the jobid that was auto-generated by mysql:
+    # likeid is the id mysql auto-generated for the insert, read
+    # back with the insert itself:
     #
-    sql = "SELECT LAST_INSERT_ID();"
-    
-    row = datatier.retrieve_one_row(dbConn, sql)
-    
-    likeid = row[0]
-    
-    print("likeid:", likeid)
+    metrics.debug("likeid:", likeid)
     
 
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    print("**DONE, returning assetid**")
+    metrics.debug("**DONE, returning assetid**")
     
-    return {
-          'statusCode': 200,
-          'body': json.dumps({"message":"success",
-                              "likeid": likeid})
-        }
+    return responses.respond(event, 200, {"message":"success",
+                                          "likeid": likeid})
     
   except Exception as err:
-    print("**ERROR**")
-    print(str(err))
+    metrics.error(str(err))
     
-    return {
-        'statusCode': 400,
-        'body': json.dumps({"message":str(err),
-                            "likeid": -1})
-      }
+    return responses.respond(event, 400, {"message":str(err),
+                                          "likeid": -1})
@@ -0,0 +1,109 @@
+import json
+import batch
+import counters
+import datatier
+import metrics
+import responses
+import runtime
+
+@metrics.instrument("final_likebatch")
+def lambda_handler(event, context):
+  try:
+    #
+    # the user has sent us two parameters:
+    #  1. userid of who is logged in
+    #  2. assetids, the list of assets to like
+    #
+    # The parameters are coming through web server
+    # (or API Gateway) in the body of the request
+    # in JSON format.
+    #
+    metrics.debug("**Accessing request body**")
+
+    if "body" not in event:
+      raise Exception("event has no body")
+
+    body = json.loads(event["body"]) # parse the json
+
+    if "userid" not in body:
+      raise Exception("event has a body but no userid")
+
+    userid = int(body["userid"])
+    assetids = [int(assetid) for assetid in batch.get_items(body, "assetids")]
+
+    metrics.debug("userid:", userid)
+    metrics.debug("assetids:", len(assetids))
+
+    #
+    # open connection to the database:
+    #
+    metrics.debug("**Opening connection**")
+
+    dbConn = runtime.get_dbConn()
+
+    #
+    # check every asset at once:
+    #
+    metrics.debug("**Checking assets**")
+
+    checked = batch.check_assets(dbConn, userid, assetids)
+
+    liked = [assetid for assetid in assetids if checked[assetid][0] == 200]
+
+    metrics.debug("allowed:", len(liked))
+
+    #
+    # add the likes to the database in one transaction: one
+    # multi-row INSERT for the likes, and one for the counter slots
+    # (one slot per asset, by however many times it was liked here).
+    # The slots are written in assetid order so two batches touching
+    # the same assets can't deadlock.
+    #
+    if len(liked) > 0:
+      metrics.debug("**Adding likes to database**")
+
+      per_asset = {}
+      for assetid in liked:
+        per_asset[assetid] = per_asset.get(assetid, 0) + 1
+
+      like_rows = ", ".join(["(%s, %s)"] * len(liked))
+      shard_rows = ", ".join(["(%s, %s, %s)"] * len(per_asset))
+
+      sql = f"""
+      INSERT INTO asset_like_shards (assetid, shard, likes)
+                  VALUES {shard_rows}
+      ON DUPLICATE KEY UPDATE likes = likes + VALUES(likes);
+      INSERT INTO likes (userid, assetid) VALUES {like_rows};
+      """
+
+      params = []
+      for assetid in sorted(per_asset):
+        params += [assetid, counters.pick_shard(), per_asset[assetid]]
+      for assetid in liked:
+        params += [userid, assetid]
+
+      datatier.perform_transaction(dbConn, sql, params)
+
+    #
+    # respond in an HTTP-like way, i.e. with a status
+    # code and body in JSON format; there is one result per item,
+    # in the order they were sent:
+    #
+    metrics.debug("**DONE, returning results**")
+
+    results = []
+    for assetid in assetids:
+      status, message = checked[assetid]
+      results.append({"assetid": assetid,
+                      "status": status,
+                      "message": message})
+
+    return responses.respond(event, 200, {"message":"success",
+                                          "liked": len(liked),
+                                          "results": results})
+
+  except Exception as err:
+    metrics.error(str(err))
+
+    return responses.respond(event, 400, {"message":str(err),
+                                          "results": []})
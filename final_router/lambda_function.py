@@ -0,0 +1,174 @@
+#
+# Single entry point for every /final_* route.
+#
+# Instead of deploying each final_* directory as its own lambda
+# (and paying a separate pool of cold starts for each), this
+# function is deployed with all of them bundled inside it and
+# dispatches on the API Gateway resource + method. All routes then
+# share one pool of containers and one runtime (config, boto3
+# sessions, RDS connection), so a like followed by a getlikes lands
+# on a container that is already warm.
+#
+# Deployment package layout:
+#
+#   lambda_function.py              <- this file
+#   datatier.py, runtime.py, ...    <- from shared/
+#   final_users/lambda_function.py
+#   final_assets/lambda_function.py
+#   ...
+#
+# Every invocation logs one line of JSON of the form
+#
+#   {"log": "ROUTER", "route": "final_like", "method": "POST",
+#    "cold": 0, "init_ms": 0.0, "handler_ms": 12.3, "status": 200}
+#
+# The line is nothing but JSON, so Logs Insights discovers its
+# fields, and cold is 0 or 1 so it can be summed; cold-start rate
+# and latency per route can then be pulled out of CloudWatch with
+#
+#   filter log = "ROUTER"
+#   | stats count(*) as calls, sum(cold) as colds,
+#           pct(handler_ms, 50), pct(handler_ms, 95) by route
+#
+# The route's handler also prints its own EMF metrics record, with
+# the time spent in each phase (see shared/metrics.py).
+#
+
+import json
+import time
+import importlib
+import responses
+
+_init_start = time.perf_counter()
+
+#
+# route name => allowed HTTP methods; the route name is also the
+# directory holding that route's lambda_function.py:
+#
+routes = {
+  "final_users": ["GET"],
+  "final_assets": ["GET"],
+  "final_like": ["POST"],
+  "final_comment": ["POST"],
+  "final_getlikes": ["GET"],
+  "final_getcomments": ["GET"],
+  "final_download": ["GET"],
+  "final_uploadimage": ["POST"],
+  "final_adduser": ["POST"],
+  "final_likebatch": ["POST"],
+  "final_commentbatch": ["POST"],
+  "final_counts": ["GET"],
+  "final_feed": ["GET"],
+}
+
+#
+# import every route up front, so the cost lands in the init phase
+# of a cold start rather than on whichever request comes first:
+#
+handlers = {}
+for name in routes:
+  handlers[name] = importlib.import_module(name + ".lambda_function")
+
+_init_ms = (time.perf_counter() - _init_start) * 1000
+_cold = True
+
+#
+# per-route totals for the life of this container:
+#
+route_stats = {}
+
+
+def find_route(event):
+  """
+  Works out which route an API Gateway event is for
+
+  Parameters
+  ----------
+  event: API Gateway proxy event
+
+  Returns
+  -------
+  route name, e.g. "final_like", or None if nothing matches
+  """
+
+  resource = event.get("resource") or event.get("path") or ""
+
+  # "/final_like/{assetid}" => "final_like"
+  parts = resource.strip("/").split("/")
+  name = parts[0]
+
+  if name not in routes:
+    return None
+
+  return name
+
+
+def record(name, method, cold, handler_ms, status):
+  """
+  Updates the per-route totals and logs the ROUTER line for one
+  invocation
+
+  Parameters
+  ----------
+  name: route name
+  method: HTTP method
+  cold: True if this was the container's first invocation
+  handler_ms: time spent in the route's handler
+  status: HTTP status code returned
+
+  Returns
+  -------
+  nothing
+  """
+
+  stats = route_stats.setdefault(name, {"calls": 0,
+                                        "colds": 0,
+                                        "total_ms": 0.0,
+                                        "max_ms": 0.0})
+  stats["calls"] += 1
+  stats["colds"] += 1 if cold else 0
+  stats["total_ms"] += handler_ms
+  stats["max_ms"] = max(stats["max_ms"], handler_ms)
+
+  line = {
+    "log": "ROUTER",
+    "route": name,
+    "method": method,
+    "cold": 1 if cold else 0,
+    "init_ms": round(_init_ms, 3) if cold else 0.0,
+    "handler_ms": round(handler_ms, 3),
+    "status": status,
+    "container_calls": stats["calls"]
+  }
+  print(json.dumps(line))
+
+
+def lambda_handler(event, context):
+  global _cold
+
+  cold = _cold
+  _cold = False
+
+  name = find_route(event)
+  method = event.get("httpMethod", "")
+
+  if name is None:
+    print(json.dumps({"log": "ROUTER",
+                      "route": None,
+                      "resource": event.get("resource"),
+                      "status": 404}))
+    return responses.respond(event, 404, {"message": "no such route..."})
+
+  if method and method not in routes[name]:
+    record(name, method, cold, 0.0, 405)
+    return responses.respond(event, 405, {"message": "method not allowed..."})
+
+  start = time.perf_counter()
+  status = 500
+  try:
+    response = handlers[name].lambda_handler(event, context)
+    status = response.get('statusCode', 200)
+    return response
+  finally:
+    handler_ms = (time.perf_counter() - start) * 1000
+    record(name, method, cold, handler_ms, status)
@@ -1,52 +1,100 @@
+import io
 import json
-import boto3
 import os
 import uuid
-import base64
-import pathlib
+import binascii
 import datatier
+import metrics
+import responses
+import runtime
 
-from configparser import ConfigParser
 
-def lambda_handler(event, context):
-  try:
-    print("**STARTING**")
-    print("**lambda: final_uploadimage**")
-    
-    #
-    # setup AWS based on config file:
-    #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    
-    bucketname = configur.get('s3', 'bucket_name')
-    
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucketname)
-    
+def complete_upload(event, dbConn, userid, body):
+  """
+  Second step of a presigned upload: the client has PUT the file
+  straight to S3, so check the object is there and mark the asset
+  uploaded, which makes it visible. If the object never arrived the
+  reservation is released and the client has to reserve again.
+  Completing an asset that is already uploaded just succeeds again.
+
+  Parameters
+  ----------
+  event: API Gateway proxy event being answered
+  dbConn: open database connection
+  userid: user completing the upload
+  body: parsed request body, holding the assetid
+
+  Returns
+  -------
+  HTTP-like response dictionary
+  """
+
+  if "assetid" not in body:
+    raise Exception("event has a body but no assetid")
+
+  assetid = body["assetid"]
+
+  metrics.debug("**Completing upload for assetid**", assetid)
+
+  sql = """
+  SELECT bucketkey, uploaded FROM assets WHERE assetid = %s AND userid = %s;
+  """
+
+  row = datatier.retrieve_one_row(dbConn, sql, [assetid, userid])
+
+  if row == ():  # no such reservation for this user
+    metrics.debug("**No such asset, returning...**")
+    return responses.respond(event, 400, {"message":"no such asset...",
+                                          "assetid": -1})
+
+  bucketkey = row[0]
+  uploaded = row[1]
+
+  size = runtime.object_size('s3readwrite', bucketkey)
+
+  if size is None and not uploaded:
+    metrics.debug("**Object never uploaded, releasing reservation**")
+
     #
-    # configure for RDS access
+    # a pending asset can't have likes or comments yet, so nothing
+    # refers to it:
     #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-    
+    sql = """
+    DELETE FROM assets WHERE assetid = %s AND userid = %s AND uploaded = 0;
+    """
+    datatier.perform_action(dbConn, sql, [assetid, userid])
+
+    return responses.respond(event, 400, {"message":"upload not found, reservation released",
+                                          "assetid": -1})
+
+  if not uploaded:
+    sql = """
+    UPDATE assets SET uploaded = 1, reserved_at = NULL
+     WHERE assetid = %s AND userid = %s AND uploaded = 0;
+    """
+    q = datatier.perform_action(dbConn, sql, [assetid, userid])
+
+    if q == 0:  # final_expireuploads removed it in the meantime
+      metrics.debug("**Reservation expired, returning...**")
+      return responses.respond(event, 400, {"message":"reservation expired",
+                                            "assetid": -1})
+
+  metrics.debug("**DONE, upload complete**", bucketkey, size)
+
+  return responses.respond(event, 200, {"message":"success",
+                                        "assetid": assetid,
+                                        "bucketkey": bucketkey,
+                                        "size": size})
+
+
+@metrics.instrument("final_uploadimage")
+def lambda_handler(event, context):
+  try:
     #
     # userid from event: could be a parameter
     # or could be part of URL path ("pathParameters"):
     #
-    print("**Accessing event/pathParameters**")
+    metrics.debug("**Accessing event/pathParameters**")
     
     if "userid" in event:
       userid = event["userid"]
@@ -58,98 +106,110 @@ def lambda_handler(event, context):
     else:
         raise Exception("requires userid parameter in event")
         
-    print("userid:", userid)
+    metrics.debug("userid:", userid)
   
     #
-    # the user has sent us two parameters:
+    # the user has sent us these parameters:
     #  1. filename of their file
     #  2. raw file data in base64 encoded string
+    #  3. privacy tag, "public" or "private" (optional)
+    #  4. action (optional), one of:
+    #       "upload"   -- the default, file data is in the body
+    #       "reserve"  -- no data; reserve the asset and return a
+    #                     presigned url the client PUTs the raw
+    #                     file to, straight to S3
+    #       "complete" -- the PUT is done, finalise the asset
+    #                     (body carries the assetid instead)
     #
     # The parameters are coming through web server 
     # (or API Gateway) in the body of the request
     # in JSON format.
     #
-    print("**Accessing request body**")
+    metrics.debug("**Accessing request body**")
     
     if "body" not in event:
       raise Exception("event has no body")
       
     body = json.loads(event["body"]) # parse the json
+
+    action = body.get("action", "upload")
+
+    if action not in ["upload", "reserve", "complete"]:
+      raise Exception("unknown action: " + str(action))
+
+    #
+    # open connection to the database:
+    #
+    metrics.debug("**Opening connection**")
+    
+    dbConn = runtime.get_dbConn()
+
+    if action == "complete":
+      return complete_upload(event, dbConn, userid, body)
     
-    ## SHOULD ALSO BE A PRIVACY tag in data
     if "assetname" not in body:
       raise Exception("event has a body but no filename")
-    if "data" not in body:
+    if action == "upload" and "data" not in body:
       raise Exception("event has a body but no data")
 
     assetname = body["assetname"]
-    datastr = body["data"]
-    
-    print("assetname:", assetname)
-    print("datastr (first 10 chars):", datastr[0:10])
+    assettype = body.get("assettype", "private")
 
-    #
-    # open connection to the database:
-    #
-    print("**Opening connection**")
+    if assettype not in ["public", "private"]:
+      raise Exception("assettype must be public or private")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    metrics.debug("assetname:", assetname)
+    metrics.debug("assettype:", assettype)
+    metrics.debug("action:", action)
 
     #
     # first we need to make sure the userid is valid:
     #
-    print("**Checking if userid is valid**")
+    metrics.debug("**Checking if userid is valid**")
     
     sql = "SELECT bucketfolder FROM users WHERE userid = %s;"
     
     row = datatier.retrieve_one_row(dbConn, sql, [userid])
     
     if not row:
-      print("Database operation failed... returning")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"database operation failed...",
-                            "assetid": -1})
-      }
+      metrics.debug("Database operation failed... returning")
+      return responses.respond(event, 400, {"message":"database operation failed...",
+                                            "assetid": -1})
     
     elif row == ():  # no such user
-      print("**No such user, returning...**")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"no such user...",
-                            "assetid": -1})
-      }
+      metrics.debug("**No such user, returning...**")
+      return responses.respond(event, 400, {"message":"no such user...",
+                                            "assetid": -1})
     
 
 
-    print(row)
+    metrics.debug(row)
     
     bucketfolder = row[0]
     
-    #
-    # at this point the user exists, so safe to upload to S3:
-    #
-    base64_bytes = datastr.encode()        # string -> base64 bytes
-    bytes = base64.b64decode(base64_bytes) # base64 bytes -> raw bytes
-    
-    #
-    # write raw bytes to local filesystem for upload:
-    #
-    print("**Writing local data file**")
-    
-    local_filename = "/tmp/data.pdf"
-    
-    outfile = open(local_filename, "wb")
-    outfile.write(bytes)
-    outfile.close()
+    if action == "upload":
+      #
+      # at this point the user exists, so safe to upload to S3:
+      #
+      datastr = body["data"]
+
+      metrics.debug("datastr (first 10 chars):", datastr[0:10])
+
+      #
+      # decode straight from the str: a2b_base64 reads an ASCII
+      # str in place, where b64decode would first copy it into
+      # a bytes object:
+      #
+      with metrics.span("base64"):
+        bytes = binascii.a2b_base64(datastr) # base64 string -> raw bytes
     
     #
     # generate unique filename in preparation for the S3 upload:
     #
-    print("**Uploading local file to S3**")
+    metrics.debug("**Uploading local file to S3**")
     
-    # basename = pathlib.Path(assetname).stem 
-    extension = pathlib.Path(assetname).suffix
+    # basename, extension = os.path.splitext(assetname)
+    extension = os.path.splitext(assetname)[1]
     
     if extension != ".jpg" : 
       raise Exception("expecting filename to have .jpg extension")
@@ -158,76 +218,97 @@ def lambda_handler(event, context):
     # CHANGE TO JPG
     bucketkey = bucketfolder + "/" + str(uuid.uuid4()) + ".jpg"
     
-    print("S3 bucketkey:", bucketkey)
+    metrics.debug("S3 bucketkey:", bucketkey)
     
     #
     # add to database
     #
-    print("**Adding asset to database**")
+    metrics.debug("**Adding asset to database**")
     
-    # Change sql to add privacy tag
+    #
+    # a reservation stays pending (uploaded = 0), and invisible, until
+    # "complete" finds the object in S3:
+    #
     sql = """
-    INSERT INTO assets (userid, assetname, bucketkey) VALUES (%s, %s, %s);
+    INSERT INTO assets (userid, assetname, bucketkey, assettype, uploaded,
+                        reserved_at)
+                VALUES (%s, %s, %s, %s, %s,
+                        IF(%s = 0, UTC_TIMESTAMP(), NULL));
     """
+
+    uploaded = 0 if action == "reserve" else 1
     
-    q = datatier.perform_action(dbConn, sql, [userid, assetname, bucketkey])
+    q, assetid = datatier.perform_insert(dbConn, sql,
+                                         [userid, assetname, bucketkey, assettype,
+                                          uploaded, uploaded])
 
     if q == -1:
-      print("Database operation failed...")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"inserting asset failed",
-                            "assetid": -1})
-      }
+      metrics.debug("Database operation failed...")
+      return responses.respond(event, 400, {"message":"inserting asset failed",
+                                            "assetid": -1})
     elif q == 0:
-      print("Unexpected query failure...")
-      return {
-        'statusCode': 400,
-        'body': json.dumps({"message":"inserting asset failed",
-                            "assetid": -1})
-      }
+      metrics.debug("Unexpected query failure...")
+      return responses.respond(event, 400, {"message":"inserting asset failed",
+                                            "assetid": -1})
     
     #
-    # grab the jobid that was auto-generated by mysql:
+    # assetid is the id mysql auto-generated for the insert, read
+    # back with the insert itself:
     #
-    sql = "SELECT LAST_INSERT_ID();"
-    
-    row = datatier.retrieve_one_row(dbConn, sql)
-    
-    assetid = row[0]
-    
-    print("assetid:", assetid)
+    metrics.debug("assetid:", assetid)
+
+    if action == "reserve":
+      #
+      # hand back a presigned PUT for the bucketkey; the client
+      # must send the same headers with its PUT or S3 rejects it:
+      #
+      metrics.debug("**DONE, returning presigned url**")
+
+      headers = {
+        'Content-Type': 'image/jpeg',
+        'x-amz-acl': 'public-read'
+      }
+
+      url = runtime.presigned_url('s3readwrite', 'put_object', bucketkey,
+                                  {'ContentType': headers['Content-Type'],
+                                   'ACL': headers['x-amz-acl']})
+
+      return responses.respond(event, 200, {"message":"success",
+                                            "assetid": assetid,
+                                            "bucketkey": bucketkey,
+                                            "url": url,
+                                            "headers": headers})
     
     #
     # finally, upload to S3:
     #
-    print("**Uploading data file to S3**")
+    metrics.debug("**Uploading data file to S3**")
 
-    bucket.upload_file(local_filename, 
-                       bucketkey, 
-                       ExtraArgs={
-                         'ACL': 'public-read',
-                         'ContentType': 'application/jpg' ## might be wrong here
-                       })
+    #
+    # BytesIO shares the decoded buffer rather than copying it, and
+    # upload_fileobj streams from it in chunks -- no /tmp file, so
+    # overlapping uploads can't clobber each other:
+    #
+    bucket = runtime.get_bucket('s3readwrite')
+    with metrics.span("s3"):
+      bucket.upload_fileobj(io.BytesIO(bytes),
+                            bucketkey,
+                            ExtraArgs={
+                              'ACL': 'public-read',
+                              'ContentType': 'application/jpg' ## might be wrong here
+                            })
 
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    print("**DONE, returning assetid**")
+    metrics.debug("**DONE, returning assetid**")
     
-    return {
-          'statusCode': 200,
-          'body': json.dumps({"message":"success",
-                              "assetid": assetid})
-        }
+    return responses.respond(event, 200, {"message":"success",
+                                          "assetid": assetid})
     
   except Exception as err:
-    print("**ERROR**")
-    print(str(err))
+    metrics.error(str(err))
     
-    return {
-        'statusCode': 400,
-        'body': json.dumps({"message":str(err),
-                            "assetid": -1})
-      }
+    return responses.respond(event, 400, {"message":str(err),
+                                          "assetid": -1})
@@ -1,84 +1,78 @@
-import json
-import boto3
-import os
 import datatier
+import listing
+import metrics
+import responses
+import runtime
 
-from configparser import ConfigParser
+#
+# columns a caller may ask for, and the key the listing pages on:
+#
+columns = ["userid", "email", "lastname", "firstname", "bucketfolder",
+           "username"]
+key = "userid"
 
+@metrics.instrument("final_users")
 def lambda_handler(event, context):
   try:
-    print("**STARTING**")
-    print("**lambda: final_assets**")
-    
     #
-    # setup AWS based on config file:
+    # open connection to the database:
     #
-    config_file = 'config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+    metrics.debug("**Opening connection**")
     
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for S3 access:
-    #
-    #s3_profile = 's3readonly'
-    #boto3.setup_default_session(profile_name=s3_profile)
-    #
-    #bucketname = configur.get('s3', 'bucket_name')
-    #
-    #s3 = boto3.resource('s3')
-    #bucket = s3.Bucket(bucketname)
+    dbConn = runtime.get_dbConn()
     
     #
-    # configure for RDS access
+    # now retrieve one page of the users in our users table,
+    # newest first, starting after the cursor (if any):
     #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
+    metrics.debug("**Retrieving data**")
 
-    #
-    # open connection to the database:
-    #
-    print("**Opening connection**")
-    
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    limit, after = listing.get_page_params(event)
+    fields = listing.get_fields(event, columns, key)
+    layout = listing.get_layout(event)
+
+    metrics.debug("limit:", limit, "after:", after)
+    metrics.debug("fields:", fields, "layout:", layout)
     
     #
-    # now retrieve all the users in our users table:
+    # the field names have been checked against columns, so are safe
+    # to put in the SQL; pwdhash is never one of them:
     #
-    print("**Retrieving data**")
-    
-    # could change SQL to not get password
-    sql = """
-    SELECT * FROM users ORDER BY userid DESC;
-    """ 
+    select = ", ".join(fields)
+
+    if after is None:
+      sql = f"""
+      SELECT {select} FROM users ORDER BY userid DESC LIMIT %s;
+      """
+      params = [limit + 1]
+    else:
+      sql = f"""
+      SELECT {select} FROM users WHERE userid < %s
+      ORDER BY userid DESC LIMIT %s;
+      """
+      params = [after, limit + 1]
     
-    rows = datatier.retrieve_all_rows(dbConn, sql)
+    rows = datatier.stream_rows(dbConn, sql, params)
     
-    for row in rows:
-      print(row)
+    # streamed: make_page reads limit + 1 rows and closes the cursor
+    rows, cursor = listing.make_page(rows, limit)
+
+    metrics.debug_rows(rows)
 
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
     #
-    print("**DONE, returning rows**")
+    metrics.debug("**DONE, returning rows**")
     
-    return {
-        'statusCode': 200,
-        'body': json.dumps({"message":"success",
-                            "data": rows})
-      }
+    return responses.respond(event, 200, {"message":"success",
+                                          "schema": fields,
+                                          "layout": layout,
+                                          "data": listing.make_data(fields, rows, layout),
+                                          "next": cursor})
     
   except Exception as err:
-    print("**ERROR**")
-    print(str(err))
+    metrics.error(str(err))
     
-    return {
-        'statusCode': 400,
-        'body': json.dumps({"message":str(err),
-                            "data": []})
-      }
\ No newline at end of file
+    return responses.respond(event, 400, {"message":str(err),
+                                          "data": []})
\ No newline at end of file
@@ -15,7 +15,7 @@
 #   CS 310, Project 04
 #
 
-import requests
+import apiclient
 import json
 
 import uuid
@@ -23,7 +23,6 @@ import pathlib
 import logging
 import sys
 import os
-import base64
 
 from configparser import ConfigParser
 
@@ -32,55 +31,21 @@ import matplotlib.image as img
 
 ############################################################
 #
-# classes
+# globals
 #
 
+sessions = {}
 
-class User:
-
-  def __init__(self, row):
-    self.userid = row[0]
-    self.email = row[1]
-    self.lastname = row[2]
-    self.firstname = row[3]
-    self.bucketfolder = row[4]
-    self.username = row[5]
-    self.pwdhash = row[6]
-
-
-class Image:
-
-  def __init__(self, row):
-    self.assetid = row[0]
-    self.userid = row[1]
-    self.assetname = row[2]
-    self.bucketkey = row[3]
-    self.assettype = row[4]
-
-
-class Like:
-
-  def __init__(self, row):
-    self.likeid = row[0]
-    self.userid = row[1]
-    self.assetid = row[2]
-
-
-class Comment:
-
-  def __init__(self, row):
-    self.commentid = row[0]
-    self.userid = row[1]
-    self.assetid = row[2]
-    self.comment = row[3]
-
-
-############################################################
 #
-# globals
+# pooled, retrying connection to the web service; set up in main
+# once the baseurl is known:
 #
+client = None
 
-sessions = {}
+#
+# rows to ask for per page when listing:
+#
+page_size = 25
 
 
 def load_sessions():
@@ -117,6 +82,15 @@ def get_active_session():
   return None, None
 
 
+def get_active_token():
+  """
+  Returns the token of the active session, or None
+  """
+
+  username, token = get_active_session()
+  return token
+
+
 def use_session(username):
   """
   Sets the session with the given username to active
@@ -151,6 +125,53 @@ def handle_error(url, res):
   print("  message:", res.json()["message"])
 
 
+def page_through(url, typename, fields, render, on_page=None):
+  """
+  Walks a paginated listing from the web service, rendering it one
+  page at a time. Pages are fetched lazily: after each page the user
+  is asked whether to keep going, and the next page is only
+  requested if they do.
+
+  Only the given fields are asked for, and each row arrives as a
+  namedtuple record with those fields.
+
+  Parameters
+  ----------
+  url: url of the listing
+  typename: name for the record class, e.g. "User"
+  fields: column names to ask for
+  render: function called with each record
+  on_page: optional function called with each page's records,
+    before they are rendered
+
+  Returns
+  -------
+  number of rows rendered, or None if a request failed
+  """
+
+  count = 0
+  try:
+    for rows, more in client.iter_pages(url,
+                                        typename,
+                                        fields=fields,
+                                        limit=page_size):
+      if on_page is not None:
+        on_page(rows)
+      for row in rows:
+        render(row)
+      count += len(rows)
+
+      if more:
+        print("Press ENTER for more, or 'q' to stop>")
+        if input().strip().lower() == "q":
+          break
+  except apiclient.ApiError as e:
+    handle_error(e.url, e.res)
+    return None
+
+  return count
+
+
 ############################################################
 #
 # prompt
@@ -185,6 +206,10 @@ def prompt():
   print("   10 => comment on post")
   print("   11 => get likes on post")
   print("   12 => get comments on post")
+  print("   13 => like several posts")
+  print("   14 => comment on several posts")
+  print("   15 => overview of posts")
+  print("   16 => view feed")
 
   cmd = input()
 
@@ -221,37 +246,17 @@ def get_users(baseurl):
   api = '/final_users'
   url = baseurl + api
 
-  res = requests.get(url)
-
   #
-  # let's look at what we got back:
+  # only ask for the columns we print:
   #
-  if not res.ok:
-    handle_error(url, res)
-    return
+  def render(user):
+    print(user.userid)
+    print(" ", user.username)
 
-  #
-  # deserialize and extract users:
-  #
-  body = res.json()["data"]
+  count = page_through(url, "User", ["userid", "username"], render)
 
-  #
-  # let's map each row into a User object:
-  #
-  users = []
-  for row in body:
-    user = User(row)
-    users.append(user)
-  #
-  # Now we can think OOP:
-  #
-  if len(users) == 0:
+  if count == 0:
     print("no users...")
-    return
-
-  for user in users:
-    print(user.userid)
-    print(" ", user.username)
 
   return
 
@@ -304,7 +309,7 @@ def add_user(baseurl):
   api = '/final_adduser'
   url = baseurl + api
 
-  res = requests.post(url, json=data)
+  res = client.post(url, json=data)
 
   #
   # let's look at what we got back:
@@ -362,7 +367,7 @@ def login(baseurl):
   api = '/auth'
   url = baseurl + api
 
-  res = requests.post(url, json=data)
+  res = client.post(url, json=data)
 
   #
   # let's look at what we got back:
@@ -456,48 +461,138 @@ def get_assets(baseurl):
   api = '/final_assets'
   url = baseurl + api
 
-  # passing in None for token indicates no active session and only public images should be returned
-  res = None
-  if username is not None:
-    res = requests.get(url, headers={"Authorization": "Bearer " + token})
-  else:
-    res = requests.get(url)
-
-  #
-  # let's look at what we got back:
-  #
-  if not res.ok:
-    handle_error(url, res)
-    return
-
-  #
-  # deserialize and extract images:
   #
-  body = res.json()
-  #
-  # let's map each row into an Job object:
-  #
-  images = []
-  for row in body:
-    image = Image(row)
-    images.append(image)
+  # with no active session no token is sent, so only public images
+  # are returned:
   #
-  # Now we can think OOP:
-  #
-  if len(images) == 0:
-    print("no images...")
-    return
-
-  for image in images:
+  def render(image):
     print(image.assetid)
     print(" ", image.userid)
     print(" ", image.assetname)
     print(" ", image.bucketkey)
     print(" ", image.assettype)
 
+  fields = ["assetid", "userid", "assetname", "bucketkey", "assettype"]
+  count = page_through(url, "Image", fields, render)
+
+  if count == 0:
+    print("no images...")
+
   return
 
 
+############################################################
+#
+# overview
+#
+def overview(baseurl):
+  """
+  Prints a table of the images the user can see, with the like and
+  comment counts and the latest comment of each. Each page of images
+  needs just one more request for all of its counts.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+
+  Returns
+  -------
+  nothing
+  """
+  username, token = get_active_session()
+
+  if username is None:
+    print("no action session, will only get public images...")
+
+  url = baseurl + '/final_assets'
+  counts_url = baseurl + '/final_counts'
+
+  counts = {}
+
+  def on_page(images):
+    counts.clear()
+    if len(images) == 0:
+      return
+    assetids = ",".join(str(image.assetid) for image in images)
+    res = client.get(counts_url, params={"assetids": assetids, "comments": 1})
+    if not res.ok:
+      handle_error(counts_url, res)
+      return
+    for result in res.json()["results"]:
+      counts[result["assetid"]] = result
+
+    print(f"{'assetid':>8}  {'name':<24} {'likes':>6} {'comments':>8}  latest comment")
+
+  def render(image):
+    result = counts.get(image.assetid, {})
+    likes = result.get("like_count", "?")
+    ncomments = result.get("comment_count", "?")
+    latest = ""
+    if result.get("comments"):
+      latest = result["comments"][0]["comment_body"][:40]
+    print(f"{image.assetid:>8}  {image.assetname[:24]:<24} {likes:>6} "
+          f"{ncomments:>8}  {latest}")
+
+  fields = ["assetid", "assetname"]
+  count = page_through(url, "Image", fields, render, on_page)
+
+  if count == 0:
+    print("no images...")
+
+  return
+
+
+############################################################
+#
+# view_feed
+#
+def view_feed(baseurl):
+  """
+  Shows the feed: the images the user can see, newest first, each
+  with its owner, like and comment counts and newest comments. Each
+  page of the feed is a single request.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+
+  Returns
+  -------
+  nothing
+  """
+  username, token = get_active_session()
+
+  if username is None:
+    print("No active session...")
+    return
+
+  url = baseurl + '/final_feed'
+  params = {"layout": "columnar", "limit": page_size, "comments": 3}
+
+  count = 0
+  try:
+    for body in client.iter_bodies(url, params):
+      for post in apiclient.decode_records(body, "Post"):
+        print(f"assetid {post.assetid}: {post.assetname} ({post.assettype})")
+        print(f"  by {post.username} (userid {post.userid})")
+        print(f"  {post.like_count} likes, {post.comment_count} comments")
+        for c in body["comments"].get(str(post.assetid), []):
+          print(f"    userid {c['userid']}: {c['comment_body']}")
+        print()
+        count += 1
+
+      if body.get("next"):
+        print("Press ENTER for more, or 'q' to stop>")
+        if input().strip().lower() == "q":
+          break
+  except apiclient.ApiError as e:
+    handle_error(e.url, e.res)
+    return
+
+  if count == 0:
+    print("nothing in the feed...")
+
+
 ############################################################
 #
 # like_post
@@ -524,8 +619,8 @@ def like_post(baseurl):
     # call the web service:
     #
     api = '/final_like'
-    url = baseurl + api + '/' + asset_id
-    res = requests.post(url, headers={"Authorization": "Bearer " + token})
+    url = baseurl + api + '/' + str(asset_id)
+    res = client.post(url)
     #
     # let's look at what we got back:
     #
@@ -533,7 +628,7 @@ def like_post(baseurl):
       handle_error(url, res)
       return
     else:
-      print(f"assetid {assetid} liked!!")
+      print(f"assetid {asset_id} liked!!")
 
   except Exception as e:
     logging.error("download_image failed:")
@@ -564,10 +659,8 @@ def comment(baseurl):
     comment_val = input()
     data = {"comment": comment_val}
     api = '/final_comment'
-    url = baseurl + api + '/' + asset_id
-    res = requests.post(url,
-                        json=data,
-                        headers={"Authorization": "Bearer " + token})
+    url = baseurl + api + '/' + str(asset_id)
+    res = client.post(url, json=data)
     #
     # let's look at what we got back:
     #
@@ -575,7 +668,7 @@ def comment(baseurl):
       handle_error(url, res)
       return
     else:
-      print(f"assetid {assetid} commented on!!")
+      print(f"assetid {asset_id} commented on!!")
 
   except Exception as e:
     logging.error("comment failed:")
@@ -584,6 +677,134 @@ def comment(baseurl):
     return
 
 
+def read_asset_ids():
+  """
+  Reads a list of asset ids from the user, separated by commas
+  or spaces
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  list of ints, or None if the input was not all numbers
+  """
+
+  text = input().replace(",", " ")
+  try:
+    return [int(s) for s in text.split()]
+  except ValueError:
+    return None
+
+
+def print_batch_results(results, verb):
+  """
+  Prints the per-item results of a batch request
+
+  Parameters
+  ----------
+  results: result dictionaries, one per item
+  verb: what was done, e.g. "liked"
+
+  Returns
+  -------
+  nothing
+  """
+
+  for r in results:
+    if r["status"] == 200:
+      print(f"assetid {r['assetid']} {verb}!!")
+    else:
+      print(f"assetid {r['assetid']}: failed ({r['status']}):", r["message"])
+
+
+def like_many(baseurl):
+  """
+  Likes several posts in one request, using the batch endpoint
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+
+  Returns
+  -------
+  nothing
+  """
+
+  url = baseurl + '/final_likebatch'
+  try:
+    username, token = get_active_session()
+
+    if username is None:
+      print("No active session...")
+      return
+
+    print("Liking posts as user:", username)
+    print("Enter asset ids to like, separated by commas>")
+    asset_ids = read_asset_ids()
+    if not asset_ids:
+      print("Please enter one or more numbers for the assetids to like")
+      return
+
+    results = client.post_batches(url, "assetids", asset_ids)
+    print_batch_results(results, "liked")
+
+  except apiclient.ApiError as e:
+    handle_error(e.url, e.res)
+  except Exception as e:
+    logging.error("like_many failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return
+
+
+def comment_many(baseurl):
+  """
+  Comments on several posts in one request, using the batch
+  endpoint; the user enters a comment for each post
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+
+  Returns
+  -------
+  nothing
+  """
+
+  url = baseurl + '/final_commentbatch'
+  try:
+    username, token = get_active_session()
+
+    if username is None:
+      print("No active session...")
+      return
+
+    print("Commenting on posts as user:", username)
+    print("Enter asset ids to comment on, separated by commas>")
+    asset_ids = read_asset_ids()
+    if not asset_ids:
+      print("Please enter one or more numbers for the assetids to comment on")
+      return
+
+    items = []
+    for asset_id in asset_ids:
+      print(f"enter comment for assetid {asset_id}>")
+      items.append({"assetid": asset_id, "comment": input()})
+
+    results = client.post_batches(url, "items", items)
+    print_batch_results(results, "commented on")
+
+  except apiclient.ApiError as e:
+    handle_error(e.url, e.res)
+  except Exception as e:
+    logging.error("comment_many failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return
+
+
 def get_likes(baseurl):
   try:
     username, token = get_active_session()
@@ -604,36 +825,23 @@ def get_likes(baseurl):
     # call the web service:
     #
     api = '/final_getlikes'
-    url = baseurl + api + '/' + asset_id
-    res = None
-    if username is not None:
-      res = requests.get(url, headers={"Authorization": "Bearer " + token})
-    else:
-      res = requests.get(url)
+    url = baseurl + api + '/' + str(asset_id)
 
     #
-    # let's look at what we got back:
+    # the total comes off the asset's counter, before any paging:
     #
-    if not res.ok:
-      handle_error(url, res)
-      return
-
-    body = res.json()
-
-    likes = []
-    for row in body:
-      like = Like(row)
-      likes.append(like)
-  #
-  # Now we can think OOP:
-  #
-    if len(likes) == 0:
-      print("no likes...")
-      return
+    res = client.get(url, params={"counts": 1})
+    if res.ok:
+      print("total likes:", res.json()["like_count"])
 
-    for like in likes:
+    def render(like):
       print(f"likeid: ", like.likeid)
       print(f"userid: ", like.userid)
+
+    count = page_through(url, "Like", ["likeid", "userid"], render)
+
+    if count == 0:
+      print("no likes...")
     return
 
   except Exception as e:
@@ -664,38 +872,23 @@ def get_comments(baseurl):
     # call the web service:
     #
     api = '/final_getcomments'
-    url = baseurl + api + '/' + asset_id
-    res = None
-    if username is not None:
-      res = requests.get(url, headers={"Authorization": "Bearer " + token})
-    else:
-      res = requests.get(url)
+    url = baseurl + api + '/' + str(asset_id)
 
-    #
-    # let's look at what we got back:
-    #
-    if not res.ok:
-      handle_error(url, res)
-      return
-
-    body = res.json()
+    res = client.get(url, params={"counts": 1})
+    if res.ok:
+      print("total comments:", res.json()["comment_count"])
 
-    comments = []
-    for row in body:
-      comment = Comment(row)
-      comments.append(comment)
-  #
-  # Now we can think OOP:
-  #
-    if len(comments) == 0:
-      print("no comments...")
-      return
-
-    for comment in comments:
+    def render(comment):
       print(f"likeid: ", comment.commentid)
       print(f"userid: ", comment.userid)
-      print(f"comment: ", comment.comment)
+      print(f"comment: ", comment.comment_body)
       print()
+
+    fields = ["commentid", "userid", "comment_body"]
+    count = page_through(url, "Comment", fields, render)
+
+    if count == 0:
+      print("no comments...")
     return
 
   except Exception as e:
@@ -706,6 +899,23 @@ def get_comments(baseurl):
 
 
 def upload_image(baseurl):
+  """
+  Prompts the user for a local image and uploads it for the
+  active session's user.
+
+  The upload is done in two steps: the web service reserves the
+  asset and hands back a presigned S3 url, the raw file is
+  streamed straight to S3, and then the web service is told the
+  upload is complete.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+
+  Returns
+  -------
+  nothing
+  """
   username, token = get_active_session()
 
   if username is None:
@@ -718,15 +928,9 @@ def upload_image(baseurl):
   local_filename = input()
 
   if not pathlib.Path(local_filename).is_file():
-    print("PDF file '", local_filename, "' does not exist...")
+    print("Image file '", local_filename, "' does not exist...")
     return
 
-  #
-  # build the data packet:
-  #
-  infile = open(local_filename, "rb")
-  bytes = infile.read()
-  infile.close()
   print("Should this image be public (enter '1') or private (enter '0') ?")
   val = 0
   try:
@@ -735,46 +939,57 @@ def upload_image(baseurl):
     print("please enter a number...")
     return
 
-  #
-  # now encode the pdf as base64. Note b64encode returns
-  # a bytes object, not a string. So then we have to convert
-  # (decode) the bytes -> string, and then we can serialize
-  # the string as JSON for upload to server:
-  #
-  data = base64.b64encode(bytes)
-  datastr = data.decode()
   stri = ""
   if val == 0:
     stri = "private"
   else:
     stri = "public"
 
-  data = {"filename": local_filename, "data": datastr, "assettype": stri}
-
   #
-  # call the web service:
+  # step 1: reserve the asset, getting back a presigned url:
   #
+  data = {
+    "action": "reserve",
+    "assetname": os.path.basename(local_filename),
+    "assettype": stri
+  }
+
   api = '/final_uploadimage'
   url = baseurl + api
 
-  res = requests.post(url,
-                      json=data,
-                      headers={"Authorization": "Bearer " + token})
+  res = client.post(url, json=data)
 
-  #
-  # let's look at what we got back:
-  #
   if not res.ok:
     handle_error(url, res)
     return
 
-  #
-  # success, extract jobid:
-  #
   body = res.json()
 
   asset = body["assetid"]
 
+  #
+  # step 2: stream the raw file straight to S3. requests sends an
+  # open file in chunks, so the image is never held in memory; the
+  # PUT is sent once, since a retry could not re-read the file:
+  #
+  with open(local_filename, "rb") as infile:
+    s3res = client.upload(body["url"], infile, headers=body["headers"])
+
+  if not s3res.ok:
+    print("Upload to S3 failed with status code:", s3res.status_code)
+
+  #
+  # step 3: complete the upload; if the PUT above failed this
+  # releases the reservation instead:
+  #
+  data = {"action": "complete", "assetid": asset}
+
+  res = client.post(url, json=data)
+
+  if not res.ok:
+    handle_error(url, res)
+    return
+
   print("image uploaded, assetid =", asset)
   return
 
@@ -785,10 +1000,11 @@ def upload_image(baseurl):
 #
 def download_image(baseurl):
   """
-  Prompts the user for the job id, and downloads
-  that asset (PDF).
+  Prompts the user for the asset id, and downloads
+  that asset (image).
 
-  Asset must belong to the authenticated user.
+  The web service hands back a short-lived presigned S3 url and
+  the image is streamed from S3 to disk in chunks.
 
   Parameters
   ----------
@@ -817,12 +1033,9 @@ def download_image(baseurl):
     # call the web service:
     #
     api = '/final_download'
-    url = baseurl + api + '/' + assetid
-    res = None
-    if username is not None:
-      res = requests.get(url, headers={"Authorization": "Bearer " + token})
-    else:
-      res = requests.get(url)
+    url = baseurl + api + '/' + str(asset_id)
+    params = {"mode": "url"}
+    res = client.get(url, params=params)
 
     #
     # let's look at what we got back:
@@ -832,9 +1045,19 @@ def download_image(baseurl):
       return
 
     body = res.json()
-    img_data = base64.b64decode(body["data"])
-    with open(body["asset_name"], "wb") as outfile:
-      outfile.write(img_data)
+
+    #
+    # stream the image from S3 straight to disk:
+    #
+    with client.get(body["url"], stream=True) as s3res:
+      if not s3res.ok:
+        print("Download from S3 failed with status code:",
+              s3res.status_code)
+        return
+      with open(body["asset_name"], "wb") as outfile:
+        for chunk in s3res.iter_content(chunk_size=64 * 1024):
+          outfile.write(chunk)
+
     print(f"userid: {body['user_id']}")
     print(f"asset name: {body['asset_name']}")
     print(f"bucket key: {body['bucket_key']}")
@@ -899,7 +1122,7 @@ def reset_everything(baseurl):
   api = '/reset'
   url = baseurl + api
 
-  res = requests.delete(url)
+  res = client.delete(url)
 
   #
   # let's look at what we got back:
@@ -975,6 +1198,22 @@ try:
   if lastchar == "/":
     baseurl = baseurl[:-1]
 
+  #
+  # one pooled connection to the web service for the whole session;
+  # timeouts and retries can be tuned in the [client] section:
+  #
+  client = apiclient.ApiClient(
+    baseurl,
+    token_source=get_active_token,
+    timeout=configur.getfloat('client', 'timeout', fallback=30.0),
+    connect_timeout=configur.getfloat('client',
+                                      'connect_timeout',
+                                      fallback=5.0),
+    retries=configur.getint('client', 'retries', fallback=3),
+    backoff=configur.getfloat('client', 'backoff', fallback=0.5))
+
+  page_size = configur.getint('client', 'page_size', fallback=page_size)
+
   #
   # load previous sessions:
   #
@@ -987,7 +1226,8 @@ try:
 
   fns = [
     None, get_users, add_user, login, switch_user, get_assets, upload_image,
-    download_image, reset_sessions, like_post, comment, get_likes, get_comments
+    download_image, reset_sessions, like_post, comment, get_likes, get_comments,
+    like_many, comment_many, overview, view_feed
   ]
 
   try:
@@ -0,0 +1,61 @@
+--
+-- 0001_base.sql
+--
+-- The tables the lambdas use, as they exist in the RDS database.
+-- Everything is IF NOT EXISTS, so this can be run against the
+-- existing database as well as a fresh one (e.g. a local MySQL for
+-- testing).
+--
+-- Migrations in this directory are applied in order of their number,
+-- by tools/migrate.py, which records each one in schema_migrations:
+--
+--   python tools/migrate.py --config config.ini
+--
+
+CREATE TABLE IF NOT EXISTS users
+(
+  userid        int not null AUTO_INCREMENT,
+  email         varchar(128) not null,
+  lastname      varchar(64) not null,
+  firstname     varchar(64) not null,
+  bucketfolder  varchar(48) not null,  -- random, unique name (UUID)
+  username      varchar(64) not null,
+  pwdhash       varchar(256) not null,
+  PRIMARY KEY   (userid),
+  UNIQUE        (email),
+  UNIQUE        (username),
+  UNIQUE        (bucketfolder)
+);
+
+CREATE TABLE IF NOT EXISTS assets
+(
+  assetid      int not null AUTO_INCREMENT,
+  userid       int not null,
+  assetname    varchar(128) not null,  -- original name from user
+  bucketkey    varchar(128) not null,  -- random, unique name in bucket
+  assettype    varchar(8) not null default 'private',  -- public / private
+  PRIMARY KEY  (assetid),
+  FOREIGN KEY  (userid) REFERENCES users(userid),
+  UNIQUE       (bucketkey)
+);
+
+CREATE TABLE IF NOT EXISTS likes
+(
+  likeid       int not null AUTO_INCREMENT,
+  userid       int not null,
+  assetid      int not null,
+  PRIMARY KEY  (likeid),
+  FOREIGN KEY  (userid) REFERENCES users(userid),
+  FOREIGN KEY  (assetid) REFERENCES assets(assetid)
+);
+
+CREATE TABLE IF NOT EXISTS comments
+(
+  commentid     int not null AUTO_INCREMENT,
+  userid        int not null,
+  assetid       int not null,
+  comment_body  varchar(1024) not null,
+  PRIMARY KEY   (commentid),
+  FOREIGN KEY   (userid) REFERENCES users(userid),
+  FOREIGN KEY   (assetid) REFERENCES assets(assetid)
+);
@@ -0,0 +1,21 @@
+--
+-- 0002_asset_counters.sql
+--
+-- Adds like and comment counters to assets, so a post's popularity
+-- can be read off its own row instead of counting likes/comments.
+-- final_like and final_comment bump them in the same transaction as
+-- the insert.
+--
+-- The backfill below is only correct while no likes or comments are
+-- being written; run it with the like/comment routes idle.
+--
+
+ALTER TABLE assets
+  ADD COLUMN like_count int not null default 0,
+  ADD COLUMN comment_count int not null default 0;
+
+UPDATE assets
+   SET like_count = (SELECT COUNT(*) FROM likes
+                      WHERE likes.assetid = assets.assetid),
+       comment_count = (SELECT COUNT(*) FROM comments
+                         WHERE comments.assetid = assets.assetid);
@@ -0,0 +1,22 @@
+--
+-- 0003_like_shards.sql
+--
+-- Sharded like counters. A like adds 1 to one of a few slots for
+-- the asset, picked at random, instead of to assets.like_count, so
+-- likes on a hot asset spread over several rows rather than queueing
+-- on one row lock. An asset's like count is
+--
+--   assets.like_count + SUM(asset_like_shards.likes)
+--
+-- and final_compactlikes periodically folds the slots back into
+-- assets.like_count.
+--
+
+CREATE TABLE IF NOT EXISTS asset_like_shards
+(
+  assetid      int not null,
+  shard        tinyint not null,
+  likes        int not null default 0,
+  PRIMARY KEY  (assetid, shard),
+  FOREIGN KEY  (assetid) REFERENCES assets(assetid)
+);
@@ -0,0 +1,16 @@
+--
+-- 0004_asset_visibility_indexes.sql
+--
+-- Indexes behind the "assets this user can see" query (see
+-- shared/visibility.py). A user sees the public assets plus their
+-- own; each half is a range scan, in assetid order, on one of these:
+--
+--   public: (assettype, assetid)  -- assettype = 'public' AND assetid > ?
+--   own:    (userid, assetid)     -- userid = ? AND assetid > ?
+--
+-- so a page costs two short index scans however many assets there
+-- are. (userid, assetid) also serves the userid foreign key.
+--
+
+CREATE INDEX assets_assettype_assetid ON assets (assettype, assetid);
+CREATE INDEX assets_userid_assetid ON assets (userid, assetid);
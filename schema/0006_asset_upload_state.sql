@@ -0,0 +1,31 @@
+--
+-- 0006_asset_upload_state.sql
+--
+-- Marks assets whose upload hasn't finished. A presigned upload
+-- (final_uploadimage, action "reserve") inserts the asset with
+-- uploaded = 0 and the time of the reservation; "complete" sets
+-- uploaded = 1 once the object is in S3. Until then the asset is
+-- invisible: not listed, counted, liked, commented on or downloaded.
+-- Reservations never completed are removed by final_expireuploads.
+--
+-- Every existing asset, and every one inserted without naming the
+-- column, is uploaded.
+--
+-- The visibility indexes from 0004 gain the uploaded column, so a
+-- page is still two index range scans with pending assets skipped
+-- in the index; (uploaded, reserved_at) finds expired reservations.
+--
+
+ALTER TABLE assets
+  ADD COLUMN uploaded tinyint not null default 1,
+  ADD COLUMN reserved_at datetime null;
+
+CREATE INDEX assets_assettype_uploaded_assetid
+  ON assets (assettype, uploaded, assetid);
+CREATE INDEX assets_userid_uploaded_assetid
+  ON assets (userid, uploaded, assetid);
+
+DROP INDEX assets_assettype_assetid ON assets;
+DROP INDEX assets_userid_assetid ON assets;
+
+CREATE INDEX assets_uploaded_reserved_at ON assets (uploaded, reserved_at);
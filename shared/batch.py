@@ -0,0 +1,91 @@
+#
+# Shared parts of the batch lambdas (final_likebatch,
+# final_commentbatch), which take many assets in one request.
+#
+# Every asset in a batch is checked with one IN query, and each item
+# gets its own result: a status code and message, as the single-asset
+# lambda would have returned for it. The items that pass are then
+# written together, in one transaction.
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+import datatier
+
+#
+# most items one request may carry; bigger batches should be split
+# by the client (see ApiClient.post_batches):
+#
+max_items = 100
+
+
+def get_items(body, name):
+  """
+  Reads the list of items from a batch request body
+
+  Parameters
+  ----------
+  body: parsed JSON body
+  name: key holding the list, e.g. "assetids"
+
+  Returns
+  -------
+  the list
+  """
+
+  if name not in body:
+    raise Exception("event has a body but no " + name)
+
+  items = body[name]
+
+  if not isinstance(items, list) or len(items) == 0:
+    raise Exception(name + " must be a non-empty list")
+  if len(items) > max_items:
+    raise Exception(name + " may hold at most " + str(max_items) + " items")
+
+  return items
+
+
+def check_assets(dbConn, userid, assetids):
+  """
+  Checks that each asset exists and that the user may see it (it is
+  public, or their own), with one query for all of them. An asset
+  whose upload hasn't finished counts as not existing.
+
+  Parameters
+  ----------
+  dbConn: database connection
+  userid: user making the request, as an int
+  assetids: list of asset ids, as ints
+
+  Returns
+  -------
+  dictionary assetid => (status, message): 200 if the asset may be
+  written to, 400 if there is no such asset, 403 if it is private
+  """
+
+  unique = sorted(set(assetids))
+  marks = ", ".join(["%s"] * len(unique))
+
+  sql = f"""
+  SELECT assetid, userid, assettype FROM assets
+   WHERE assetid IN ({marks}) AND uploaded = 1;
+  """
+
+  rows = datatier.retrieve_all_rows(dbConn, sql, unique)
+
+  found = {}
+  for row in rows:
+    found[row[0]] = (row[1], row[2])
+
+  checked = {}
+  for assetid in unique:
+    if assetid not in found:
+      checked[assetid] = (400, "no such asset...")
+    elif found[assetid][1] != "public" and found[assetid][0] != userid:
+      checked[assetid] = (403, "forbidden...")
+    else:
+      checked[assetid] = (200, "success")
+
+  return checked
@@ -0,0 +1,45 @@
+#
+# Sharded like counters (see schema/0003_like_shards.sql).
+#
+# A like is counted by adding 1 to a randomly chosen slot in
+# asset_like_shards, so concurrent likes on one asset mostly land on
+# different rows and don't wait on each other's locks. Reads add the
+# slots to the compacted total kept in assets.like_count.
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+import random
+
+#
+# slots per asset; more slots means less contention on a hot asset
+# but more rows to sum on read. Changing it is safe at any time,
+# since reads sum whatever slots exist:
+#
+like_shards = 16
+
+#
+# SQL expression for an asset's full like count, for a query over
+# "assets a". SUM() is a DECIMAL in MySQL, which json can't encode,
+# so the total is cast back to an integer:
+#
+like_count_sql = """CAST(a.like_count + COALESCE(
+  (SELECT SUM(s.likes) FROM asset_like_shards s WHERE s.assetid = a.assetid),
+  0) AS SIGNED)"""
+
+
+def pick_shard():
+  """
+  Picks the slot a like is added to
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  shard number, 0 <= shard < like_shards
+  """
+
+  return random.randrange(like_shards)
@@ -0,0 +1,450 @@
+#
+# datatier.py
+#
+# Executes SQL queries against the given MySQL database.
+#
+# This is v2 of the CS 310 datatier module, and replaces the copy
+# that used to be dropped into each deployment package. It keeps
+# the original API (get_dbConn, retrieve_one_row, retrieve_all_rows,
+# perform_action) and adds:
+#
+#   perform_insert -- INSERT that also returns the auto-generated id,
+#                     read off the same execution instead of a second
+#                     "SELECT LAST_INSERT_ID();" round trip
+#   perform_many   -- executemany for bulk writes; pymysql folds an
+#                     INSERT ... VALUES into one multi-row statement
+#   stream_rows    -- unbuffered server-side cursor, yielding rows as
+#                     they arrive rather than fetching them all
+#   perform_transaction -- several statements as one transaction, sent
+#                     in a single round trip
+#
+# get_dbConn now hands out connections from a small pool, and
+# release_dbConn gives them back for reuse.
+#
+# Each query is timed as a phase of the current invocation (see
+# metrics.py), named by its statement and table, e.g. "sql SELECT
+# assets".
+#
+
+import threading
+
+import metrics
+import pymysql
+import pymysql.cursors
+
+#
+# idle connections kept per database:
+#
+pool_size = 4
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+##################################################################
+#
+# get_dbConn
+#
+# Returns a connection to the database, reusing an idle one from
+# the pool if there is one. Give it back with release_dbConn() when
+# done, or close() it to drop it.
+#
+def get_dbConn(endpoint, portnum, username, pwd, dbname):
+  """
+  Opens and returns a connection object for interacting
+  with a MySQL database.
+
+  Parameters
+  ----------
+  endpoint : machine name or IP address of server
+  portnum : server port #
+  username : user name for login
+  pwd : user password for login
+  dbname : database name
+
+  Returns
+  -------
+  a connection object
+  """
+
+  key = (endpoint, portnum, username, dbname)
+
+  with _pool_lock:
+    idle = _pool.get(key, [])
+    while len(idle) > 0:
+      dbConn = idle.pop()
+      if dbConn.open:
+        return dbConn
+
+  try:
+    dbConn = pymysql.connect(host=endpoint,
+                             port=portnum,
+                             user=username,
+                             passwd=pwd,
+                             database=dbname,
+                             #
+                             # allow execution of a query string with multiple SQL queries:
+                             #
+                             client_flag=pymysql.constants.CLIENT.MULTI_STATEMENTS)
+    dbConn._datatier_key = key
+    return dbConn
+  except Exception as err:
+    print("datatier.get_dbConn() failed:")
+    print(str(err))
+    raise
+
+
+##################################################################
+#
+# release_dbConn
+#
+# Gives a connection from get_dbConn() back to the pool. Anything
+# left uncommitted is rolled back first, so the next user starts
+# clean. If the pool is full, or the connection is broken, it is
+# closed instead.
+#
+def release_dbConn(dbConn):
+  """
+  Returns a connection to the pool for reuse.
+
+  Parameters
+  ----------
+  dbConn : connection from get_dbConn()
+
+  Returns
+  -------
+  nothing
+  """
+
+  key = getattr(dbConn, "_datatier_key", None)
+
+  if key is None or not dbConn.open:
+    if dbConn.open:
+      dbConn.close()
+    return
+
+  try:
+    dbConn.rollback()
+  except Exception:
+    dbConn.close()
+    return
+
+  with _pool_lock:
+    idle = _pool.setdefault(key, [])
+    if len(idle) < pool_size:
+      idle.append(dbConn)
+      return
+
+  dbConn.close()
+
+
+##################################################################
+#
+# retrieve_one_row
+#
+# Executes the given SQL query and returns one row, or () if no
+# row was found.
+#
+def retrieve_one_row(dbConn, sql, parameters = []):
+  """
+  Executes an sql SELECT query against the database connection
+  and returns the first row retrieved by the query.  If the query
+  returns no data, () is returned.
+
+  Parameters
+  ----------
+  dbConn : connection object returned by get_dbConn
+  sql : query string to execute
+  parameters : optional list of parameters to the query
+
+  Returns
+  -------
+  a row, or () if no data was found
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    with metrics.span(metrics.sql_name(sql)):
+      dbCursor.execute(sql, parameters)
+      row = dbCursor.fetchone()
+    if row is None:
+      return ()
+    else:
+      return row
+  except Exception as err:
+    print("datatier.retrieve_one_row() failed:")
+    print(str(err))
+    raise
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# retrieve_all_rows
+#
+# Executes the given SQL query and returns all rows, or [] if no
+# rows were found.
+#
+def retrieve_all_rows(dbConn, sql, parameters = []):
+  """
+  Executes an sql SELECT query against the database connection
+  and returns all rows retrieved by the query.  If the query
+  returns no data, [] is returned.
+
+  Parameters
+  ----------
+  dbConn : connection object returned by get_dbConn
+  sql : query string to execute
+  parameters : optional list of parameters to the query
+
+  Returns
+  -------
+  a list of 0 or more rows
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    with metrics.span(metrics.sql_name(sql)):
+      dbCursor.execute(sql, parameters)
+      rows = dbCursor.fetchall()
+    if rows is None:
+      return []
+    else:
+      return rows
+  except Exception as err:
+    print("datatier.retrieve_all_rows() failed:")
+    print(str(err))
+    raise
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# stream_rows
+#
+# Executes the given SQL query through an unbuffered server-side
+# cursor and yields the rows one at a time as they come off the
+# wire, so a large result is never held in memory all at once.
+#
+# The connection cannot run another query until the generator is
+# exhausted or closed; closing it early discards the unread rows.
+#
+def stream_rows(dbConn, sql, parameters = []):
+  """
+  Executes an sql SELECT query against the database connection
+  and yields the rows retrieved by the query, one by one.
+
+  Parameters
+  ----------
+  dbConn : connection object returned by get_dbConn
+  sql : query string to execute
+  parameters : optional list of parameters to the query
+
+  Yields
+  ------
+  each row in turn
+  """
+
+  dbCursor = dbConn.cursor(pymysql.cursors.SSCursor)
+  name = metrics.sql_name(sql)
+
+  try:
+    with metrics.span(name):
+      dbCursor.execute(sql, parameters)
+    while True:
+      with metrics.span(name, calls=0):
+        row = dbCursor.fetchone()
+      if row is None:
+        return
+      yield row
+  except Exception as err:
+    print("datatier.stream_rows() failed:")
+    print(str(err))
+    raise
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# perform_action
+#
+# Executes the given SQL query (e.g. insert, update, delete) and
+# returns the # of rows modified.
+#
+def perform_action(dbConn, sql, parameters = []):
+  """
+  Executes an sql ACTION query (insert, update, delete) against
+  the database connection, and returns the # of rows modified.
+
+  Parameters
+  ----------
+  dbConn : connection object returned by get_dbConn
+  sql : query string to execute
+  parameters : optional list of parameters to the query
+
+  Returns
+  -------
+  # of rows modified
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    with metrics.span(metrics.sql_name(sql)):
+      dbCursor.execute(sql, parameters)
+      dbConn.commit()
+    return dbCursor.rowcount
+  except Exception as err:
+    dbConn.rollback()
+    print("datatier.perform_action() failed:")
+    print(str(err))
+    raise
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# perform_insert
+#
+# Executes the given INSERT and returns the # of rows inserted
+# along with the id MySQL generated for it, both taken from the
+# same execution.
+#
+def perform_insert(dbConn, sql, parameters = []):
+  """
+  Executes an sql INSERT against the database connection, and
+  returns the # of rows inserted and the auto-generated id.
+
+  Parameters
+  ----------
+  dbConn : connection object returned by get_dbConn
+  sql : query string to execute
+  parameters : optional list of parameters to the query
+
+  Returns
+  -------
+  (# of rows inserted, auto-generated id); for a multi-row INSERT
+  the id is that of the first row
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    with metrics.span(metrics.sql_name(sql)):
+      dbCursor.execute(sql, parameters)
+      dbConn.commit()
+    return dbCursor.rowcount, dbCursor.lastrowid
+  except Exception as err:
+    dbConn.rollback()
+    print("datatier.perform_insert() failed:")
+    print(str(err))
+    raise
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# perform_many
+#
+# Executes the given SQL once per set of parameters, as a single
+# batch, and returns the total # of rows modified.
+#
+def perform_many(dbConn, sql, parameter_list):
+  """
+  Executes an sql ACTION query once for each set of parameters,
+  as one batch in one transaction, and returns the total # of rows
+  modified. For INSERT ... VALUES (...) pymysql sends the whole
+  batch as one multi-row statement.
+
+  Parameters
+  ----------
+  dbConn : connection object returned by get_dbConn
+  sql : query string to execute
+  parameter_list : list of parameter lists, one per execution
+
+  Returns
+  -------
+  # of rows modified
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    with metrics.span(metrics.sql_name(sql)):
+      dbCursor.executemany(sql, parameter_list)
+      dbConn.commit()
+    return dbCursor.rowcount
+  except Exception as err:
+    dbConn.rollback()
+    print("datatier.perform_many() failed:")
+    print(str(err))
+    raise
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# perform_transaction
+#
+# Executes the given SQL statements (separated by ;) as one
+# transaction, sent to the server in a single round trip, and
+# returns the # of rows modified and the auto-generated id for each
+# statement. Either every statement takes effect or none does.
+#
+# The connection was opened with MULTI_STATEMENTS, so the server runs
+# START TRANSACTION, the statements and COMMIT back to back; a later
+# statement can look at an earlier one's effect through ROW_COUNT()
+# or LAST_INSERT_ID().
+#
+def perform_transaction(dbConn, sql, parameters = []):
+  """
+  Executes one or more sql ACTION queries against the database
+  connection, as a single transaction, and returns what each did.
+
+  Parameters
+  ----------
+  dbConn : connection object returned by get_dbConn
+  sql : query string to execute, statements separated by ;
+  parameters : optional list of parameters to the query, for all
+    the statements in order
+
+  Returns
+  -------
+  list of (# of rows modified, auto-generated id), one per statement
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    body = sql.strip().rstrip(";")
+
+    with metrics.span(metrics.sql_name(sql)):
+      dbCursor.execute("START TRANSACTION; " + body + "; COMMIT;", parameters)
+
+      #
+      # one result per statement; an error in any of them is raised
+      # when its result is read:
+      #
+      results = []
+      while True:
+        results.append((dbCursor.rowcount, dbCursor.lastrowid))
+        if not dbCursor.nextset():
+          break
+
+    # drop the START TRANSACTION and COMMIT results:
+    return results[1:-1]
+  except Exception as err:
+    dbConn.rollback()
+    print("datatier.perform_transaction() failed:")
+    print(str(err))
+    raise
+  finally:
+    dbCursor.close()
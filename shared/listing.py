@@ -0,0 +1,255 @@
+#
+# Keyset pagination and column projection for the listing lambdas.
+#
+# A listing is paged with two optional query string parameters:
+#
+#   limit  -- rows per page (default 100, at most 1000)
+#   cursor -- opaque value from the "next" field of the previous
+#             page; omit it for the first page
+#
+# The cursor wraps the key of the last row sent, and the next page
+# is fetched with "WHERE key > last ORDER BY key LIMIT n" (or < for
+# a descending listing). Unlike OFFSET, every page is a short index
+# range scan no matter how deep into the listing it is.
+#
+# Two more optional parameters shape what comes back:
+#
+#   fields -- comma-separated columns to return, e.g. "userid,username";
+#             only a listing's own allowed columns may be named, and
+#             its key column is always included (first)
+#   layout -- "rows" (default): data is a list of rows
+#             "columnar": data is one list per column, which is
+#             smaller on the wire and quicker to parse
+#
+# Either way the body carries a "schema" naming the columns in order,
+# so the client can map values by name rather than position.
+#
+# A listing that keeps a counter for its rows (likes and comments, on
+# the asset) also takes "counts=1", which returns just that count
+# instead of a page of rows.
+#
+# The rows on each page are counted in the invocation's metrics
+# record (see metrics.py).
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+import base64
+import itertools
+import json
+import metrics
+
+default_limit = 100
+max_limit = 1000
+
+
+def encode_cursor(key):
+  """
+  Wraps the key of the last row on a page into an opaque cursor
+
+  Parameters
+  ----------
+  key: key value of the last row sent
+
+  Returns
+  -------
+  cursor string
+  """
+
+  raw = json.dumps({"after": key}).encode()
+  return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+  """
+  Unwraps a cursor made by encode_cursor()
+
+  Parameters
+  ----------
+  cursor: cursor string from the client
+
+  Returns
+  -------
+  key value the next page starts after
+  """
+
+  try:
+    raw = base64.urlsafe_b64decode(cursor.encode())
+    return json.loads(raw)["after"]
+  except Exception:
+    raise Exception("invalid cursor")
+
+
+def get_page_params(event):
+  """
+  Reads the paging parameters from the event's query string
+
+  Parameters
+  ----------
+  event: API Gateway proxy event
+
+  Returns
+  -------
+  (limit, after) where after is None for the first page
+  """
+
+  query = event.get("queryStringParameters") or {}
+
+  limit = default_limit
+  if "limit" in query:
+    try:
+      limit = int(query["limit"])
+    except ValueError:
+      raise Exception("limit must be a number")
+    if limit < 1:
+      raise Exception("limit must be at least 1")
+    limit = min(limit, max_limit)
+
+  after = None
+  if query.get("cursor"):
+    after = decode_cursor(query["cursor"])
+
+  return limit, after
+
+
+def make_page(rows, limit, key_index=0):
+  """
+  Cuts the rows of a page query down to one page and works out the
+  cursor for the next. The query should ask for limit + 1 rows: if
+  the extra row came back there is another page.
+
+  rows may be an iterator, e.g. from datatier.stream_rows(); only
+  limit + 1 rows are read from it, and it is closed afterwards so
+  the connection is free for the next query.
+
+  Parameters
+  ----------
+  rows: rows returned for "LIMIT limit + 1", as a list or iterator
+  limit: rows per page
+  key_index: position of the key column in each row
+
+  Returns
+  -------
+  (rows, next) where next is the cursor for the following page,
+  or None if this is the last page
+  """
+
+  it = iter(rows)
+
+  try:
+    page = list(itertools.islice(it, limit))
+    more = next(it, None) is not None
+  finally:
+    if hasattr(it, "close"):
+      it.close()
+
+  metrics.count("rows", len(page))
+
+  if not more or len(page) == 0:
+    return page, None
+
+  return page, encode_cursor(page[-1][key_index])
+
+
+def get_fields(event, columns, key):
+  """
+  Reads the "fields" query parameter, checking every name against
+  the listing's allowed columns. The names are safe to put into
+  the SELECT once they have passed this check.
+
+  Parameters
+  ----------
+  event: API Gateway proxy event
+  columns: allowed column names, in default order
+  key: the listing's key column, always returned first
+
+  Returns
+  -------
+  list of column names to select
+  """
+
+  query = event.get("queryStringParameters") or {}
+
+  if not query.get("fields"):
+    requested = list(columns)
+  else:
+    requested = [f.strip() for f in query["fields"].split(",") if f.strip()]
+
+  for field in requested:
+    if field not in columns:
+      raise Exception("unknown field: " + field)
+
+  fields = [key]
+  for field in requested:
+    if field not in fields:
+      fields.append(field)
+
+  return fields
+
+
+def get_layout(event):
+  """
+  Reads the "layout" query parameter
+
+  Parameters
+  ----------
+  event: API Gateway proxy event
+
+  Returns
+  -------
+  "rows" or "columnar"
+  """
+
+  query = event.get("queryStringParameters") or {}
+  layout = query.get("layout", "rows")
+
+  if layout not in ["rows", "columnar"]:
+    raise Exception("layout must be rows or columnar")
+
+  return layout
+
+
+def get_counts_only(event):
+  """
+  Reads the "counts" query parameter
+
+  Parameters
+  ----------
+  event: API Gateway proxy event
+
+  Returns
+  -------
+  True if only the count is wanted, False for a page of rows
+  """
+
+  query = event.get("queryStringParameters") or {}
+  counts = query.get("counts", "0").lower()
+
+  if counts not in ["0", "1", "false", "true"]:
+    raise Exception("counts must be 0 or 1")
+
+  return counts in ["1", "true"]
+
+
+def make_data(fields, rows, layout):
+  """
+  Lays out a page of rows for the response body
+
+  Parameters
+  ----------
+  fields: column names, in the order they were selected
+  rows: the page's rows
+  layout: "rows" or "columnar"
+
+  Returns
+  -------
+  list of rows, or list of columns
+  """
+
+  if layout == "columnar":
+    if len(rows) == 0:
+      return [[] for field in fields]
+    return [list(column) for column in zip(*rows)]
+
+  return rows
@@ -0,0 +1,369 @@
+#
+# Timing and logging for the final_* lambda functions.
+#
+# Each handler's lambda_handler is wrapped with instrument(), and the
+# phases of an invocation are timed with span():
+#
+#   @metrics.instrument("final_users")
+#   def lambda_handler(event, context):
+#     ...
+#     with metrics.span("s3"):
+#       bucket.upload_fileobj(...)
+#
+# The shared modules time their own phases: runtime (config, connect,
+# s3_setup, s3), datatier (one span per query, e.g. "sql SELECT
+# assets"), listing (rows) and responses (serialize). Span times are
+# exclusive, so time spent parsing the config inside get_dbConn counts
+# under config only; whatever no span covers is "other".
+#
+# At the end of every invocation one line of CloudWatch embedded
+# metric format (EMF) is printed:
+#
+#   {"_aws": {"Timestamp": ..., "CloudWatchMetrics": [{"Namespace":
+#    "final", "Dimensions": [["Function"]], "Metrics": [...]}]},
+#    "Function": "final_users", "Duration": 14.2, "config": 0.0,
+#    "connect": 0.3, "sql SELECT users": 11.9, "serialize": 0.8,
+#    "other": 1.2, "rows": 100, "StatusCode": 200, "Cold": 0, ...}
+#
+# CloudWatch turns each of Duration, the phases and the counts into
+# a metric per Function, without any extra API calls, so dashboards
+# can show where handler time goes.
+#
+# Progress messages go through debug() / info() / error() rather than
+# print(), and are only printed at or above LOG_LEVEL (environment,
+# default INFO). Row-by-row dumps use debug_rows(), which costs
+# nothing unless LOG_LEVEL is DEBUG.
+#
+# Outside an instrumented invocation (tools/, local scripts) spans
+# and counts are ignored. What the last invocation on a thread
+# recorded is kept for last_invocation(), which bench/handlers.py
+# reads rather than timing the handlers itself.
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+levels = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+log_level = levels.get(os.environ.get("LOG_LEVEL", "INFO").upper(), 20)
+
+namespace = os.environ.get("METRICS_NAMESPACE", "final")
+
+#
+# per thread: the invocation being recorded (or None), the stack
+# of open spans, and the last invocation emitted:
+#
+_local = threading.local()
+
+_cold = True
+
+#
+# names for SQL statements, by statement text:
+#
+_sql_names = {}
+_sql_names_max = 256
+
+
+##################################################################
+#
+# invocations
+#
+
+def instrument(function):
+  """
+  Decorator for a lambda_handler: records the invocation's spans and
+  counts, and prints one EMF record when it returns. If an invocation
+  is already being recorded on this thread (a handler called from
+  the router), the inner handler is simply run as part of it.
+
+  Parameters
+  ----------
+  function: name for the Function dimension, e.g. "final_users"
+
+  Returns
+  -------
+  decorator
+  """
+
+  def decorator(handler):
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+      if getattr(_local, "record", None) is not None:
+        return handler(event, context)
+
+      _local.record = {"spans": {}, "calls": {}, "counts": {},
+                       "properties": {}}
+      _local.stack = []
+
+      start = time.perf_counter()
+      status = 500
+      try:
+        response = handler(event, context)
+        status = response.get("statusCode", 200)
+        return response
+      finally:
+        duration = (time.perf_counter() - start) * 1000
+        record = _local.record
+        _local.record = None
+        emit(function, record, duration, status, context)
+
+    return wrapper
+
+  return decorator
+
+
+def emit(function, record, duration, status, context):
+  """
+  Prints the EMF record for one invocation
+
+  Parameters
+  ----------
+  function: value of the Function dimension
+  record: what the invocation recorded
+  duration: total time in the handler, ms
+  status: HTTP status code returned
+  context: lambda context, or None
+
+  Returns
+  -------
+  nothing
+  """
+
+  global _cold
+
+  spans = record["spans"]
+  other = max(0.0, duration - sum(spans.values()))
+
+  names = [{"Name": "Duration", "Unit": "Milliseconds"}]
+  names += [{"Name": name, "Unit": "Milliseconds"} for name in spans]
+  names += [{"Name": "other", "Unit": "Milliseconds"}]
+  names += [{"Name": name, "Unit": "Count"} for name in record["counts"]]
+
+  line = {
+    "_aws": {
+      "Timestamp": int(time.time() * 1000),
+      "CloudWatchMetrics": [{
+        "Namespace": namespace,
+        "Dimensions": [["Function"]],
+        "Metrics": names
+      }]
+    },
+    "Function": function,
+    "Duration": round(duration, 3)
+  }
+
+  for name, ms in spans.items():
+    line[name] = round(ms, 3)
+  line["other"] = round(other, 3)
+  line.update(record["counts"])
+
+  _local.last = {
+    "duration": duration,
+    "spans": dict(spans, other=other),
+    "calls": dict(record["calls"]),
+    "counts": dict(record["counts"]),
+    "status": status
+  }
+
+  line["Calls"] = record["calls"]
+  line["StatusCode"] = status
+  line["Cold"] = 1 if _cold else 0
+  line.update(record["properties"])
+
+  if context is not None:
+    line["RequestId"] = getattr(context, "aws_request_id", None)
+
+  _cold = False
+
+  print(json.dumps(line, default=str))
+
+
+def last_invocation():
+  """
+  Returns what the last invocation emitted on this thread recorded,
+  or None if there has not been one
+
+  Returns
+  -------
+  dictionary with "duration" (ms), "spans" (phase => exclusive ms,
+  including "other"), "calls", "counts" and "status"
+  """
+
+  return getattr(_local, "last", None)
+
+
+##################################################################
+#
+# spans and counts
+#
+
+@contextlib.contextmanager
+def span(name, calls=1):
+  """
+  Times the enclosed block as the named phase of the current
+  invocation. Time in spans nested inside it is taken out, so it
+  is not counted twice.
+
+  Parameters
+  ----------
+  name: phase name, e.g. "s3"
+  calls: how many calls to count for the phase, e.g. 0 when timing
+    one more piece of work for a call already counted
+  """
+
+  record = getattr(_local, "record", None)
+  if record is None:
+    yield
+    return
+
+  stack = _local.stack
+  stack.append(0.0)
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    elapsed = (time.perf_counter() - start) * 1000
+    nested = stack.pop()
+    spans = record["spans"]
+    spans[name] = spans.get(name, 0.0) + elapsed - nested
+    record["calls"][name] = record["calls"].get(name, 0) + calls
+    if stack:
+      stack[-1] += elapsed
+
+
+def count(name, n=1):
+  """
+  Adds to a count for the current invocation, e.g. rows returned
+
+  Parameters
+  ----------
+  name: metric name
+  n: amount to add
+
+  Returns
+  -------
+  nothing
+  """
+
+  record = getattr(_local, "record", None)
+  if record is not None:
+    record["counts"][name] = record["counts"].get(name, 0) + n
+
+
+def sql_name(sql):
+  """
+  Names a SQL statement for its span by what it does and the table
+  it does it to, e.g. "sql SELECT assets" or "sql INSERT likes";
+  subqueries are skipped, so the table is the statement's own
+
+  Parameters
+  ----------
+  sql: the statement text
+
+  Returns
+  -------
+  span name
+  """
+
+  name = _sql_names.get(sql)
+  if name is not None:
+    return name
+
+  text = " ".join(sql.split())
+
+  outer = text
+  while True:
+    stripped = re.sub(r"\([^()]*\)", "", outer)
+    if stripped == outer:
+      break
+    outer = stripped
+
+  # a UNION of parenthesized SELECTs strips down to nothing:
+  if not re.search(r"\b(FROM|INTO|UPDATE)\b", outer, re.IGNORECASE):
+    outer = text
+
+  verb = re.search(r"\b(SELECT|INSERT|UPDATE|DELETE|REPLACE)\b", outer,
+                   re.IGNORECASE)
+  table = re.search(r"\b(?:FROM|INTO|UPDATE)\s+`?(\w+)", outer,
+                    re.IGNORECASE)
+
+  name = "sql"
+  if verb:
+    name += " " + verb.group(1).upper()
+  if table:
+    name += " " + table.group(1)
+
+  if len(_sql_names) < _sql_names_max:
+    _sql_names[sql] = name
+
+  return name
+
+
+##################################################################
+#
+# logging
+#
+
+def debugging():
+  """
+  Returns True if LOG_LEVEL is DEBUG
+  """
+
+  return log_level <= levels["DEBUG"]
+
+
+def debug(*values):
+  """
+  Prints a progress message, if LOG_LEVEL is DEBUG
+  """
+
+  if log_level <= levels["DEBUG"]:
+    print(*values)
+
+
+def info(*values):
+  """
+  Prints a message, if LOG_LEVEL is INFO or DEBUG
+  """
+
+  if log_level <= levels["INFO"]:
+    print(*values)
+
+
+def error(*values):
+  """
+  Prints an error, and adds it to the invocation's record
+  """
+
+  message = " ".join(str(v) for v in values)
+
+  record = getattr(_local, "record", None)
+  if record is not None:
+    record["properties"]["Error"] = message[:500]
+
+  if log_level <= levels["ERROR"]:
+    print("**ERROR**", message)
+
+
+def debug_rows(rows):
+  """
+  Prints each row, if LOG_LEVEL is DEBUG; otherwise does nothing,
+  without touching the rows
+
+  Parameters
+  ----------
+  rows: list of rows
+  """
+
+  if log_level <= levels["DEBUG"]:
+    for row in rows:
+      print(row)
@@ -0,0 +1,156 @@
+#
+# Builds the HTTP-like responses the lambdas return to API Gateway.
+#
+# Bodies are JSON. When the client sent an Accept-Encoding that
+# includes br or gzip and the body is big enough to be worth it, the
+# body is compressed, base64-encoded and returned with
+# isBase64Encoded set; API Gateway decodes it back to binary and
+# the client's HTTP library undoes the Content-Encoding. For a REST
+# API this needs "*/*" in the API's binary media types, otherwise
+# the base64 text is passed through as-is. HTTP APIs always honor
+# isBase64Encoded.
+#
+# Building the body (JSON, compression, base64) is timed as the
+# serialize phase of the invocation (see metrics.py).
+#
+# brotli is only used if the brotli package is in the deployment
+# package; gzip always works.
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+import base64
+import gzip
+import json
+import metrics
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+#
+# bodies smaller than this (bytes) are sent as-is; below a page or
+# so, compression saves less than the base64 wrapping costs:
+#
+min_size = 1024
+
+gzip_level = 5
+brotli_quality = 5
+
+
+def accepted_encoding(event):
+  """
+  Picks the best encoding the client accepts, from the event's
+  Accept-Encoding header. q-values are honored, so "gzip;q=0" rules
+  gzip out, and "*" stands for every coding not named.
+
+  Parameters
+  ----------
+  event: API Gateway proxy event
+
+  Returns
+  -------
+  "br", "gzip" or None
+  """
+
+  headers = event.get("headers") or {}
+
+  accept = ""
+  for name in headers:
+    if name.lower() == "accept-encoding":
+      accept = headers[name] or ""
+      break
+
+  offered = {}
+  for part in accept.split(","):
+    fields = part.strip().split(";")
+    coding = fields[0].strip().lower()
+    q = 1.0
+    for param in fields[1:]:
+      name, _, value = param.partition("=")
+      if name.strip().lower() == "q":
+        try:
+          q = float(value.strip())
+        except ValueError:
+          q = 0.0
+    if coding != "":
+      offered[coding] = q
+
+  def quality(coding):
+    return offered.get(coding, offered.get("*", 0.0))
+
+  best = None
+  best_q = 0.0
+  for coding in ["br", "gzip"]:
+    if coding == "br" and brotli is None:
+      continue
+    if quality(coding) > best_q:
+      best = coding
+      best_q = quality(coding)
+
+  return best
+
+
+def respond(event, statusCode, payload, headers=None):
+  """
+  Builds a response, compressing the body if the client accepts it
+  and it is large enough
+
+  Parameters
+  ----------
+  event: API Gateway proxy event being answered
+  statusCode: HTTP status code
+  payload: object to serialize as the JSON body, or None for an
+    empty body
+  headers: extra response headers
+
+  Returns
+  -------
+  response dictionary for API Gateway
+  """
+
+  with metrics.span("serialize"):
+    response = {'statusCode': statusCode}
+
+    all_headers = dict(headers or {})
+
+    if payload is None:
+      response['body'] = ''
+      if all_headers:
+        response['headers'] = all_headers
+      return response
+
+    body = json.dumps(payload)
+    all_headers['Content-Type'] = 'application/json'
+
+    #
+    # whether this body is compressed depends on Accept-Encoding, so
+    # every JSON response says so, compressed or not; otherwise a
+    # cache could hand one client's variant to another:
+    #
+    all_headers['Vary'] = 'Accept-Encoding'
+
+    encoding = None
+    if len(body) >= min_size:
+      encoding = accepted_encoding(event)
+
+    if encoding is not None:
+      raw = body.encode()
+
+      if encoding == "br":
+        compressed = brotli.compress(raw, quality=brotli_quality)
+      else:
+        compressed = gzip.compress(raw, compresslevel=gzip_level)
+
+      if len(compressed) < len(raw):
+        all_headers['Content-Encoding'] = encoding
+        response['headers'] = all_headers
+        response['body'] = base64.b64encode(compressed).decode()
+        response['isBase64Encoded'] = True
+        return response
+
+    response['headers'] = all_headers
+    response['body'] = body
+    return response
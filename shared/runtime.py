@@ -0,0 +1,306 @@
+#
+# Per-container runtime shared by the final_* lambda functions.
+#
+# Lambda keeps a container (and its python modules) alive between
+# invocations, so anything stored at module level here survives
+# from one request to the next. The config file is parsed once,
+# boto3 sessions / S3 buckets are built once per profile, and the
+# RDS connection is opened once and reused, with a health check
+# before reuse if it has been sitting idle.
+#
+# Each of these is timed as a phase of the invocation (see
+# metrics.py): config, connect, s3_setup, and s3 for presigning and
+# HEAD requests.
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+import os
+import time
+import threading
+import datatier
+import metrics
+
+from configparser import ConfigParser
+
+config_file = 'config.ini'
+
+#
+# seconds a connection may sit idle before we ping it
+# before handing it out again:
+#
+ping_interval = 30
+
+_configur = None
+_sessions = {}
+_buckets = {}
+
+#
+# the database connection is per thread: dbConn, and used (when it
+# was last handed out):
+#
+_local = threading.local()
+
+
+def get_config():
+  """
+  Returns the parsed config file, reading it on first use
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  ConfigParser for config.ini
+  """
+
+  global _configur
+  if _configur is None:
+    with metrics.span("config"):
+      os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+      configur = ConfigParser()
+      configur.read(config_file)
+      _configur = configur
+
+  return _configur
+
+
+def get_session(profile):
+  """
+  Returns the boto3 session for the given credentials profile,
+  creating it on first use
+
+  Parameters
+  ----------
+  profile: profile name in the credentials file, e.g. 's3readonly'
+
+  Returns
+  -------
+  boto3 Session
+  """
+
+  if profile not in _sessions:
+    get_config()  # credentials file must be set before boto3 looks
+
+    with metrics.span("s3_setup"):
+      import boto3
+      _sessions[profile] = boto3.Session(profile_name=profile)
+
+  return _sessions[profile]
+
+
+def get_bucket(profile):
+  """
+  Returns the S3 bucket from the config file, accessed through
+  the given credentials profile
+
+  If the config file has an [s3] endpoint_url, S3 is reached there
+  instead of AWS, e.g. a local S3 stand-in such as MinIO for
+  testing; such stand-ins want path-style urls, so those are used.
+
+  Parameters
+  ----------
+  profile: profile name in the credentials file, e.g. 's3readonly'
+
+  Returns
+  -------
+  boto3 S3 Bucket resource
+  """
+
+  if profile not in _buckets:
+    configur = get_config()
+    bucketname = configur.get('s3', 'bucket_name')
+
+    endpoint_url = configur.get('s3', 'endpoint_url', fallback=None)
+
+    session = get_session(profile)
+
+    with metrics.span("s3_setup"):
+      if endpoint_url:
+        from botocore.config import Config
+        s3 = session.resource(
+          's3',
+          endpoint_url=endpoint_url,
+          config=Config(s3={'addressing_style': 'path'}))
+      else:
+        s3 = session.resource('s3')
+
+      _buckets[profile] = s3.Bucket(bucketname)
+
+  return _buckets[profile]
+
+
+def presigned_url(profile, operation, bucketkey, params=None):
+  """
+  Returns a presigned url for one S3 operation on one object in the
+  bucket, so the client can transfer the object directly with S3
+  instead of through API Gateway and lambda. Signing happens
+  locally, there is no call to S3.
+
+  The url lifetime comes from [s3] presign_expires in the config
+  file (seconds, default 300).
+
+  Parameters
+  ----------
+  profile: credentials profile to sign with, e.g. 's3readwrite'
+  operation: S3 client method, e.g. 'put_object' or 'get_object'
+  bucketkey: key of the object
+  params: extra request parameters that are signed into the url,
+    e.g. {'ContentType': 'image/jpeg'}
+
+  Returns
+  -------
+  the url, as a string
+  """
+
+  configur = get_config()
+  expires = configur.getint('s3', 'presign_expires', fallback=300)
+
+  bucket = get_bucket(profile)
+
+  all_params = {'Bucket': bucket.name, 'Key': bucketkey}
+  if params:
+    all_params.update(params)
+
+  with metrics.span("s3"):
+    return bucket.meta.client.generate_presigned_url(operation,
+                                                     Params=all_params,
+                                                     ExpiresIn=expires)
+
+
+def object_size(profile, bucketkey):
+  """
+  Returns the size of an object in the bucket, or None if there is
+  no such object
+
+  Parameters
+  ----------
+  profile: credentials profile, e.g. 's3readonly'
+  bucketkey: key of the object
+
+  Returns
+  -------
+  size in bytes, or None
+  """
+
+  from botocore.exceptions import ClientError
+
+  bucket = get_bucket(profile)
+
+  try:
+    with metrics.span("s3"):
+      response = bucket.meta.client.head_object(Bucket=bucket.name,
+                                                Key=bucketkey)
+  except ClientError as err:
+    if err.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+      return None
+    raise
+
+  return response['ContentLength']
+
+
+def get_dbConn():
+  """
+  Returns an open connection to the RDS database from the config
+  file. The connection is reused across invocations; if it has
+  been idle for a while it is pinged first, and reopened if the
+  server has dropped it.
+
+  The connection runs in autocommit mode, so a reused connection
+  never reads from a snapshot left over from an earlier request.
+
+  Each thread gets its own connection, taken from the datatier pool,
+  so local tools that run handlers on several threads don't share
+  one. In lambda there is only ever one thread.
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  pymysql connection
+  """
+
+  with metrics.span("connect"):
+    now = time.monotonic()
+
+    dbConn = getattr(_local, "dbConn", None)
+
+    if dbConn is not None and not dbConn.open:
+      close_dbConn()  # lost during an earlier request
+      dbConn = None
+
+    if dbConn is not None and now - _local.used > ping_interval:
+      try:
+        dbConn.ping(reconnect=False)
+      except Exception as err:
+        metrics.info("**Dropping stale database connection:", str(err))
+        close_dbConn()
+        dbConn = None
+
+    if dbConn is None:
+      configur = get_config()
+
+      rds_endpoint = configur.get('rds', 'endpoint')
+      rds_portnum = int(configur.get('rds', 'port_number'))
+      rds_username = configur.get('rds', 'user_name')
+      rds_pwd = configur.get('rds', 'user_pwd')
+      rds_dbname = configur.get('rds', 'db_name')
+
+      dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username,
+                                   rds_pwd, rds_dbname)
+      dbConn.autocommit(True)
+      _local.dbConn = dbConn
+
+    _local.used = now
+    return dbConn
+
+
+def release_dbConn():
+  """
+  Gives this thread's connection back to the datatier pool, for a
+  caller that is done with it for now; the next get_dbConn() on
+  this thread takes one from the pool again
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  nothing
+  """
+
+  dbConn = getattr(_local, "dbConn", None)
+  _local.dbConn = None
+
+  if dbConn is not None:
+    datatier.release_dbConn(dbConn)
+
+
+def close_dbConn():
+  """
+  Closes this thread's database connection, if any; the next call
+  to get_dbConn() opens a new one
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  nothing
+  """
+
+  dbConn = getattr(_local, "dbConn", None)
+  _local.dbConn = None
+
+  if dbConn is not None:
+    try:
+      dbConn.close()
+    except Exception:
+      pass
@@ -0,0 +1,130 @@
+#
+# Per-asset summaries for many assets at once: like and comment
+# counts, and the newest few comments. Used by final_counts and the
+# feed, so an overview of N assets costs two queries rather than a
+# getlikes and a getcomments call per asset.
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+import datatier
+
+#
+# most comments per asset that may be asked for:
+#
+max_comments = 10
+
+
+def get_counts(dbConn, userid, assetids):
+  """
+  Looks up the like and comment counts of the given assets, with
+  one grouped query. The same query says whether each asset exists
+  and whether the user may see it; counts are only given for the
+  ones they may.
+
+  Parameters
+  ----------
+  dbConn: database connection
+  userid: user making the request, as an int
+  assetids: list of asset ids, as ints
+
+  Returns
+  -------
+  dictionary assetid => {"status": ..., "message": ...,
+  "like_count": ..., "comment_count": ...}, where status is 200,
+  400 (no such asset, or its upload hasn't finished) or 403
+  (private); the counts are only there for 200
+  """
+
+  unique = sorted(set(assetids))
+  marks = ", ".join(["%s"] * len(unique))
+
+  #
+  # the like count is the compacted total plus the asset's counter
+  # slots (see counters.py), summed in the same pass:
+  #
+  sql = f"""
+  SELECT a.assetid, a.userid, a.assettype,
+         CAST(a.like_count + COALESCE(SUM(s.likes), 0) AS SIGNED),
+         a.comment_count
+    FROM assets a
+    LEFT JOIN asset_like_shards s ON s.assetid = a.assetid
+   WHERE a.assetid IN ({marks}) AND a.uploaded = 1
+   GROUP BY a.assetid;
+  """
+
+  rows = datatier.retrieve_all_rows(dbConn, sql, unique)
+
+  found = {}
+  for row in rows:
+    found[row[0]] = row
+
+  results = {}
+  for assetid in unique:
+    if assetid not in found:
+      results[assetid] = {"status": 400, "message": "no such asset..."}
+      continue
+
+    (assetid, owner, assettype, like_count, comment_count) = found[assetid]
+
+    if assettype != "public" and owner != userid:
+      results[assetid] = {"status": 403, "message": "forbidden..."}
+      continue
+
+    results[assetid] = {"status": 200,
+                        "message": "success",
+                        "like_count": like_count,
+                        "comment_count": comment_count}
+
+  return results
+
+
+def get_latest_comments(dbConn, assetids, k):
+  """
+  Looks up the newest k comments on each of the given assets, with
+  one query: ROW_NUMBER() numbers each asset's comments newest first,
+  and only the first k of each are kept. Needs MySQL 8.
+
+  The caller is responsible for only passing assets the user may see.
+
+  Parameters
+  ----------
+  dbConn: database connection
+  assetids: list of asset ids, as ints
+  k: comments per asset, at most max_comments
+
+  Returns
+  -------
+  dictionary assetid => list of {"commentid", "userid",
+  "comment_body"}, newest first; every asset given has an entry
+  """
+
+  comments = {assetid: [] for assetid in assetids}
+
+  if len(comments) == 0 or k < 1:
+    return comments
+
+  unique = sorted(comments)
+  marks = ", ".join(["%s"] * len(unique))
+
+  sql = f"""
+  SELECT assetid, commentid, userid, comment_body
+    FROM (SELECT assetid, commentid, userid, comment_body,
+                 ROW_NUMBER() OVER (PARTITION BY assetid
+                                    ORDER BY commentid DESC) AS n
+            FROM comments
+           WHERE assetid IN ({marks})) AS numbered
+   WHERE n <= %s
+   ORDER BY assetid, commentid DESC;
+  """
+
+  rows = datatier.retrieve_all_rows(dbConn, sql,
+                                    unique + [min(k, max_comments)])
+
+  for (assetid, commentid, userid, comment_body) in rows:
+    comments[assetid].append({"commentid": commentid,
+                              "userid": userid,
+                              "comment_body": comment_body})
+
+  return comments
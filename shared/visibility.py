@@ -0,0 +1,74 @@
+#
+# Which assets a user may see: every public asset, plus their own,
+# leaving out any whose upload hasn't finished (uploaded = 0, see
+# schema/0006_asset_upload_state.sql).
+#
+# The obvious WHERE assettype = 'public' OR userid = ? can't use an
+# index for both halves at once, so MySQL scans the whole assets
+# table for every page. Instead a page is built as the UNION of two
+# index range scans (see schema/0004_asset_visibility_indexes.sql
+# and 0006_asset_upload_state.sql):
+#
+#   (public assets after the cursor, in assetid order, LIMIT n)
+#   UNION
+#   (the user's assets after the cursor, in assetid order, LIMIT n)
+#   ORDER BY assetid LIMIT n
+#
+# Each half reads at most n index entries, and UNION drops the
+# user's own public assets that both halves found.
+#
+# Like datatier.py, this file is copied into each lambda's
+# deployment package next to lambda_function.py.
+#
+
+
+def page_sql(select, userid, after, limit, descending=False):
+  """
+  Builds the query for one page of the assets a user may see, in
+  assetid order
+
+  Parameters
+  ----------
+  select: columns of assets to return, e.g. "assetid, assetname";
+    must include assetid, and must be safe to put in the SQL
+  userid: user asking, or None for an anonymous caller, who only
+    sees public assets
+  after: assetid the page starts after (before, if descending), or
+    None for the first page
+  limit: rows to return
+  descending: True for newest first
+
+  Returns
+  -------
+  (sql, parameters); the sql has no trailing ;, so it can be used as
+  a subquery
+  """
+
+  op = "<" if descending else ">"
+  order = "DESC" if descending else "ASC"
+
+  page_filter = ""
+  page_params = []
+  if after is not None:
+    page_filter = f"AND assetid {op} %s"
+    page_params = [after]
+
+  public = f"""SELECT {select} FROM assets
+      WHERE assettype = 'public' AND uploaded = 1 {page_filter}
+      ORDER BY assetid {order} LIMIT %s"""
+
+  if userid is None:
+    return public, page_params + [limit]
+
+  own = f"""SELECT {select} FROM assets
+      WHERE userid = %s AND uploaded = 1 {page_filter}
+      ORDER BY assetid {order} LIMIT %s"""
+
+  sql = f"""({public})
+    UNION
+    ({own})
+    ORDER BY assetid {order} LIMIT %s"""
+
+  params = page_params + [limit] + [userid] + page_params + [limit] + [limit]
+
+  return sql, params
@@ -0,0 +1,298 @@
+#
+# EXPLAIN check for every SQL query the lambdas run.
+#
+# Pulls the SQL strings out of the handlers (final_*/lambda_function.py)
+# and the shared modules with the ast module, adds the queries that
+# are only built at run time (shared/visibility.py), and EXPLAINs each
+# statement against the database in the given config file: a local
+# MySQL with the schema/ migrations applied, not RDS. Exits with
+# status 1 if any of them reads a table with a full scan (type ALL)
+# or needs a filesort:
+#
+#   python tools/explain_queries.py --config local.ini
+#   python tools/explain_queries.py --config local.ini --verbose
+#   python tools/explain_queries.py --config local.ini --json
+#
+# The optimizer picks full scans on small tables whatever the
+# indexes, so run it against a realistically sized database (see
+# tools/seed.py). Parameters are all filled in as 1.
+#
+# f-strings are rendered with the sample values in "samples" below;
+# one that uses a name not listed there is reported as skipped. The
+# sorts MySQL does on the result of a UNION or derived table (the
+# "<union...>" and "<derived...>" rows) are of one page at most and
+# are not counted as filesorts.
+#
+
+import argparse
+import ast
+import glob
+import json
+import os
+import re
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, "shared"))
+sys.path.insert(0, repo_root)
+
+import counters
+import runtime
+import visibility
+
+#
+# what the names used inside the SQL f-strings stand for:
+#
+samples = {
+  "counters": counters,
+  "select": "*",
+  "marks": "%s, %s, %s",
+  "cases": "WHEN %s THEN %s WHEN %s THEN %s",
+  "like_rows": "(%s, %s), (%s, %s)",
+  "shard_rows": "(%s, %s, %s), (%s, %s, %s)",
+  "comment_rows": "(%s, %s, %s), (%s, %s, %s)",
+  "page_filter": "AND assetid > %s",
+  "order": "ASC",
+  "page": visibility.page_sql("assetid", 1, 1, 101, descending=True)[0],
+}
+
+#
+# a string is taken to be SQL if it starts with one of these keywords,
+# in capitals, as all the queries in this repo are written:
+#
+statement_start = re.compile(r"^\(?(SELECT|INSERT|UPDATE|DELETE)\s")
+
+
+def render(node):
+  """
+  Renders an f-string node to text using the sample values
+
+  Parameters
+  ----------
+  node: ast.JoinedStr
+
+  Returns
+  -------
+  the text, or None if it uses a name with no sample value
+  """
+
+  parts = []
+  for value in node.values:
+    if isinstance(value, ast.Constant):
+      parts.append(value.value)
+      continue
+    try:
+      code = compile(ast.Expression(value.value), "<sql>", "eval")
+      parts.append(str(eval(code, {"__builtins__": {}}, dict(samples))))
+    except Exception:
+      return None
+  return "".join(parts)
+
+
+def extract(path):
+  """
+  Finds the SQL strings in a python file
+
+  Parameters
+  ----------
+  path: the file
+
+  Returns
+  -------
+  (found, skipped): lists of (line, sql) and of line numbers whose
+  f-string could not be rendered
+  """
+
+  with open(path) as f:
+    tree = ast.parse(f.read(), path)
+
+  #
+  # the constant pieces of an f-string are visited on their own too;
+  # only the whole f-string counts:
+  #
+  pieces = set()
+  for node in ast.walk(tree):
+    if isinstance(node, ast.JoinedStr):
+      for value in node.values:
+        pieces.add(id(value))
+
+  found = []
+  skipped = []
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+      if id(node) in pieces:
+        continue
+      text = node.value
+    elif isinstance(node, ast.JoinedStr):
+      text = render(node)
+      if text is None:
+        if node.values and isinstance(node.values[0], ast.Constant) and \
+           statement_start.match(node.values[0].value.strip()):
+          skipped.append(node.lineno)
+        continue
+    else:
+      continue
+
+    if statement_start.match(text.strip()):
+      found.append((node.lineno, text))
+
+  return found, skipped
+
+
+def collect():
+  """
+  Gathers every query to check
+
+  Returns
+  -------
+  (queries, skipped): list of (name, statement), and list of names
+  of f-strings that could not be rendered
+  """
+
+  paths = sorted(glob.glob(os.path.join(repo_root, "final_*",
+                                        "lambda_function.py")))
+  paths += sorted(glob.glob(os.path.join(repo_root, "shared", "*.py")))
+
+  queries = []
+  skipped = []
+
+  for path in paths:
+    rel = os.path.relpath(path, repo_root)
+    found, unrendered = extract(path)
+
+    for line in unrendered:
+      skipped.append(f"{rel}:{line}")
+
+    for line, text in found:
+      statements = [s.strip() for s in text.split(";") if s.strip()]
+      for i, statement in enumerate(statements):
+        name = f"{rel}:{line}"
+        if len(statements) > 1:
+          name += f" #{i + 1}"
+        queries.append((name, statement))
+
+  #
+  # built at run time:
+  #
+  for userid in [None, 1]:
+    for after in [None, 1]:
+      for descending in [False, True]:
+        sql, params = visibility.page_sql("assetid, assetname", userid,
+                                          after, 101, descending)
+        name = (f"visibility.page_sql(userid={userid}, after={after}, "
+                f"descending={descending})")
+        queries.append((name, sql))
+
+  return queries, skipped
+
+
+def explain(dbConn, statement):
+  """
+  Runs EXPLAIN on one statement, with every parameter set to 1
+
+  Returns
+  -------
+  list of dictionaries, one per row of the plan
+  """
+
+  # EXPLAIN won't take SELECT ... INTO @var:
+  statement = re.sub(r"\bINTO\s+@\w+", "", statement)
+  statement = statement.replace("%s", "1")
+
+  dbCursor = dbConn.cursor()
+  try:
+    dbCursor.execute("EXPLAIN " + statement)
+    names = [d[0] for d in dbCursor.description]
+    return [dict(zip(names, row)) for row in dbCursor.fetchall()]
+  finally:
+    dbCursor.close()
+
+
+def problems(plan):
+  """
+  Returns what is wrong with a plan: full scans and filesorts
+
+  Returns
+  -------
+  list of strings, empty if the plan is fine
+  """
+
+  found = []
+  for step in plan:
+    table = str(step.get("table"))
+    if table.startswith("<"):
+      continue  # a UNION or derived result
+    if str(step.get("select_type")) in ["INSERT", "REPLACE"]:
+      continue  # the table being inserted into
+    if step.get("type") == "ALL":
+      found.append(f"full scan of {table}")
+    if "Using filesort" in str(step.get("Extra") or ""):
+      found.append(f"filesort on {table}")
+  return found
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="EXPLAIN every SQL query used by the lambdas")
+  parser.add_argument("--config", default="config.ini",
+                      help="config file with the [rds] section to use")
+  parser.add_argument("--ignore", action="append", default=[],
+                      help="skip queries whose name contains this")
+  parser.add_argument("--verbose", action="store_true",
+                      help="print every query and plan, not just failures")
+  parser.add_argument("--json", action="store_true",
+                      help="write the results as JSON")
+  args = parser.parse_args()
+
+  runtime.config_file = args.config
+  dbConn = runtime.get_dbConn()
+
+  queries, skipped = collect()
+
+  results = []
+  for name, statement in queries:
+    if any(pattern in name for pattern in args.ignore):
+      continue
+    try:
+      plan = explain(dbConn, statement)
+      issues = problems(plan)
+    except Exception as err:
+      plan = []
+      issues = ["EXPLAIN failed: " + str(err)]
+    results.append({"query": name,
+                    "sql": " ".join(statement.split()),
+                    "ok": len(issues) == 0,
+                    "problems": issues,
+                    "plan": [dict((k, str(v)) for k, v in step.items())
+                             for step in plan]})
+
+  failed = [r for r in results if not r["ok"]]
+
+  if args.json:
+    print(json.dumps({"results": results, "skipped": skipped}, indent=2))
+  else:
+    for r in results:
+      if r["ok"] and not args.verbose:
+        continue
+      print(("OK   " if r["ok"] else "FAIL ") + r["query"])
+      print("     " + r["sql"])
+      for issue in r["problems"]:
+        print("     **" + issue)
+      if args.verbose:
+        for step in r["plan"]:
+          print(f"       {step.get('table'):<20} type={step.get('type'):<7} "
+                f"key={step.get('key'):<28} {step.get('Extra')}")
+      print()
+
+    for name in skipped:
+      print("SKIP " + name + " (f-string uses a name with no sample)")
+
+    print(f"{len(results)} queries, {len(failed)} failed, "
+          f"{len(skipped)} skipped")
+
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
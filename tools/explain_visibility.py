@@ -0,0 +1,223 @@
+#
+# EXPLAIN check for the visible-assets queries (shared/visibility.py)
+# at production scale.
+#
+# Against the database in the given config file (a local MySQL with
+# the schema/ migrations applied, not RDS), tops the assets table up
+# to --assets rows if it has fewer, then EXPLAINs the final_assets
+# and final_feed page queries, for an anonymous and a logged-in user,
+# first page and later page. Exits with status 1 if any of them
+# reads a table with a full scan (type ALL):
+#
+#   python tools/explain_visibility.py --config local.ini
+#   python tools/explain_visibility.py --config local.ini --assets 1000000
+#
+# For contrast it also prints the plan of the plain
+# "assettype = 'public' OR userid = ?" query, which is not checked.
+#
+
+import argparse
+import os
+import random
+import sys
+import uuid
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, "shared"))
+sys.path.insert(0, repo_root)
+
+import datatier
+import runtime
+import visibility
+
+
+def fill_assets(dbConn, target, users=1000, public=0.2, batch=10000):
+  """
+  Adds assets (and, if needed, users to own them) until the assets
+  table has at least target rows
+
+  Parameters
+  ----------
+  dbConn: database connection
+  target: rows wanted in assets
+  users: users to spread the new assets over
+  public: fraction of new assets that are public
+  batch: rows per multi-row INSERT
+
+  Returns
+  -------
+  # of assets added
+  """
+
+  row = datatier.retrieve_one_row(dbConn, "SELECT COUNT(*) FROM assets;")
+  missing = target - row[0]
+  if missing <= 0:
+    return 0
+
+  rows = datatier.retrieve_all_rows(dbConn, "SELECT userid FROM users;")
+  userids = [r[0] for r in rows]
+
+  #
+  # every value is a %s, constants included: pymysql only turns
+  # executemany into one multi-row INSERT when the VALUES clause
+  # is nothing but placeholders, and otherwise runs a statement
+  # per row
+  #
+  if len(userids) < users:
+    sql = """
+    INSERT INTO users (email, lastname, firstname, bucketfolder, username, pwdhash)
+                VALUES (%s, %s, %s, %s, %s, %s);
+    """
+    new = []
+    for i in range(users - len(userids)):
+      tag = str(uuid.uuid4())
+      new.append([tag + "@explain", "explain", "explain", tag,
+                  "explain-" + tag, ""])
+    datatier.perform_many(dbConn, sql, new)
+
+    rows = datatier.retrieve_all_rows(dbConn, "SELECT userid FROM users;")
+    userids = [r[0] for r in rows]
+
+  sql = """
+  INSERT INTO assets (userid, assetname, bucketkey, assettype)
+              VALUES (%s, %s, %s, %s);
+  """
+
+  added = 0
+  while added < missing:
+    n = min(batch, missing - added)
+    new = []
+    for i in range(n):
+      assettype = "public" if random.random() < public else "private"
+      new.append([random.choice(userids), "explain.jpg",
+                  str(uuid.uuid4()) + ".jpg", assettype])
+    datatier.perform_many(dbConn, sql, new)
+    added += n
+    print(f"  {added}/{missing} assets added", file=sys.stderr)
+
+  return added
+
+
+def explain(dbConn, sql, params):
+  """
+  Runs EXPLAIN on a query
+
+  Parameters
+  ----------
+  dbConn: database connection
+  sql: the query
+  params: its parameters
+
+  Returns
+  -------
+  list of dictionaries, one per row of the plan
+  """
+
+  dbCursor = dbConn.cursor()
+  try:
+    dbCursor.execute("EXPLAIN " + sql, params)
+    names = [d[0] for d in dbCursor.description]
+    return [dict(zip(names, row)) for row in dbCursor.fetchall()]
+  finally:
+    dbCursor.close()
+
+
+def print_plan(name, plan):
+  print(name)
+  for step in plan:
+    print(f"  {str(step['select_type']):<14} {str(step['table']):<16} "
+          f"type={str(step['type']):<7} key={str(step['key']):<28} "
+          f"rows={str(step['rows']):<8} {step['Extra'] or ''}")
+  print()
+
+
+def queries(userid, after):
+  """
+  The page queries to check, as final_assets and final_feed build
+  them
+
+  Returns
+  -------
+  list of (name, sql, params)
+  """
+
+  limit = 101
+  found = []
+
+  for who, uid in [("anonymous", None), ("user " + str(userid), userid)]:
+    for page, aft in [("first page", None), ("later page", after)]:
+      sql, params = visibility.page_sql("assetid, userid, assetname, "
+                                        "bucketkey, assettype",
+                                        uid, aft, limit)
+      found.append((f"final_assets, {who}, {page}", sql, params))
+
+    if uid is None:
+      continue
+
+    for page, aft in [("first page", None), ("later page", after)]:
+      inner, params = visibility.page_sql("assetid", uid, aft, limit,
+                                          descending=True)
+      sql = f"""
+      SELECT a.assetid, u.username
+        FROM ({inner}) AS v
+        JOIN assets a ON a.assetid = v.assetid
+        JOIN users u ON u.userid = a.userid
+       ORDER BY a.assetid DESC"""
+      found.append((f"final_feed, {who}, {page}", sql, params))
+
+  return found
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="EXPLAIN the visible-assets queries at scale")
+  parser.add_argument("--config", default="config.ini",
+                      help="config file with the [rds] section to use")
+  parser.add_argument("--assets", type=int, default=1000000,
+                      help="fill the assets table up to this many rows")
+  args = parser.parse_args()
+
+  runtime.config_file = args.config
+  dbConn = runtime.get_dbConn()
+
+  added = fill_assets(dbConn, args.assets)
+  if added > 0:
+    datatier.retrieve_all_rows(dbConn, "ANALYZE TABLE assets;")
+
+  row = datatier.retrieve_one_row(dbConn, """
+    SELECT MIN(assetid), MAX(assetid), COUNT(*) FROM assets;
+  """)
+  middle = (row[0] + row[1]) // 2
+  print(f"assets: {row[2]}")
+
+  row = datatier.retrieve_one_row(dbConn, """
+    SELECT userid FROM assets GROUP BY userid ORDER BY COUNT(*) DESC LIMIT 1;
+  """)
+  userid = row[0]
+  print()
+
+  failed = []
+  for name, sql, params in queries(userid, middle):
+    plan = explain(dbConn, sql, params)
+    print_plan(name, plan)
+    for step in plan:
+      if step["type"] == "ALL" and step["table"] in ["assets", "a", "users", "u"]:
+        failed.append(name)
+
+  sql = """
+  SELECT assetid FROM assets
+   WHERE (assettype = 'public' OR userid = %s) AND assetid > %s
+   ORDER BY assetid LIMIT %s"""
+  print_plan("for contrast, the OR query (not checked)",
+             explain(dbConn, sql, [userid, middle, 101]))
+
+  if failed:
+    for name in sorted(set(failed)):
+      print("**FULL TABLE SCAN:", name, file=sys.stderr)
+    sys.exit(1)
+
+  print("no full table scans")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,349 @@
+#
+# Local stand-in for API Gateway.
+#
+# Serves the /final_* routes over HTTP on this machine, so main.py
+# and the benchmarks can run without deploying. Each request is
+# turned into an API Gateway proxy event (resource, path,
+# pathParameters, queryStringParameters, headers, body) and handed
+# to the router lambda (final_router), which calls the route's
+# lambda_handler. The handlers use the database and bucket in the
+# given config file; point that at a local MySQL and S3 stand-in.
+#
+#   python tools/gateway.py --config local.ini
+#   python tools/gateway.py --config local.ini --port 8080 --workers 8 \
+#     --cold-start-ms 250 --quiet
+#
+# and in main.py's config file:
+#
+#   [client]
+#   webservice = http://localhost:8080
+#
+# Every worker is a separate process standing in for one lambda
+# container: it handles one request at a time, keeps its module state
+# (connections, sessions) between requests, and is only started when
+# all the others are busy, up to --workers. Its first request pays
+# the real import cost plus --cold-start-ms, the way a cold start
+# would.
+#
+# Login is local too: POST /auth with {"username", "password"} returns
+# {"access_token"} for that user. The password is NOT checked; this is
+# for local testing only. A request carrying "Authorization: Bearer
+# <token>" gets the token's userid put into its body (and into
+# pathParameters), as the deployed API does for the handlers; an
+# unknown token gets a 401.
+#
+# One line per request is logged to stderr:
+#
+#   GATEWAY POST /final_like/1001 200 12.3ms worker=4242 cold=false
+#
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+shared_dir = os.path.join(repo_root, "shared")
+
+#
+# routes that take a path parameter, and its name:
+#
+path_parameters = {
+  "final_like": "assetid",
+  "final_comment": "assetid",
+  "final_getlikes": "assetid",
+  "final_getcomments": "assetid",
+  "final_download": "assetid",
+}
+
+
+##################################################################
+#
+# worker processes
+#
+
+_router = None
+_invocations = 0
+
+
+def init_worker(config_file, cold_start_ms, quiet):
+  """
+  Runs once in each new worker process: the cold start
+  """
+
+  global _router
+
+  if quiet:
+    sys.stdout = open(os.devnull, "w")
+
+  sys.path.insert(0, shared_dir)
+  sys.path.insert(0, repo_root)
+
+  import runtime
+  runtime.config_file = config_file
+
+  import importlib
+  _router = importlib.import_module("final_router.lambda_function")
+
+  if cold_start_ms > 0:
+    time.sleep(cold_start_ms / 1000)
+
+
+def invoke(event):
+  """
+  Runs one event through the router, in a worker process
+
+  Returns
+  -------
+  (response, pid, cold)
+  """
+
+  global _invocations
+
+  cold = _invocations == 0
+  _invocations += 1
+
+  response = _router.lambda_handler(event, None)
+  return response, os.getpid(), cold
+
+
+##################################################################
+#
+# tokens for the local /auth
+#
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def login(username):
+  """
+  Issues a token for the user with the given username
+
+  Returns
+  -------
+  (userid, token), or (None, None) if there is no such user
+  """
+
+  import datatier
+  import runtime
+
+  #
+  # each /auth request runs on its own short-lived server thread;
+  # hand the connection back to the datatier pool (which keeps at
+  # most pool_size idle) rather than leaving one open per thread:
+  #
+  try:
+    row = datatier.retrieve_one_row(runtime.get_dbConn(),
+                                    "SELECT userid FROM users WHERE username = %s;",
+                                    [username])
+  finally:
+    runtime.release_dbConn()
+
+  if row == ():
+    return None, None
+
+  token = uuid.uuid4().hex
+  with _tokens_lock:
+    _tokens[token] = row[0]
+  return row[0], token
+
+
+def token_userid(headers):
+  """
+  Returns the userid for the request's bearer token
+
+  Returns
+  -------
+  userid, None if there is no Authorization header, or False if
+  the token is unknown
+  """
+
+  auth = headers.get("Authorization")
+  if not auth:
+    return None
+  if not auth.startswith("Bearer "):
+    return False
+  with _tokens_lock:
+    return _tokens.get(auth[len("Bearer "):], False)
+
+
+##################################################################
+#
+# the HTTP side
+#
+
+def build_event(method, path, query, headers, body, userid):
+  """
+  Builds the API Gateway proxy event for a request
+
+  Parameters
+  ----------
+  method: HTTP method
+  path: request path, e.g. "/final_like/1001"
+  query: query string, e.g. "limit=10"
+  headers: dictionary of request headers
+  body: request body, as bytes
+  userid: userid from the token, or None
+
+  Returns
+  -------
+  the event
+  """
+
+  parts = path.strip("/").split("/")
+  name = parts[0]
+
+  resource = "/" + name
+  params = None
+  if name in path_parameters and len(parts) > 1:
+    resource += "/{" + path_parameters[name] + "}"
+    params = {path_parameters[name]: parts[1]}
+
+  text = body.decode() if body else None
+
+  if userid is not None:
+    payload = json.loads(text) if text else {}
+    payload["userid"] = userid
+    text = json.dumps(payload)
+    params = dict(params or {})
+    params.setdefault("userid", str(userid))
+
+  return {
+    "resource": resource,
+    "path": path,
+    "httpMethod": method,
+    "headers": headers,
+    "queryStringParameters": dict(parse_qsl(query)) or None,
+    "pathParameters": params,
+    "body": text if text is not None else "{}",
+    "isBase64Encoded": False,
+    "requestContext": {"requestId": str(uuid.uuid4()), "stage": "local"}
+  }
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+
+  protocol_version = "HTTP/1.1"
+
+  # set by main():
+  pool = None
+
+  def send(self, status, headers, body):
+    self.send_response(status)
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def send_json(self, status, payload):
+    self.send(status, {"Content-Type": "application/json"},
+              json.dumps(payload).encode())
+
+  def handle_auth(self, body):
+    data = json.loads(body or b"{}")
+    userid, token = login(data.get("username", ""))
+    if token is None:
+      self.send_json(401, {"message": "no such user..."})
+    else:
+      self.send_json(200, {"access_token": token, "userid": userid})
+
+  def handle_any(self):
+    start = time.perf_counter()
+
+    url = urlsplit(self.path)
+    length = int(self.headers.get("Content-Length") or 0)
+    body = self.rfile.read(length) if length > 0 else b""
+
+    if url.path == "/auth" and self.command == "POST":
+      self.handle_auth(body)
+      return
+
+    headers = dict(self.headers.items())
+
+    userid = token_userid(headers)
+    if userid is False:
+      self.send_json(401, {"message": "unauthorized"})
+      return
+
+    event = build_event(self.command, url.path, url.query, headers, body,
+                        userid)
+
+    response, pid, cold = self.pool.submit(invoke, event).result()
+
+    status = response.get("statusCode", 200)
+    out = response.get("body") or ""
+    if response.get("isBase64Encoded"):
+      out = base64.b64decode(out)
+    else:
+      out = out.encode()
+
+    self.send(status, response.get("headers") or {}, out)
+
+    ms = (time.perf_counter() - start) * 1000
+    print(f"GATEWAY {self.command} {self.path} {status} {ms:.1f}ms "
+          f"worker={pid} cold={str(cold).lower()}", file=sys.stderr)
+
+  do_GET = handle_any
+  do_POST = handle_any
+  do_PUT = handle_any
+  do_DELETE = handle_any
+
+  def log_message(self, format, *args):
+    pass  # one GATEWAY line per request instead
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Serve the /final_* routes locally, like API Gateway")
+  parser.add_argument("--config", default="config.ini",
+                      help="config file for the handlers ([rds], [s3])")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8080)
+  parser.add_argument("--workers", type=int, default=4,
+                      help="most requests handled at once (lambda containers)")
+  parser.add_argument("--cold-start-ms", type=float, default=0.0,
+                      help="extra delay on each worker's first request")
+  parser.add_argument("--quiet", action="store_true",
+                      help="drop the handlers' own output (for load tests)")
+  args = parser.parse_args()
+
+  config_file = os.path.abspath(args.config)
+
+  sys.path.insert(0, shared_dir)
+  sys.path.insert(0, repo_root)
+
+  import runtime
+  runtime.config_file = config_file
+
+  GatewayHandler.pool = ProcessPoolExecutor(
+    max_workers=args.workers,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=init_worker,
+    initargs=(config_file, args.cold_start_ms, args.quiet))
+
+  server = ThreadingHTTPServer((args.host, args.port), GatewayHandler)
+  print(f"gateway on http://{args.host}:{args.port}, "
+        f"{args.workers} workers", file=sys.stderr)
+
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    GatewayHandler.pool.shutdown()
+
+
+if __name__ == "__main__":
+  main()
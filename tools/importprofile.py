@@ -0,0 +1,242 @@
+#
+# Import-time profile of each lambda handler.
+#
+# Runs "python -X importtime -c 'import lambda_function'" in a fresh
+# interpreter for every final_* directory (the same import a cold
+# start performs) and reports, per handler, the total import cost and
+# which modules it comes from. Run it locally before deploying to
+# catch a handler that has started pulling in something heavy:
+#
+#   python tools/importprofile.py
+#   python tools/importprofile.py --runs 5 --top 15
+#   python tools/importprofile.py --json > imports.json
+#   python tools/importprofile.py --budget-ms 150   # exit 1 if over
+#
+# The handlers' shared modules (datatier.py, runtime.py, ...) are
+# found in shared/, which is put on PYTHONPATH; point --path at the
+# directory holding pymysql if that is not installed in this python.
+#
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+shared_dir = os.path.join(repo_root, "shared")
+
+
+def find_handlers():
+  """
+  Returns the names of the final_* directories holding a handler
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  sorted list of directory names
+  """
+
+  names = []
+  for name in os.listdir(repo_root):
+    if not name.startswith("final_"):
+      continue
+    if os.path.isfile(os.path.join(repo_root, name, "lambda_function.py")):
+      names.append(name)
+  return sorted(names)
+
+
+def parse_importtime(stderr):
+  """
+  Parses the output of -X importtime into a list of entries
+
+  Parameters
+  ----------
+  stderr: text written by python -X importtime
+
+  Returns
+  -------
+  list of (module, depth, self_us, cumulative_us), in the order
+  python printed them (children before their parent)
+  """
+
+  entries = []
+  for line in stderr.splitlines():
+    if not line.startswith("import time:"):
+      continue
+    fields = line[len("import time:"):].split("|")
+    if len(fields) != 3 or not fields[0].strip().isdigit():
+      continue  # the header line
+
+    name_field = fields[2][1:]  # one space always follows the bar
+    depth = (len(name_field) - len(name_field.lstrip())) // 2
+    entries.append((name_field.strip(), depth, int(fields[0]),
+                    int(fields[1])))
+  return entries
+
+
+def profile_once(name, extra_path):
+  """
+  Imports one handler in a fresh interpreter and returns the entries
+  for lambda_function and everything it pulled in
+
+  Parameters
+  ----------
+  name: handler directory, e.g. "final_like"
+  extra_path: extra directories to put on PYTHONPATH
+
+  Returns
+  -------
+  list of (module, depth, self_us, cumulative_us); the last entry is
+  lambda_function itself
+  """
+
+  env = dict(os.environ)
+  path = [shared_dir, repo_root] + extra_path
+  if env.get("PYTHONPATH"):
+    path.append(env["PYTHONPATH"])
+  env["PYTHONPATH"] = os.pathsep.join(path)
+
+  proc = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", "import lambda_function"],
+    cwd=os.path.join(repo_root, name),
+    env=env,
+    capture_output=True,
+    text=True)
+
+  if proc.returncode != 0:
+    message = proc.stderr.strip().splitlines()[-1] if proc.stderr else "?"
+    raise Exception(name + ": import failed: " + message)
+
+  entries = parse_importtime(proc.stderr)
+
+  #
+  # the handler's subtree is the run of deeper entries just before
+  # the top-level lambda_function line:
+  #
+  for end in range(len(entries) - 1, -1, -1):
+    if entries[end][0] == "lambda_function" and entries[end][1] == 0:
+      break
+  else:
+    raise Exception(name + ": lambda_function missing from importtime")
+
+  start = end
+  while start > 0 and entries[start - 1][1] > 0:
+    start -= 1
+
+  return entries[start:end + 1]
+
+
+def profile(name, runs, extra_path):
+  """
+  Profiles one handler several times, keeping the fastest time seen
+  for each module to filter out noise
+
+  Parameters
+  ----------
+  name: handler directory
+  runs: number of fresh interpreters to try
+  extra_path: extra directories to put on PYTHONPATH
+
+  Returns
+  -------
+  dict with the handler's total, its direct imports and every module
+  it loaded, times in milliseconds
+  """
+
+  best = {}
+  for _ in range(runs):
+    for module, depth, self_us, cum_us in profile_once(name, extra_path):
+      if module not in best:
+        best[module] = [depth, self_us, cum_us]
+      else:
+        best[module][1] = min(best[module][1], self_us)
+        best[module][2] = min(best[module][2], cum_us)
+
+  def ms(us):
+    return round(us / 1000, 3)
+
+  total = best.pop("lambda_function")
+  modules = [{"module": m, "self_ms": ms(v[1]), "cumulative_ms": ms(v[2])}
+             for m, v in best.items()]
+  direct = [m for m in modules if best[m["module"]][0] == 1]
+
+  return {
+    "handler": name,
+    "total_ms": ms(total[2]),
+    "own_ms": ms(total[1]),
+    "direct": sorted(direct, key=lambda m: -m["cumulative_ms"]),
+    "modules": sorted(modules, key=lambda m: -m["self_ms"])
+  }
+
+
+def print_report(results, top):
+  """
+  Prints the profiles as a table per handler
+
+  Parameters
+  ----------
+  results: list of profile() results
+  top: how many of the most expensive modules to list
+
+  Returns
+  -------
+  nothing
+  """
+
+  print("handler               total ms   modules")
+  for r in results:
+    print(f"{r['handler']:<20} {r['total_ms']:>9.1f}   {len(r['modules'])}")
+
+  for r in results:
+    print()
+    print(f"** {r['handler']}: {r['total_ms']:.1f} ms")
+    print("   direct imports (cumulative ms):")
+    for m in r["direct"]:
+      print(f"     {m['cumulative_ms']:>9.1f}  {m['module']}")
+    print(f"   top {top} modules by own time (ms):")
+    for m in r["modules"][:top]:
+      print(f"     {m['self_ms']:>9.1f}  {m['module']}")
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Import-time profile of each lambda handler")
+  parser.add_argument("handlers", nargs="*",
+                      help="handler directories (default: all final_*)")
+  parser.add_argument("--runs", type=int, default=3,
+                      help="fresh interpreters per handler, fastest wins")
+  parser.add_argument("--top", type=int, default=10,
+                      help="modules to list per handler")
+  parser.add_argument("--path", action="append", default=[],
+                      help="extra directory for PYTHONPATH (e.g. pymysql)")
+  parser.add_argument("--json", action="store_true",
+                      help="write the results as JSON")
+  parser.add_argument("--budget-ms", type=float, default=None,
+                      help="exit with status 1 if any handler is slower")
+  args = parser.parse_args()
+
+  names = args.handlers or find_handlers()
+  extra_path = [os.path.abspath(p) for p in args.path]
+
+  results = [profile(name, args.runs, extra_path) for name in names]
+
+  if args.json:
+    print(json.dumps(results, indent=2))
+  else:
+    print_report(results, args.top)
+
+  if args.budget_ms is not None:
+    over = [r for r in results if r["total_ms"] > args.budget_ms]
+    for r in over:
+      print(f"**OVER BUDGET: {r['handler']} {r['total_ms']:.1f} ms > "
+            f"{args.budget_ms:.1f} ms", file=sys.stderr)
+    if over:
+      sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
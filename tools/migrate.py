@@ -0,0 +1,207 @@
+#
+# Applies the schema migrations in schema/ to the database in the
+# given config file.
+#
+# Migrations are the files schema/NNNN_name.sql, applied in order of
+# their number. Each one applied is recorded in the schema_migrations
+# table, so running this again only applies the new ones:
+#
+#   python tools/migrate.py --config config.ini            # apply all new
+#   python tools/migrate.py --config config.ini --status   # list, apply none
+#   python tools/migrate.py --config config.ini --dry-run  # print the SQL
+#
+# --dry-run changes nothing, not even creating schema_migrations.
+#
+# A database that already has a migration's changes (e.g. one that
+# was applied by hand) can be brought in line with
+#
+#   python tools/migrate.py --config config.ini --mark-applied 2
+#
+# MySQL commits DDL statement by statement, so a migration that fails
+# part way is not rolled back: fix the cause, undo or finish what
+# was done, and run again.
+#
+
+import argparse
+import os
+import re
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, "shared"))
+sys.path.insert(0, repo_root)
+
+import datatier
+import runtime
+
+schema_dir = os.path.join(repo_root, "schema")
+
+
+def find_migrations():
+  """
+  Returns the migrations in schema/, in order
+
+  Parameters
+  ----------
+  None
+
+  Returns
+  -------
+  list of (version, name, path), e.g. (2, "asset_counters", ...)
+  """
+
+  found = []
+  for filename in os.listdir(schema_dir):
+    m = re.match(r"^(\d+)_(\w+)\.sql$", filename)
+    if m is None:
+      continue
+    found.append((int(m.group(1)), m.group(2),
+                  os.path.join(schema_dir, filename)))
+
+  found.sort()
+
+  versions = [version for (version, name, path) in found]
+  if len(set(versions)) != len(versions):
+    raise Exception("two migrations share a number")
+
+  return found
+
+
+def split_statements(text):
+  """
+  Splits a migration into its statements. -- comments are dropped;
+  statements end with a ; (the migrations don't put ; or -- inside
+  string literals)
+
+  Parameters
+  ----------
+  text: contents of a migration file
+
+  Returns
+  -------
+  list of statements, without their ;
+  """
+
+  lines = [line.split("--", 1)[0] for line in text.splitlines()]
+
+  statements = []
+  for statement in "\n".join(lines).split(";"):
+    statement = statement.strip()
+    if statement != "":
+      statements.append(statement)
+
+  return statements
+
+
+def get_applied(dbConn, create=True):
+  """
+  Returns the versions already applied, creating the
+  schema_migrations table on first use
+
+  Parameters
+  ----------
+  dbConn: database connection
+  create: False to leave the schema alone (--dry-run), treating a
+    missing schema_migrations table as nothing applied
+
+  Returns
+  -------
+  set of version numbers
+  """
+
+  if not create:
+    row = datatier.retrieve_one_row(dbConn, """
+    SELECT COUNT(*) FROM information_schema.tables
+     WHERE table_schema = DATABASE() AND table_name = 'schema_migrations';
+    """)
+    if row[0] == 0:
+      return set()
+  else:
+    datatier.perform_action(dbConn, """
+    CREATE TABLE IF NOT EXISTS schema_migrations
+    (
+      version      int not null,
+      name         varchar(128) not null,
+      applied_at   timestamp not null default CURRENT_TIMESTAMP,
+      PRIMARY KEY  (version)
+    );
+    """)
+
+  rows = datatier.retrieve_all_rows(dbConn,
+                                    "SELECT version FROM schema_migrations;")
+  return set(row[0] for row in rows)
+
+
+def record(dbConn, version, name):
+  datatier.perform_action(dbConn, """
+  INSERT INTO schema_migrations (version, name) VALUES (%s, %s);
+  """, [version, name])
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Apply the schema/ migrations")
+  parser.add_argument("--config", default="config.ini",
+                      help="config file with the [rds] section to use")
+  parser.add_argument("--status", action="store_true",
+                      help="list the migrations and whether each is applied")
+  parser.add_argument("--dry-run", action="store_true",
+                      help="print the statements that would run")
+  parser.add_argument("--mark-applied", type=int, action="append",
+                      default=[], metavar="VERSION",
+                      help="record a migration as applied without running it")
+  args = parser.parse_args()
+
+  runtime.config_file = args.config
+  dbConn = runtime.get_dbConn()
+
+  migrations = find_migrations()
+  applied = get_applied(dbConn, create=not args.dry_run)
+
+  if args.mark_applied:
+    known = dict((version, name) for (version, name, path) in migrations)
+    for version in args.mark_applied:
+      if version not in known:
+        print("**ERROR: no migration", version)
+        sys.exit(1)
+      if version not in applied:
+        if args.dry_run:
+          print(f"would mark {version:04d}_{known[version]} as applied")
+          continue
+        record(dbConn, version, known[version])
+        print(f"marked {version:04d}_{known[version]} as applied")
+    return
+
+  if args.status:
+    for (version, name, path) in migrations:
+      state = "applied" if version in applied else "pending"
+      print(f"{version:04d}_{name:<32} {state}")
+    return
+
+  pending = [m for m in migrations if m[0] not in applied]
+
+  if len(pending) == 0:
+    print("up to date")
+    return
+
+  for (version, name, path) in pending:
+    with open(path) as f:
+      statements = split_statements(f.read())
+
+    print(f"**Applying {version:04d}_{name} ({len(statements)} statements)**")
+
+    for statement in statements:
+      if args.dry_run:
+        print(statement + ";")
+        print()
+        continue
+      datatier.perform_action(dbConn, statement)
+
+    if not args.dry_run:
+      record(dbConn, version, name)
+
+  print("done")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,365 @@
+#
+# Synthetic dataset generator for benchmarking.
+#
+# Bulk-loads users, assets, likes and comments into the database in
+# the given config file (a local MySQL with the schema/ migrations
+# applied, never RDS), and puts a matching object in the S3 bucket
+# for every asset, at bucketfolder/uuid.jpg. Point [s3] endpoint_url
+# in the config file at a local S3 stand-in (e.g. MinIO) for that.
+#
+# Popularity is Zipfian: with exponent s, the k'th most popular item
+# is picked in proportion to 1/k^s, so a few assets collect most of
+# the likes and comments and a few users own most of the assets.
+# Which assets and users are the popular ones is shuffled, not just
+# the lowest ids. Private assets are only liked and commented on by
+# their owner, as the API would allow.
+#
+# The same --seed gives the same data, so runs are reproducible:
+#
+#   python tools/seed.py --config local.ini --reset
+#   python tools/seed.py --config local.ini --reset --users 100000 \
+#     --assets 1000000 --likes 5000000 --comments 1000000 --zipf 1.2 \
+#     --manifest bench/fixture.json
+#
+# Rows go in with multi-row INSERTs (datatier.perform_many), in
+# batches of --batch rows.
+#
+
+import argparse
+import bisect
+import itertools
+import json
+import os
+import sys
+import time
+import uuid
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, "shared"))
+sys.path.insert(0, repo_root)
+
+import datatier
+import runtime
+
+#
+# a 1x1 JPEG; objects bigger than this are padded after the end of
+# image marker, which image readers ignore:
+#
+tiny_jpeg = bytes.fromhex(
+  "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707"
+  "070909080a0c140d0c0b0b0c1912130f141d1a1f1e1d1a1c1c20242e2720222c231c"
+  "1c2837292c30313434341f27393d38323c2e333432ffc0000b080001000101011100"
+  "ffc4001f0000010501010101010100000000000000000102030405060708090a0bff"
+  "c400b5100002010303020403050504040000017d01020300041105122131410613"
+  "516107227114328191a1082342b1c11552d1f02433627282090a161718191a2526"
+  "2728292a3435363738393a434445464748494a535455565758595a636465666768"
+  "696a737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7"
+  "a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3"
+  "e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9")
+
+words = ["nice", "love", "this", "great", "shot", "wow", "the", "light",
+         "colors", "amazing", "where", "is", "that", "so", "good", "cool",
+         "photo", "again", "more", "please"]
+
+
+def zipf_sampler(n, s, rng):
+  """
+  Returns a function that picks one of n items with Zipfian
+  popularity
+
+  Parameters
+  ----------
+  n: number of items
+  s: exponent; 0 is uniform, higher is more skewed
+  rng: random.Random to draw from
+
+  Returns
+  -------
+  function returning an index 0 <= i < n
+  """
+
+  cdf = list(itertools.accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+  total = cdf[-1]
+
+  # popularity rank => item, so the hot items are spread out:
+  order = list(range(n))
+  rng.shuffle(order)
+
+  def sample():
+    return order[bisect.bisect_left(cdf, rng.random() * total)]
+
+  return sample
+
+
+def make_uuid(rng):
+  return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def insert_batches(dbConn, sql, rows, batch, what):
+  """
+  Inserts rows with multi-row INSERTs of at most batch rows
+
+  Parameters
+  ----------
+  dbConn: database connection
+  sql: INSERT ... VALUES (%s, ...) statement
+  rows: iterable of parameter lists
+  batch: rows per INSERT
+  what: name for progress messages, e.g. "likes"
+
+  Returns
+  -------
+  # of rows inserted
+  """
+
+  total = 0
+  start = time.perf_counter()
+  it = iter(rows)
+
+  while True:
+    chunk = list(itertools.islice(it, batch))
+    if len(chunk) == 0:
+      break
+    datatier.perform_many(dbConn, sql, chunk)
+    total += len(chunk)
+    print(f"  {what}: {total}", file=sys.stderr, end="\r")
+
+  secs = time.perf_counter() - start
+  print(f"  {what}: {total} in {secs:.1f}s ({total / max(secs, 1e-9):.0f}/s)",
+        file=sys.stderr)
+  return total
+
+
+def reset(dbConn):
+  """
+  Empties the tables the generator fills
+  """
+
+  datatier.perform_action(dbConn, "SET FOREIGN_KEY_CHECKS = 0;")
+  try:
+    for table in ["asset_like_shards", "likes", "comments", "assets", "users"]:
+      datatier.perform_action(dbConn, f"TRUNCATE TABLE {table};")
+  finally:
+    datatier.perform_action(dbConn, "SET FOREIGN_KEY_CHECKS = 1;")
+
+
+def next_id(dbConn, table, column):
+  row = datatier.retrieve_one_row(dbConn,
+                                  f"SELECT COALESCE(MAX({column}), 0) FROM {table};")
+  return row[0] + 1
+
+
+def upload_objects(bucketkeys, size, threads):
+  """
+  Puts an object in the bucket for every bucketkey
+
+  Parameters
+  ----------
+  bucketkeys: keys to create
+  size: bytes per object (at least the size of a 1x1 JPEG)
+  threads: uploads in flight at once
+
+  Returns
+  -------
+  # of objects uploaded
+  """
+
+  body = tiny_jpeg + b"\0" * max(0, size - len(tiny_jpeg))
+
+  bucket = runtime.get_bucket('s3readwrite')
+  client = bucket.meta.client
+
+  def put(bucketkey):
+    client.put_object(Bucket=bucket.name, Key=bucketkey, Body=body,
+                      ContentType='image/jpeg')
+
+  done = 0
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=threads) as pool:
+    for _ in pool.map(put, bucketkeys):
+      done += 1
+      if done % 1000 == 0:
+        print(f"  objects: {done}", file=sys.stderr, end="\r")
+
+  secs = time.perf_counter() - start
+  print(f"  objects: {done} in {secs:.1f}s", file=sys.stderr)
+  return done
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Fill a local database and bucket with synthetic data")
+  parser.add_argument("--config", default="config.ini",
+                      help="config file with the [rds] and [s3] sections")
+  parser.add_argument("--users", type=int, default=1000)
+  parser.add_argument("--assets", type=int, default=10000)
+  parser.add_argument("--likes", type=int, default=100000)
+  parser.add_argument("--comments", type=int, default=20000)
+  parser.add_argument("--zipf", type=float, default=1.1,
+                      help="skew of like/comment popularity per asset")
+  parser.add_argument("--owner-zipf", type=float, default=0.8,
+                      help="skew of asset ownership and activity per user")
+  parser.add_argument("--public", type=float, default=0.7,
+                      help="fraction of assets that are public")
+  parser.add_argument("--seed", type=int, default=310)
+  parser.add_argument("--batch", type=int, default=5000,
+                      help="rows per multi-row INSERT")
+  parser.add_argument("--reset", action="store_true",
+                      help="empty the tables first")
+  parser.add_argument("--no-objects", action="store_true",
+                      help="don't put objects in the bucket")
+  parser.add_argument("--object-size", type=int, default=len(tiny_jpeg))
+  parser.add_argument("--upload-threads", type=int, default=16)
+  parser.add_argument("--manifest", default=None,
+                      help="write a JSON description of the data here")
+  args = parser.parse_args()
+
+  rng = Random(args.seed)
+
+  runtime.config_file = args.config
+  dbConn = runtime.get_dbConn()
+
+  if args.reset:
+    print("**Emptying tables**", file=sys.stderr)
+    reset(dbConn)
+
+  first_userid = next_id(dbConn, "users", "userid")
+  first_assetid = next_id(dbConn, "assets", "assetid")
+
+  #
+  # users:
+  #
+  print("**Users**", file=sys.stderr)
+
+  folders = [make_uuid(rng) for i in range(args.users)]
+
+  def user_rows():
+    for i in range(args.users):
+      userid = first_userid + i
+      yield [userid, f"seed{userid}@example.com", f"Last{userid}",
+             f"First{userid}", folders[i], f"seed{userid}", ""]
+
+  insert_batches(dbConn, """
+    INSERT INTO users (userid, email, lastname, firstname, bucketfolder,
+                       username, pwdhash)
+                VALUES (%s, %s, %s, %s, %s, %s, %s);
+    """, user_rows(), args.batch, "users")
+
+  #
+  # who owns each asset, and which are public; then the likes and
+  # comments, so the assets can be inserted with their counts:
+  #
+  print("**Planning assets, likes and comments**", file=sys.stderr)
+
+  pick_user = zipf_sampler(args.users, args.owner_zipf, rng)
+  pick_asset = zipf_sampler(args.assets, args.zipf, rng)
+
+  owners = array("i", (pick_user() for i in range(args.assets)))
+  public = array("b", (rng.random() < args.public for i in range(args.assets)))
+
+  def pick_actor(a):
+    return pick_user() if public[a] else owners[a]
+
+  like_assets = array("i", (pick_asset() for i in range(args.likes)))
+  like_users = array("i", (pick_actor(a) for a in like_assets))
+
+  comment_assets = array("i", (pick_asset() for i in range(args.comments)))
+  comment_users = array("i", (pick_actor(a) for a in comment_assets))
+
+  like_counts = array("i", bytes(4 * args.assets))
+  for a in like_assets:
+    like_counts[a] += 1
+  comment_counts = array("i", bytes(4 * args.assets))
+  for a in comment_assets:
+    comment_counts[a] += 1
+
+  bucketkeys = [folders[owners[a]] + "/" + make_uuid(rng) + ".jpg"
+                for a in range(args.assets)]
+
+  #
+  # assets, likes, comments:
+  #
+  print("**Assets**", file=sys.stderr)
+
+  def asset_rows():
+    for a in range(args.assets):
+      yield [first_assetid + a, first_userid + owners[a], f"img{a}.jpg",
+             bucketkeys[a], "public" if public[a] else "private",
+             like_counts[a], comment_counts[a]]
+
+  insert_batches(dbConn, """
+    INSERT INTO assets (assetid, userid, assetname, bucketkey, assettype,
+                        like_count, comment_count)
+                VALUES (%s, %s, %s, %s, %s, %s, %s);
+    """, asset_rows(), args.batch, "assets")
+
+  print("**Likes**", file=sys.stderr)
+
+  def like_rows():
+    for i in range(args.likes):
+      yield [first_userid + like_users[i], first_assetid + like_assets[i]]
+
+  insert_batches(dbConn, """
+    INSERT INTO likes (userid, assetid) VALUES (%s, %s);
+    """, like_rows(), args.batch, "likes")
+
+  print("**Comments**", file=sys.stderr)
+
+  def comment_rows():
+    for i in range(args.comments):
+      body = " ".join(rng.choice(words) for w in range(rng.randint(1, 20)))
+      yield [first_userid + comment_users[i],
+             first_assetid + comment_assets[i], body]
+
+  insert_batches(dbConn, """
+    INSERT INTO comments (userid, assetid, comment_body) VALUES (%s, %s, %s);
+    """, comment_rows(), args.batch, "comments")
+
+  if not args.no_objects:
+    print("**Objects**", file=sys.stderr)
+    upload_objects(bucketkeys, args.object_size, args.upload_threads)
+
+  datatier.retrieve_all_rows(dbConn,
+                             "ANALYZE TABLE users, assets, likes, comments;")
+
+  #
+  # what was made, for the benchmarks to pick their targets from:
+  #
+  by_likes = sorted(range(args.assets), key=lambda a: -like_counts[a])
+  by_assets = {}
+  for owner in owners:
+    by_assets[owner] = by_assets.get(owner, 0) + 1
+
+  manifest = {
+    "seed": args.seed,
+    "zipf": args.zipf,
+    "owner_zipf": args.owner_zipf,
+    "users": {"first": first_userid, "count": args.users},
+    "assets": {"first": first_assetid, "count": args.assets,
+               "public": sum(public)},
+    "likes": args.likes,
+    "comments": args.comments,
+    "objects": 0 if args.no_objects else args.assets,
+    "hot_assets": [{"assetid": first_assetid + a,
+                    "userid": first_userid + owners[a],
+                    "public": bool(public[a]),
+                    "likes": like_counts[a],
+                    "comments": comment_counts[a]} for a in by_likes[:10]],
+    "heavy_users": [{"userid": first_userid + u, "assets": n}
+                    for u, n in sorted(by_assets.items(),
+                                       key=lambda item: -item[1])[:10]]
+  }
+
+  text = json.dumps(manifest, indent=2)
+  if args.manifest:
+    with open(args.manifest, "w") as f:
+      f.write(text + "\n")
+  print(text)
+
+
+if __name__ == "__main__":
+  main()